@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -39,17 +40,21 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework.authtoken',
-    'core',
+    'core.apps.CoreConfig',
     'user',
-    'pins',
+    'pins.apps.PinsConfig',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfileMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,6 +93,105 @@ DATABASES = {
     }
 }
 
+# Read replicas
+#
+# Every host in DB_REPLICA_HOSTS gets a replica alias, and safe requests to
+# REPLICA_READ_VIEWS read from one of them (see core.middleware). To try
+# it locally, add SQLite or Postgres aliases to DATABASES and list them in
+# DATABASE_REPLICAS. Stickiness after writes and replica outages are kept
+# in REPLICA_CACHE, which every worker must share for clients to read their
+# own writes. It defaults to files on disk; point it at memcached when the
+# workers run on several hosts.
+
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+    filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+REPLICA_READ_VIEWS = [
+    'pins.views.PinViewSet',
+    'pins.views.TagViewSet',
+    'user.views.ManageUserView',
+]
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+REPLICA_CACHE = 'replicas'
+
+
+# Django REST framework
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# The responses cache holds serialized pin and tag lists. The local memory
+# backend evicts least recently used entries past MAX_ENTRIES; point it at
+# a file based or memcached backend when running several workers.
+#
+# The tiles cache holds encoded map tiles. It defaults to files on disk so
+# that every worker on a host sees the same tiles and invalidations.
+#
+# The replicas cache holds the read replica state (see Read replicas).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.environ.get(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_LOCATION', 'responses'),
+        'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)
+            ),
+        },
+    },
+    'replicas': {
+        'BACKEND': os.environ.get(
+            'REPLICA_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.environ.get(
+            'REPLICA_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'pin-replicas')
+        ),
+    },
+    'tiles': {
+        'BACKEND': os.environ.get(
+            'TILE_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.environ.get(
+            'TILE_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'pin-tiles')
+        ),
+        'TIMEOUT': int(os.environ.get('TILE_CACHE_TIMEOUT', 86400)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.environ.get('TILE_CACHE_MAX_ENTRIES', 100000)
+            ),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -132,3 +236,35 @@ MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
 AUTH_USER_MODEL = 'core.user'
+
+# Worker processes rendering pin image variants, 0 renders them inline
+PIN_IMAGE_WORKERS = int(os.environ.get('PIN_IMAGE_WORKERS', 2))
+
+# Where parts of resumable image uploads are assembled, and the largest
+# image accepted that way
+PIN_UPLOAD_DIR = os.environ.get(
+    'PIN_UPLOAD_DIR',
+    os.path.join(tempfile.gettempdir(), 'pin-uploads')
+)
+PIN_UPLOAD_MAX_SIZE = int(os.environ.get('PIN_UPLOAD_MAX_SIZE', 50 * 2**20))
+
+# Request metrics are served at /api/metrics/ to staff tokens. With several
+# worker processes, point METRICS_DIR at a directory they share and clear
+# it when the server starts (see core.metrics).
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+
+# Staff users get a request profiled by adding ?profile=1 or an X-Profile
+# header; the newest REQUEST_PROFILES_KEPT profiles are kept for download
+# from the admin.
+REQUEST_PROFILES_KEPT = int(os.environ.get('REQUEST_PROFILES_KEPT', 100))
+
+# Queries of requests running for SLOW_QUERY_SECONDS or longer are logged
+# with their plan, browsable in the admin; an empty value turns the log
+# off. SLOW_QUERY_EXPLAIN_ANALYZE runs slow SELECTs again under EXPLAIN
+# ANALYZE on PostgreSQL. Only the newest SLOW_QUERY_LOG_SIZE are kept.
+SLOW_QUERY_SECONDS = os.environ.get('SLOW_QUERY_SECONDS', '0.5')
+SLOW_QUERY_SECONDS = float(SLOW_QUERY_SECONDS) if SLOW_QUERY_SECONDS else None
+SLOW_QUERY_EXPLAIN_ANALYZE = \
+    os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', '') == '1'
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 500))
@@ -18,8 +18,12 @@ from django.urls import path, include
 
 from django.conf.urls.static import static
 from django.conf import settings
+
+from core.views import MetricsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/users/', include('user.urls')),
     path('api/pins/', include('pins.urls')),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
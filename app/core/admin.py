@@ -1,8 +1,12 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from django.utils.translation import gettext as _
 
-from core import models
+from core import models, profiling
 
 
 class UserAdmin(BaseUserAdmin):
@@ -31,6 +35,83 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        'created', 'method', 'path', 'status', 'user', 'total_seconds',
+        'auth_seconds', 'queryset_seconds', 'serializer_seconds',
+        'render_seconds',
+    ]
+    list_filter = ['method', 'status']
+    fields = [
+        'created', 'user', 'method', 'path', 'status', 'total_seconds',
+        'auth_seconds', 'queryset_seconds', 'serializer_seconds',
+        'render_seconds', 'download', 'report',
+    ]
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='core_requestprofile_download',
+            ),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        """Return the statistics as a file pstats can load"""
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(models.RequestProfile, pk=pk)
+        response = HttpResponse(
+            bytes(profile.stats), content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = \
+            f'attachment; filename="profile-{profile.pk}.prof"'
+        return response
+
+    def download(self, obj):
+        return format_html(
+            '<a href="{}">profile-{}.prof</a>',
+            reverse('admin:core_requestprofile_download', args=[obj.pk]),
+            obj.pk,
+        )
+
+    def report(self, obj):
+        return format_html('<pre>{}</pre>', profiling.report(obj.stats))
+
+
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['created', 'seconds', 'view', 'serializer', 'path']
+    list_filter = ['view', 'alias']
+    search_fields = ['sql', 'path']
+    fields = [
+        'created', 'alias', 'seconds', 'path', 'view', 'serializer',
+        'location', 'query', 'params', 'plan',
+    ]
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def query(self, obj):
+        return format_html('<pre>{}</pre>', obj.sql)
+
+    def plan(self, obj):
+        return format_html('<pre>{}</pre>', obj.explain)
+
+
 admin.site.register(models.User, UserAdmin)
 admin.site.register(models.Tag)
 admin.site.register(models.Pin)
+admin.site.register(models.RequestProfile, RequestProfileAdmin)
+admin.site.register(models.SlowQuery, SlowQueryAdmin)
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_replica_cache(app_configs, **kwargs):
+    """Warn when read replicas keep their state in one process"""
+    backend = settings.CACHES.get(settings.REPLICA_CACHE, {}).get('BACKEND')
+    if settings.DATABASE_REPLICAS and backend in LOCAL_CACHES:
+        return [Warning(
+            'REPLICA_CACHE uses a local memory cache, so under several '
+            'workers clients may not read their own writes.',
+            hint='Point REPLICA_CACHE at a cache shared by the workers.',
+            id='core.W001',
+        )]
+    return []
@@ -0,0 +1,158 @@
+"""Geohash helpers for indexing and querying pin locations
+
+A geohash interleaves longitude and latitude bits and writes them in
+base32, so every prefix names a rectangular cell and the hashes of the
+points inside a cell share that prefix. Stored hashes can therefore be
+searched with plain B-tree range scans on any database.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 9
+MAX_CELLS = 32
+CLUSTER_LENGTHS = range(1, 9)
+EARTH_RADIUS = 6371008.8
+
+
+def encode(latitude, longitude, length=GEOHASH_LENGTH):
+    """Return the geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    use_lon = True
+    while len(chars) < length:
+        value, bounds = (
+            (longitude, lon_range) if use_lon else (latitude, lat_range)
+        )
+        mid = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        use_lon = not use_lon
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Return the great circle distance between two points in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2 +
+        math.cos(phi1) * math.cos(phi2) *
+        math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_around(latitude, longitude, radius):
+    """Return a (min_lon, min_lat, max_lon, max_lat) box holding a circle
+
+    The circle is given by its center and radius in meters. Boxes that
+    cross the antimeridian have min_lon greater than max_lon.
+    """
+    angle = radius / EARTH_RADIUS
+    min_lat = max(-90.0, latitude - math.degrees(angle))
+    max_lat = min(90.0, latitude + math.degrees(angle))
+    cos_lat = math.cos(math.radians(latitude))
+    if min_lat == -90.0 or max_lat == 90.0 or math.sin(angle) >= cos_lat:
+        return -180.0, min_lat, 180.0, max_lat
+
+    spread = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    min_lon = longitude - spread
+    max_lon = longitude + spread
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def cell_size(length):
+    """Return the (height, width) in degrees of a geohash cell"""
+    lat_bits = 5 * length // 2
+    lon_bits = 5 * length - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cluster_length(zoom):
+    """Return the geohash length of the clusters shown at a zoom level
+
+    Picks cells at most a quarter of a 256 pixel map tile wide, so a
+    screen full of tiles shows a few hundred clusters.
+    """
+    for length in CLUSTER_LENGTHS:
+        if cell_size(length)[1] <= 360.0 / 2 ** (zoom + 2):
+            return length
+    return CLUSTER_LENGTHS[-1]
+
+
+def covering_cells(min_lon, min_lat, max_lon, max_lat,
+                   max_cells=MAX_CELLS, max_length=GEOHASH_LENGTH):
+    """Return the geohash prefixes of the cells covering a bounding box
+
+    Uses the longest prefixes, up to `max_length`, for which at most
+    `max_cells` cells are needed, so the cells hug the box as tightly as
+    the budget allows. The box must not cross the antimeridian.
+    """
+    cells = None
+    for length in range(1, max_length + 1):
+        height, width = cell_size(length)
+        rows = _cell_span(min_lat + 90, max_lat + 90, height, 180)
+        columns = _cell_span(min_lon + 180, max_lon + 180, width, 360)
+        if cells is not None and len(rows) * len(columns) > max_cells:
+            break
+        cells = [
+            encode(
+                (row + 0.5) * height - 90,
+                (column + 0.5) * width - 180,
+                length,
+            )
+            for row in rows for column in columns
+        ]
+    return cells
+
+
+def _cell_span(low, high, size, total):
+    last = int(total / size) - 1
+    return range(
+        min(int(math.floor(low / size)), last),
+        min(int(math.floor(high / size)), last) + 1,
+    )
+
+
+def prefix_ranges(prefixes):
+    """Return merged [low, high) hash ranges matching any of the prefixes
+
+    `high` is None when a range runs to the end of the key space.
+    """
+    ranges = []
+    for prefix in sorted(prefixes):
+        low, high = prefix, _next_prefix(prefix)
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] >= low:
+            ranges[-1] = (ranges[-1][0], _max_bound(ranges[-1][1], high))
+        else:
+            ranges.append((low, high))
+    return ranges
+
+
+def _next_prefix(prefix):
+    """Return the smallest hash sorting after every hash with the prefix"""
+    prefix = prefix.rstrip(BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def _max_bound(first, second):
+    if first is None or second is None:
+        return None
+    return max(first, second)
@@ -0,0 +1,275 @@
+"""Per endpoint request metrics in the Prometheus text format
+
+Each process aggregates the requests it handles in memory, keyed by the
+resolved URL name and method. When METRICS_DIR is set, processes write
+their totals to a file of their own in it at most every
+METRICS_FLUSH_SECONDS, and a scrape sums the files of every process, so
+any worker can answer for all of them. Files of workers that exited are
+kept so that counters never go back; clear the directory when the server
+starts.
+"""
+import atexit
+import bisect
+import contextlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE')
+UNRESOLVED = 'unresolved'
+
+_sample = ContextVar('metrics_sample', default=None)
+
+
+class Sample:
+    """Database and serialization time of the request being handled
+
+    Instances are installed as execute wrappers on the connections, so
+    every query of the request is counted and timed.
+    """
+    __slots__ = ('queries', 'db_seconds', 'serialization_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def measure():
+    """Collect a Sample of the code run in the block"""
+    sample = Sample()
+    token = _sample.set(sample)
+    try:
+        yield sample
+    finally:
+        _sample.reset(token)
+
+
+@contextlib.contextmanager
+def serializing():
+    """Count the time spent in the block as serialization
+
+    Queries run in the block, such as those of a queryset serialized
+    before it was evaluated, are left to the database time.
+    """
+    sample = _sample.get()
+    if sample is None:
+        yield
+        return
+    start = time.perf_counter()
+    db_seconds = sample.db_seconds
+    try:
+        yield
+    finally:
+        sample.serialization_seconds += (
+            time.perf_counter() - start - (sample.db_seconds - db_seconds)
+        )
+
+
+def _new_stats():
+    return {
+        'statuses': {},
+        'latency': [0] * (len(LATENCY_BUCKETS) + 1),
+        'latency_sum': 0.0,
+        'queries': 0,
+        'db_seconds': 0.0,
+        'serialization_seconds': 0.0,
+        'sizes': [0] * (len(SIZE_BUCKETS) + 1),
+        'size_sum': 0,
+    }
+
+
+def _add(total, stats):
+    """Add the counters of stats to total"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            counts = total.setdefault(key, {})
+            for name, count in value.items():
+                counts[name] = counts.get(name, 0) + count
+        elif isinstance(value, list):
+            total[key] = [a + b for a, b in zip(total[key], value)]
+        else:
+            total[key] += value
+
+
+class Registry:
+    """Request metrics of the current process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._exit_flush = False
+        self._reset()
+
+    def _reset(self):
+        # A forked worker starts empty, under a file name of its own
+        self._pid = os.getpid()
+        self._file_name = f'{self._pid}-{secrets.token_hex(4)}.json'
+        self._endpoints = {}
+        self._flushed = 0.0
+
+    def observe(self, endpoint, method, status, seconds, size, sample):
+        """Record a handled request"""
+        if method not in METHODS:
+            method = 'other'
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset()
+            stats = self._endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self._endpoints[endpoint, method] = _new_stats()
+            status = str(status)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['latency'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats['latency_sum'] += seconds
+            stats['queries'] += sample.queries
+            stats['db_seconds'] += sample.db_seconds
+            stats['serialization_seconds'] += sample.serialization_seconds
+            if size is not None:
+                stats['sizes'][bisect.bisect_left(SIZE_BUCKETS, size)] += 1
+                stats['size_sum'] += size
+        if (
+            settings.METRICS_DIR and
+            time.monotonic() - self._flushed >= settings.METRICS_FLUSH_SECONDS
+        ):
+            self.flush()
+
+    def snapshot(self):
+        """Return the process' metrics as [endpoint, method, stats] lists"""
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset()
+            return json.loads(json.dumps([
+                [endpoint, method, stats]
+                for (endpoint, method), stats in self._endpoints.items()
+            ]))
+
+    def flush(self):
+        """Write the process' metrics to its file in METRICS_DIR"""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        with self._flush_lock:
+            self._flushed = time.monotonic()
+            snapshot = self.snapshot()
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                'w', dir=directory, suffix='.tmp', delete=False
+            ) as out:
+                json.dump(snapshot, out)
+            os.replace(out.name, os.path.join(directory, self._file_name))
+            if not self._exit_flush:
+                self._exit_flush = True
+                atexit.register(self.flush)
+
+    def collect(self):
+        """Return the metrics of every process, keyed by endpoint, method"""
+        if settings.METRICS_DIR:
+            self.flush()
+            snapshots = []
+            for name in os.listdir(settings.METRICS_DIR):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(settings.METRICS_DIR, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        else:
+            snapshots = [self.snapshot()]
+
+        totals = {}
+        for snapshot in snapshots:
+            for endpoint, method, stats in snapshot:
+                total = totals.get((endpoint, method))
+                if total is None:
+                    totals[endpoint, method] = stats
+                else:
+                    _add(total, stats)
+        return totals
+
+    def render(self):
+        """Return the metrics of every process in the Prometheus format"""
+        totals = sorted(self.collect().items())
+        lines = []
+
+        def family(name, kind, text):
+            lines.append(f'# HELP pinmap_{name} {text}')
+            lines.append(f'# TYPE pinmap_{name} {kind}')
+
+        def sample(name, labels, value):
+            text = ','.join(
+                '{}="{}"'.format(label, _escape(value))
+                for label, value in labels.items()
+            )
+            lines.append(f'pinmap_{name}{{{text}}} {value}')
+
+        def histogram(name, buckets, counts_key, sum_key):
+            for (endpoint, method), stats in totals:
+                labels = {'endpoint': endpoint, 'method': method}
+                cumulative = 0
+                for bound, count in zip(
+                    (*buckets, '+Inf'), stats[counts_key]
+                ):
+                    cumulative += count
+                    sample(f'{name}_bucket', {**labels, 'le': bound},
+                           cumulative)
+                sample(f'{name}_sum', labels, stats[sum_key])
+                sample(f'{name}_count', labels, cumulative)
+
+        family('http_requests_total', 'counter', 'Requests handled.')
+        for (endpoint, method), stats in totals:
+            for status, count in sorted(stats['statuses'].items()):
+                sample('http_requests_total', {
+                    'endpoint': endpoint, 'method': method, 'status': status,
+                }, count)
+
+        family('http_request_duration_seconds', 'histogram',
+               'Time from the first to the last middleware.')
+        histogram('http_request_duration_seconds', LATENCY_BUCKETS,
+                  'latency', 'latency_sum')
+
+        for name, key, text in (
+            ('db_queries_total', 'queries', 'Database queries run.'),
+            ('db_duration_seconds_total', 'db_seconds',
+             'Time spent running database queries.'),
+            ('serialization_seconds_total', 'serialization_seconds',
+             'Time spent serializing and rendering response data.'),
+        ):
+            family(name, 'counter', text)
+            for (endpoint, method), stats in totals:
+                sample(name, {'endpoint': endpoint, 'method': method},
+                       stats[key])
+
+        family('http_response_size_bytes', 'histogram',
+               'Size of response bodies, streamed ones excepted.')
+        histogram('http_response_size_bytes', SIZE_BUCKETS,
+                  'sizes', 'size_sum')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+registry = Registry()
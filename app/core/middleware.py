@@ -0,0 +1,162 @@
+import cProfile
+import hashlib
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+
+from core import metrics, profiling, routers, slowqueries
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class MetricsMiddleware:
+    """Record the latency, queries and response size of each URL name
+
+    Placed first, so the latency covers the other middleware too.
+    Requests that resolve to no URL are recorded together.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with metrics.measure() as sample, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample))
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        metrics.registry.observe(
+            match.view_name if match else metrics.UNRESOLVED,
+            request.method,
+            response.status_code,
+            time.perf_counter() - start,
+            None if response.streaming else len(response.content),
+            sample,
+        )
+        return response
+
+
+class SlowQueryMiddleware:
+    """Log the queries of requests running for SLOW_QUERY_SECONDS or more"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_SECONDS is None:
+            return self.get_response(request)
+        log = slowqueries.SlowQueryLog(request.get_full_path())
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+        log.save()
+        return response
+
+
+class ProfileMiddleware:
+    """Profile the requests of staff users that ask for it
+
+    The profile is stored as a RequestProfile, whose id is returned in
+    the X-Profile-Id header. Requests not asking for a profile only pay
+    for the check of the flag.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.requested(request):
+            return self.get_response(request)
+        user = profiling.staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        profile = profiling.save(
+            request, response, user, profiler, time.perf_counter() - start
+        )
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+
+class ReplicaMiddleware:
+    """Read from a replica during safe requests to the configured views
+
+    Clients that wrote within the last REPLICA_STICKY_SECONDS keep
+    reading from the primary, so they see their own writes however far
+    the replicas lag. A replica that cannot be reached is skipped for
+    REPLICA_RETRY_SECONDS, and reads fall back to the primary when none
+    is left.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @property
+    def cache(self):
+        return caches[settings.REPLICA_CACHE]
+
+    def __call__(self, request):
+        with routers.read_from(None):
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            key = self._sticky_key(request)
+            if key is not None:
+                self.cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            request.method in SAFE_METHODS and
+            settings.DATABASE_REPLICAS and
+            self._view_name(view_func) in settings.REPLICA_READ_VIEWS and
+            not self._is_sticky(request)
+        ):
+            routers.use_replica(self._pick_replica())
+
+    def _view_name(self, view_func):
+        view = getattr(view_func, 'cls', view_func)
+        return f'{view.__module__}.{view.__qualname__}'
+
+    def _sticky_key(self, request):
+        """Return the cache key marking a client's recent writes"""
+        authorization = request.META.get('HTTP_AUTHORIZATION')
+        if authorization:
+            digest = hashlib.md5(authorization.encode('utf-8')).hexdigest()
+            return f'replica:sticky:auth:{digest}'
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'replica:sticky:user:{user.pk}'
+        return None
+
+    def _is_sticky(self, request):
+        key = self._sticky_key(request)
+        return key is not None and self.cache.get(key) is not None
+
+    def _pick_replica(self):
+        """Return a reachable replica, or None to read from the primary"""
+        aliases = list(settings.DATABASE_REPLICAS)
+        random.shuffle(aliases)
+        for alias in aliases:
+            down_key = f'replica:down:{alias}'
+            if self.cache.get(down_key) is not None:
+                continue
+            try:
+                connections[alias].ensure_connection()
+            except DatabaseError:
+                self.cache.set(down_key, True, settings.REPLICA_RETRY_SECONDS)
+                continue
+            return alias
+        return None
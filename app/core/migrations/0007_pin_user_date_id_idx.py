@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_pin_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pin',
+            index=models.Index(fields=['user', '-date', '-id'], name='core_pin_user_date_id_idx'),
+        ),
+    ]
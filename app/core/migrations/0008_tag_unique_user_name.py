@@ -0,0 +1,45 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """Fold tags sharing a (user, name) into the oldest one"""
+    Tag = apps.get_model('core', 'Tag')
+    PinTag = apps.get_model('core', 'Pin').tags.through
+
+    duplicates = Tag.objects.values('user', 'name').annotate(
+        keep_id=Min('id'),
+        total=Count('id'),
+    ).filter(total__gt=1)
+
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        drop_ids = list(
+            Tag.objects.filter(
+                user=duplicate['user'],
+                name=duplicate['name'],
+            ).exclude(id=keep_id).values_list('id', flat=True)
+        )
+        linked = PinTag.objects.filter(tag_id=keep_id).values('pin_id')
+        for drop_id in drop_ids:
+            PinTag.objects.filter(
+                tag_id=drop_id
+            ).exclude(pin_id__in=linked).update(tag_id=keep_id)
+        Tag.objects.filter(id__in=drop_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_pin_user_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='core_tag_unique_user_name'),
+        ),
+    ]
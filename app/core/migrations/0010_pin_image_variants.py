@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_user_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pin',
+            name='image_marker',
+            field=models.ImageField(editable=False, null=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='pin',
+            name='image_preview',
+            field=models.ImageField(editable=False, null=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='pin',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='pin',
+            name='image_thumb',
+            field=models.ImageField(editable=False, null=True, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_pin_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('pin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Pin')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.User')),
+            ],
+        ),
+    ]
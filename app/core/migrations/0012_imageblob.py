@@ -0,0 +1,46 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:39
+
+import core.models
+import core.storage
+from django.db import migrations, models
+import django.utils.timezone
+from django.db.models import Count
+
+
+def count_existing_images(apps, schema_editor):
+    """Create reference counts for images stored before blobs"""
+    Pin = apps.get_model('core', 'Pin')
+    ImageBlob = apps.get_model('core', 'ImageBlob')
+
+    counts = Pin.objects.exclude(image='').exclude(
+        image__isnull=True
+    ).values('image').annotate(total=Count('id'))
+    ImageBlob.objects.bulk_create(
+        ImageBlob(name=row['image'], ref_count=row['total'])
+        for row in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_imageupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='pin',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.recipe_image_file_path),
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
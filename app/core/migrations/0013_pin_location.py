@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:45
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_imageblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pin',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='pin',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='pin',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='pin',
+            index=models.Index(fields=['user', 'geohash'], name='core_pin_user_geohash_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from core import geo
+
+
+def build_clusters(apps, schema_editor):
+    """Aggregate the clusters of pins located before clustering"""
+    Pin = apps.get_model('core', 'Pin')
+    PinCluster = apps.get_model('core', 'PinCluster')
+
+    clusters = {}
+    pins = Pin.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).values_list('user_id', 'latitude', 'longitude')
+    for user_id, latitude, longitude in pins.iterator():
+        geohash = geo.encode(latitude, longitude)
+        for length in geo.CLUSTER_LENGTHS:
+            cluster = clusters.setdefault(
+                (user_id, geohash[:length]), [0, 0.0, 0.0]
+            )
+            cluster[0] += 1
+            cluster[1] += latitude
+            cluster[2] += longitude
+
+    PinCluster.objects.bulk_create(
+        (
+            PinCluster(
+                user_id=user_id,
+                length=len(cell),
+                cell=cell,
+                count=count,
+                latitude_sum=latitude_sum,
+                longitude_sum=longitude_sum,
+            )
+            for (user_id, cell), (count, latitude_sum, longitude_sum)
+            in clusters.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_pin_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PinCluster',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.User')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pincluster',
+            constraint=models.UniqueConstraint(fields=('user', 'length', 'cell'), name='core_pincluster_unique_user_cell'),
+        ),
+        migrations.RunPython(build_clusters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.0.14 on 2026-10-17 00:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+from core import search
+
+
+def index_pins(apps, schema_editor):
+    """Build the search postings of existing pins"""
+    Pin = apps.get_model('core', 'Pin')
+    PinTerm = apps.get_model('core', 'PinTerm')
+    PinTag = Pin.tags.through
+
+    tag_names = defaultdict(list)
+    links = PinTag.objects.values_list('pin_id', 'tag__name')
+    for pin_id, name in links.iterator():
+        tag_names[pin_id].append(name)
+
+    postings = []
+    pins = Pin.objects.values_list('id', 'user_id', 'title', 'link')
+    for pin_id, user_id, title, link in pins.iterator():
+        weights = search.weigh(title, link, tag_names.pop(pin_id, []))
+        postings.extend(
+            PinTerm(user_id=user_id, pin_id=pin_id, term=term, weight=weight)
+            for term, weight in weights.items()
+        )
+        if len(postings) >= 5000:
+            PinTerm.objects.bulk_create(postings)
+            postings = []
+    PinTerm.objects.bulk_create(postings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_pincluster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PinTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('pin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Pin')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.User')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pinterm',
+            constraint=models.UniqueConstraint(fields=('user', 'term', 'pin'), name='core_pinterm_unique_user_term_pin'),
+        ),
+        migrations.RunPython(index_pins, migrations.RunPython.noop),
+    ]
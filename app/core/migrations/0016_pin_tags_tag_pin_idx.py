@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-17 00:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index pin tag links by tag first, covering tag filter subqueries
+
+    The unique (pin_id, tag_id) index of the through table serves lookups
+    by pin. Filters by tag read this one instead of the table.
+    """
+
+    dependencies = [
+        ('core', '0015_pinterm'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX core_pin_tags_tag_pin_idx '
+            'ON core_pin_tags (tag_id, pin_id)',
+            'DROP INDEX core_pin_tags_tag_pin_idx',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-17 00:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_tag_pins(apps, schema_editor):
+    """Count the pins already linked to each tag"""
+    Tag = apps.get_model('core', 'Tag')
+    counts = Tag.objects.annotate(
+        linked=Count('pin')
+    ).filter(linked__gt=0).values_list('id', 'linked')
+    for tag_id, linked in counts.iterator():
+        Tag.objects.filter(id=tag_id).update(pin_count=linked)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_pin_tags_tag_pin_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='pin_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_tag_pins, migrations.RunPython.noop),
+    ]
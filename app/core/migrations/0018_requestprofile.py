@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-17 00:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_tag_pin_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.TextField()),
+                ('status', models.PositiveSmallIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('total_seconds', models.FloatField()),
+                ('auth_seconds', models.FloatField()),
+                ('queryset_seconds', models.FloatField()),
+                ('serializer_seconds', models.FloatField()),
+                ('render_seconds', models.FloatField()),
+                ('stats', models.BinaryField()),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.User')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.14 on 2026-10-17 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_requestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('alias', models.CharField(max_length=100)),
+                ('seconds', models.FloatField()),
+                ('sql', models.TextField()),
+                ('params', models.TextField()),
+                ('path', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('serializer', models.CharField(blank=True, max_length=255)),
+                ('location', models.CharField(blank=True, max_length=255)),
+                ('explain', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name_plural': 'slow queries',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-17 01:11
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_slowquery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pin',
+            name='user',
+            field=models.ForeignKey(on_delete=core.models.cascade_from_owner, to='core.User'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='user',
+            field=models.ForeignKey(on_delete=core.models.cascade_from_owner, to='core.User'),
+        ),
+    ]
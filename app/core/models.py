@@ -1,10 +1,18 @@
+import math
 import uuid
 import os
+from collections import defaultdict
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 
+from core import geo, search
+from core.storage import ContentAddressedStorage
+
 
 def recipe_image_file_path(instance, filename):
     """Generate file path for new recipe image"""
@@ -14,6 +22,18 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+def cascade_from_owner(collector, field, sub_objs, using):
+    """Cascade a user deletion, marking the rows that go along with it
+
+    Signal receivers skip the upkeep of search postings, clusters, tag
+    counts and data versions for these rows, since all of that is deleted
+    with the user too.
+    """
+    for obj in sub_objs:
+        obj._owner_deleted = True
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -36,6 +56,13 @@ class UserManager(BaseUserManager):
 
         return user
 
+    def bump_data_version(self, user_id):
+        """Record that one of the user's pins or tags has changed"""
+        self.filter(pk=user_id).update(
+            data_version=F('data_version') + 1,
+            data_modified=timezone.now(),
+        )
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     """Custom user model that supports using email instead of username"""
@@ -43,35 +70,658 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    data_version = models.PositiveIntegerField(default=0, editable=False)
+    data_modified = models.DateTimeField(null=True, editable=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
+    def save(self, *args, **kwargs):
+        # The data version is kept by relative updates, so never write it
+        # back from a copy loaded before a concurrent bump
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in ('data_version', 'data_modified')
+            ]
+        super().save(*args, **kwargs)
+
+
+class TagManager(models.Manager):
+
+    def resolve_names(self, user, names):
+        """Return a name to tag mapping, creating tags that are missing"""
+        names = list(dict.fromkeys(names))
+        tags = {
+            tag.name: tag
+            for tag in self.filter(user=user, name__in=names)
+        }
+        missing = [name for name in names if name not in tags]
+        if missing:
+            self.bulk_create(
+                [self.model(user=user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            tags.update(
+                (tag.name, tag)
+                for tag in self.filter(user=user, name__in=missing)
+            )
+            User.objects.bump_data_version(user.pk)
+
+        return {name: tags[name] for name in names}
+
+    def count_pins(self, deltas):
+        """Add {tag_id: delta} changes to the pin counts of tags"""
+        tag_ids = defaultdict(list)
+        for tag_id, delta in deltas.items():
+            if delta:
+                tag_ids[delta].append(tag_id)
+        for delta, ids in tag_ids.items():
+            self.filter(id__in=ids).update(pin_count=F('pin_count') + delta)
+
+    def recount_pins(self):
+        """Recompute drifted pin counts from the pin links
+
+        Returns the number of tags whose count was repaired. The owners'
+        data versions are bumped, so cached tag lists are not served.
+        """
+        drifted = self.annotate(
+            linked=Count('pin')
+        ).exclude(
+            pin_count=F('linked')
+        ).values_list('id', 'user_id', 'linked')
+        repaired = 0
+        user_ids = set()
+        for tag_id, user_id, linked in drifted:
+            if self.filter(id=tag_id).update(pin_count=linked):
+                repaired += 1
+                user_ids.add(user_id)
+        for user_id in user_ids:
+            User.objects.bump_data_version(user_id)
+        return repaired
+
 
 class Tag(models.Model):
     """Tag to be used for a Pin"""
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=cascade_from_owner
     )
+    pin_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TagManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='core_tag_unique_user_name',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The pin count is kept by relative updates, so never write it back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'pin_count'
+            ]
+        super().save(*args, **kwargs)
+
+
+def split_bbox(min_lon, max_lon):
+    """Return the (west, east) spans of a box, split at the antimeridian"""
+    if min_lon > max_lon:
+        return [(min_lon, 180.0), (-180.0, max_lon)]
+    return [(min_lon, max_lon)]
+
+
+def hash_ranges_q(field, cells, **equal):
+    """Return a filter matching values of `field` under any of the cells
+
+    The `equal` lookups are repeated in every range, so each range is a
+    separate scan on an index led by those columns. Planners such as
+    SQLite's do not push a condition outside an OR into its branches.
+    """
+    hashes = Q()
+    for low, high in geo.prefix_ranges(cells):
+        bounds = {f'{field}__gte': low}
+        if high is not None:
+            bounds[f'{field}__lt'] = high
+        hashes |= Q(**bounds, **equal)
+    return hashes
+
+
+class PinQuerySet(models.QuerySet):
+    NEAREST_START_RADIUS = 1000
+    NEAREST_MAX_RADIUS = math.pi * geo.EARTH_RADIUS
+
+    def with_any_tags(self, tag_ids):
+        """Filter pins linked to at least one of the tags
+
+        Uses an EXISTS probe on the through table's (pin, tag) index, so
+        each pin is returned once however many of the tags it has.
+        """
+        PinTag = Pin.tags.through
+        return self.filter(Exists(PinTag.objects.filter(
+            pin_id=OuterRef('pk'), tag_id__in=tag_ids
+        )))
+
+    def with_all_tags(self, tag_ids):
+        """Filter pins linked to every one of the tags
+
+        Counts the matching links per pin in a subquery over the through
+        table's covering (tag, pin) index.
+        """
+        tag_ids = set(tag_ids)
+        PinTag = Pin.tags.through
+        return self.filter(id__in=PinTag.objects.filter(
+            tag_id__in=tag_ids
+        ).values('pin_id').annotate(
+            matched=Count('tag_id')
+        ).filter(matched=len(tag_ids)).values('pin_id'))
+
+    def in_bbox(self, user, min_lon, min_lat, max_lon, max_lat):
+        """Filter the pins of a user located inside a bounding box
+
+        Boxes with min_lon greater than max_lon cross the antimeridian.
+        The geohash ranges of the covering cells narrow the scan on the
+        (user, geohash) index and the coordinates trim the cell edges.
+        The user is matched inside every range, so do not also filter
+        on it separately.
+        """
+        cells = []
+        inside = Q()
+        for west, east in split_bbox(min_lon, max_lon):
+            cells.extend(geo.covering_cells(west, min_lat, east, max_lat))
+            inside |= Q(longitude__gte=west, longitude__lte=east)
+
+        return self.filter(
+            hash_ranges_q('geohash', cells, user=user),
+            inside,
+            latitude__gte=min_lat,
+            latitude__lte=max_lat,
+        )
+
+    def nearest(self, user, latitude, longitude, k):
+        """Return the ids of a user's k pins closest to a point
+
+        Reads squares around the point that grow fourfold until one holds
+        k pins, then widens the square once to the k-th distance so no
+        closer pin outside it is missed. Each square is a bounding box
+        query on the geohash index, so the cost depends on how many pins
+        are near the point, not on how many the user has.
+        """
+        radius = self.NEAREST_START_RADIUS
+        while True:
+            candidates = self._by_distance(user, latitude, longitude, radius)
+            if len(candidates) >= k or radius >= self.NEAREST_MAX_RADIUS:
+                break
+            radius *= 4
+
+        if len(candidates) >= k and candidates[k - 1][0] > radius:
+            candidates = self._by_distance(
+                user, latitude, longitude, candidates[k - 1][0]
+            )
+        return [pin_id for _, pin_id in candidates[:k]]
+
+    def search(self, user, text, limit):
+        """Return the ids of a user's best matching pins, best first
+
+        Pins must contain every word of the text in their title, link or
+        tag names, and are ranked by the summed weights of their words.
+        The postings of the words are grouped per pin in one query on the
+        (user, term, pin) index; other filters of this queryset apply to
+        them as a semi-join.
+        """
+        terms = set(search.tokenize(text))
+        if not terms:
+            return []
+
+        postings = PinTerm.objects.filter(user=user, term__in=terms)
+        if self.query.has_filters():
+            postings = postings.filter(pin__in=self.values('id'))
+        return list(postings.values('pin_id').annotate(
+            matched=Count('term'),
+            score=Sum('weight'),
+        ).filter(matched=len(terms)).order_by(
+            '-score', '-pin_id'
+        ).values_list('pin_id', flat=True)[:limit])
+
+    def _by_distance(self, user, latitude, longitude, radius):
+        """Return (distance, id) pairs of the pins in a square, sorted"""
+        pins = self.in_bbox(
+            user, *geo.bbox_around(latitude, longitude, radius)
+        ).values_list('id', 'latitude', 'longitude')
+        return sorted(
+            (geo.distance(latitude, longitude, lat, lon), pin_id)
+            for pin_id, lat, lon in set(pins)
+        )
+
 
 class Pin(models.Model):
     """Pin object"""
+    IMAGE_PENDING = 'pending'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUS_CHOICES = (
+        (IMAGE_PENDING, 'Pending'),
+        (IMAGE_READY, 'Ready'),
+        (IMAGE_FAILED, 'Failed'),
+    )
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=cascade_from_owner
     )
     title = models.CharField(max_length=255)
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     date = models.DateField(auto_now_add=True, blank=True)
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=ContentAddressedStorage(),
+    )
+    image_status = models.CharField(
+        max_length=10,
+        choices=IMAGE_STATUS_CHOICES,
+        blank=True,
+        editable=False,
+    )
+    image_thumb = models.ImageField(null=True, editable=False)
+    image_marker = models.ImageField(null=True, editable=False)
+    image_preview = models.ImageField(null=True, editable=False)
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)],
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)],
+    )
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+
+    objects = PinQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', '-date', '-id'],
+                name='core_pin_user_date_id_idx',
+            ),
+            models.Index(
+                fields=['user', 'geohash'],
+                name='core_pin_user_geohash_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        coordinates = {'latitude', 'longitude'}
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if not coordinates & self.get_deferred_fields():
+                self.update_geohash()
+        elif coordinates & set(update_fields):
+            self.update_geohash()
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+    def update_geohash(self):
+        """Set the geohash from the coordinates
+
+        Called from save(), and by bulk writers that bypass it.
+        """
+        if self.latitude is None or self.longitude is None:
+            self.geohash = ''
+        else:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+
+
+class ImageUpload(models.Model):
+    """Resumable upload of an image for a pin
+
+    Parts are appended to a temporary file named after the upload, so the
+    number of bytes received so far is the size of that file.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    pin = models.ForeignKey('Pin', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.PIN_UPLOAD_DIR, f'{self.id}.part')
+
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def __str__(self):
+        return self.filename
+
+
+class ImageBlobManager(models.Manager):
+
+    def acquire(self, name):
+        """Count a new reference to a stored image"""
+        if self._add_reference(name):
+            return
+        try:
+            with transaction.atomic():
+                self.create(name=name, ref_count=1)
+        except IntegrityError:
+            self._add_reference(name)
+
+    def _add_reference(self, name):
+        return self.filter(name=name).update(
+            ref_count=F('ref_count') + 1,
+            updated=timezone.now(),
+        )
+
+    def release(self, name):
+        """Drop a reference to a stored image"""
+        self.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1,
+            updated=timezone.now(),
+        )
+
+
+class ImageBlob(models.Model):
+    """Reference count of a stored pin image"""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return self.name
+
+
+class PinClusterQuerySet(models.QuerySet):
+
+    def in_bbox(self, user, length, min_lon, min_lat, max_lon, max_lat):
+        """Filter a user's clusters whose centroid is inside a box"""
+        cells = []
+        inside = Q()
+        for west, east in split_bbox(min_lon, max_lon):
+            cells.extend(geo.covering_cells(
+                west, min_lat, east, max_lat, max_length=length
+            ))
+            inside |= Q(
+                longitude_sum__gte=F('count') * west,
+                longitude_sum__lte=F('count') * east,
+            )
+
+        return self.filter(
+            hash_ranges_q('cell', cells, user=user, length=length),
+            inside,
+            latitude_sum__gte=F('count') * min_lat,
+            latitude_sum__lte=F('count') * max_lat,
+        )
+
+
+class PinClusterManager(models.Manager.from_queryset(PinClusterQuerySet)):
+    batch_size = 500
+
+    def move(self, user_id, added=(), removed=()):
+        """Update every zoom level for pins added at or removed from points
+
+        `added` and `removed` hold (latitude, longitude) pairs, pairs
+        without coordinates are skipped. Changes are summed per cell
+        first and written set-based: with one upsert statement per
+        batch of cells on PostgreSQL, elsewhere by reading the touched
+        clusters once and writing them back in bulk.
+        """
+        deltas = {}
+        for sign, points in ((1, added), (-1, removed)):
+            for latitude, longitude in points:
+                if latitude is None or longitude is None:
+                    continue
+                geohash = geo.encode(latitude, longitude)
+                for length in geo.CLUSTER_LENGTHS:
+                    delta = deltas.setdefault(geohash[:length], [0, 0.0, 0.0])
+                    delta[0] += sign
+                    delta[1] += sign * latitude
+                    delta[2] += sign * longitude
+
+        deltas = {cell: delta for cell, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+
+        with transaction.atomic(using=self.db):
+            if connections[self.db].vendor == 'postgresql':
+                self._upsert(user_id, deltas)
+            else:
+                self._merge(user_id, deltas)
+            if any(count < 0 for count, _, _ in deltas.values()):
+                self.filter(user_id=user_id, count__lte=0).delete()
+
+    def _upsert(self, user_id, deltas):
+        """Add deltas with INSERT ... ON CONFLICT DO UPDATE"""
+        table = self.model._meta.db_table
+        cells = list(deltas.items())
+        with connections[self.db].cursor() as cursor:
+            for start in range(0, len(cells), self.batch_size):
+                batch = cells[start:start + self.batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} AS cluster '
+                    '(user_id, length, cell, count, latitude_sum, '
+                    'longitude_sum) VALUES '
+                    + ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+                    + ' ON CONFLICT (user_id, length, cell) DO UPDATE SET '
+                    'count = cluster.count + EXCLUDED.count, '
+                    'latitude_sum = cluster.latitude_sum '
+                    '+ EXCLUDED.latitude_sum, '
+                    'longitude_sum = cluster.longitude_sum '
+                    '+ EXCLUDED.longitude_sum',
+                    [
+                        value
+                        for cell, delta in batch
+                        for value in (user_id, len(cell), cell, *delta)
+                    ],
+                )
+
+    def _merge(self, user_id, deltas):
+        """Add deltas to the touched clusters read in one pass"""
+        cells = list(deltas)
+        existing = {}
+        for start in range(0, len(cells), self.batch_size):
+            existing.update(
+                (cluster.cell, cluster)
+                for cluster in self.select_for_update().filter(
+                    user_id=user_id,
+                    cell__in=cells[start:start + self.batch_size],
+                )
+            )
+
+        created = []
+        for cell, (count, latitude, longitude) in deltas.items():
+            cluster = existing.get(cell)
+            if cluster is None:
+                cluster = PinCluster(user_id=user_id, length=len(cell),
+                                     cell=cell)
+                created.append(cluster)
+            cluster.count += count
+            cluster.latitude_sum += latitude
+            cluster.longitude_sum += longitude
+
+        self.bulk_update(
+            existing.values(), ['count', 'latitude_sum', 'longitude_sum'],
+            batch_size=self.batch_size,
+        )
+        self.bulk_create(created, batch_size=self.batch_size)
+
+
+class PinCluster(models.Model):
+    """Number and coordinate sums of a user's pins in a geohash cell
+
+    Kept for every cell length in CLUSTER_LENGTHS, so a zoomed out map
+    reads one row per visible cell instead of every pin.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    length = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+
+    objects = PinClusterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'length', 'cell'],
+                name='core_pincluster_unique_user_cell',
+            ),
+        ]
+
+    def __str__(self):
+        return self.cell
+
+    @property
+    def latitude(self):
+        return self.latitude_sum / self.count
+
+    @property
+    def longitude(self):
+        return self.longitude_sum / self.count
+
+
+class PinTermManager(models.Manager):
+    chunk_size = 500
+
+    def reindex(self, pin_ids):
+        """Replace the search postings of pins with their current text"""
+        pin_ids = list(pin_ids)
+        for start in range(0, len(pin_ids), self.chunk_size):
+            self._reindex(pin_ids[start:start + self.chunk_size])
+
+    def _reindex(self, pin_ids):
+        tag_names = defaultdict(list)
+        links = Pin.tags.through.objects.filter(
+            pin_id__in=pin_ids
+        ).values_list('pin_id', 'tag__name')
+        for pin_id, name in links:
+            tag_names[pin_id].append(name)
+
+        postings = []
+        pins = Pin.objects.filter(
+            id__in=pin_ids
+        ).values_list('id', 'user_id', 'title', 'link')
+        for pin_id, user_id, title, link in pins:
+            weights = search.weigh(title, link, tag_names[pin_id])
+            postings.extend(
+                PinTerm(user_id=user_id, pin_id=pin_id, term=term,
+                        weight=weight)
+                for term, weight in weights.items()
+            )
+
+        with transaction.atomic(savepoint=False):
+            self.filter(pin_id__in=pin_ids).delete()
+            self.bulk_create(postings)
+
+
+class PinTerm(models.Model):
+    """Search posting of a word in a pin's title, link or tag names"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    term = models.CharField(max_length=search.MAX_TERM_LENGTH)
+    pin = models.ForeignKey('Pin', on_delete=models.CASCADE)
+    weight = models.PositiveIntegerField()
+
+    objects = PinTermManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'term', 'pin'],
+                name='core_pinterm_unique_user_term_pin',
+            ),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class RingBufferManager(models.Manager):
+    """Manager of a log table keeping only its newest rows"""
+
+    def trim(self, kept):
+        """Delete all but the `kept` newest rows"""
+        cutoff = self.order_by('-id').values_list('id', flat=True)[
+            kept:kept + 1
+        ]
+        if cutoff:
+            self.filter(id__lte=cutoff[0]).delete()
+
+
+class RequestProfile(models.Model):
+    """cProfile statistics of a request a staff user asked to profile"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    status = models.PositiveSmallIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    total_seconds = models.FloatField()
+    auth_seconds = models.FloatField()
+    queryset_seconds = models.FloatField()
+    serializer_seconds = models.FloatField()
+    render_seconds = models.FloatField()
+    stats = models.BinaryField()
+
+    objects = RingBufferManager()
+
+    def __str__(self):
+        return f'{self.method} {self.path}'
+
+
+class SlowQuery(models.Model):
+    """Query of a request that ran for SLOW_QUERY_SECONDS or longer"""
+    created = models.DateTimeField(auto_now_add=True)
+    alias = models.CharField(max_length=100)
+    seconds = models.FloatField()
+    sql = models.TextField()
+    params = models.TextField()
+    path = models.TextField()
+    view = models.CharField(max_length=255, blank=True)
+    serializer = models.CharField(max_length=255, blank=True)
+    location = models.CharField(max_length=255, blank=True)
+    explain = models.TextField(blank=True)
+
+    objects = RingBufferManager()
+
+    class Meta:
+        verbose_name_plural = 'slow queries'
+
+    def __str__(self):
+        return self.sql[:80]
@@ -0,0 +1,92 @@
+"""Profiles of single requests, taken on demand for staff users
+
+A staff user adds a `profile` query parameter or an X-Profile header to a
+request, and ProfileMiddleware runs it under cProfile. The statistics are
+stored with the time of each phase of the request, read off the
+cumulative time of the function doing it. Phases nest, so queries run
+while serializing count in both the queryset and serializer phases.
+"""
+import io
+import marshal
+import pstats
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+from core.models import RequestProfile
+
+QUERY_PARAM = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+PHASES = {
+    'auth': Request._authenticate,
+    'queryset': QuerySet._fetch_all,
+    'serializer': BaseSerializer.data.fget,
+    'render': Response.rendered_content.fget,
+}
+
+
+def requested(request):
+    """Return whether the request asks to be profiled"""
+    return HEADER in request.META or QUERY_PARAM in request.GET
+
+
+def staff_user(request):
+    """Return the staff user making the request, or None"""
+    user = request.user
+    if not user.is_authenticated:
+        try:
+            result = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        user = result[0] if result else None
+    if user is None or not user.is_staff:
+        return None
+    return user
+
+
+def _key(function):
+    code = function.__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def phases(stats):
+    """Return the cumulative seconds of each phase in a pstats.Stats"""
+    return {
+        name: stats.stats[_key(function)][3]
+        if _key(function) in stats.stats else 0.0
+        for name, function in PHASES.items()
+    }
+
+
+def save(request, response, user, profiler, seconds):
+    """Store the profile of a request and drop the oldest past the limit"""
+    stats = pstats.Stats(profiler)
+    profile = RequestProfile.objects.create(
+        user=user,
+        method=request.method,
+        path=request.get_full_path(),
+        status=response.status_code,
+        total_seconds=seconds,
+        stats=marshal.dumps(stats.stats),
+        **{
+            f'{name}_seconds': value
+            for name, value in phases(stats).items()
+        },
+    )
+    RequestProfile.objects.trim(settings.REQUEST_PROFILES_KEPT)
+    return profile
+
+
+def report(data, limit=40):
+    """Return the functions of a stored profile by cumulative time"""
+    out = io.StringIO()
+    stats = pstats.Stats(stream=out)
+    stats.stats = marshal.loads(bytes(data))
+    stats.get_top_level_stats()
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
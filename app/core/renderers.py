@@ -0,0 +1,11 @@
+from rest_framework import renderers
+
+from core import metrics
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """JSON renderer counting its time as serialization in the metrics"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.serializing():
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,51 @@
+"""Routing of ORM reads to read replicas
+
+Reads go to the primary unless the current request picked a replica
+through `core.middleware.ReplicaMiddleware`. Writes always go to the
+primary, and a write also moves the rest of the request back to it so
+that the request reads what it just wrote.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def read_alias():
+    """Return the replica the current reads go to, if any"""
+    return _read_alias.get()
+
+
+def use_replica(alias):
+    """Send the following reads of the current context to a replica"""
+    _read_alias.set(alias)
+
+
+@contextmanager
+def read_from(alias):
+    """Send the reads made inside the block to a replica, or the primary"""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """Send reads to the replica picked for the request"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -0,0 +1,35 @@
+"""Tokenizing and weighting of the words indexed for pin search
+
+Every pin has one posting per distinct word of its title, link and tag
+names. The weight of a posting adds up the field weights of each
+occurrence, so a word in the title counts more than one in the link.
+"""
+import re
+from collections import Counter
+
+WEIGHTS = (
+    ('title', 3),
+    ('tags', 2),
+    ('link', 1),
+)
+MAX_TERM_LENGTH = 64
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Return the case folded words of a text"""
+    return [
+        word[:MAX_TERM_LENGTH] for word in _WORD.findall(text.casefold())
+    ]
+
+
+def weigh(title, link, tag_names):
+    """Return a {term: weight} mapping for the text of a pin"""
+    texts = {'title': [title], 'link': [link], 'tags': tag_names}
+    weights = Counter()
+    for field, weight in WEIGHTS:
+        for text in texts[field]:
+            for term in tokenize(text or ''):
+                weights[term] += weight
+    return weights
@@ -0,0 +1,207 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, \
+    post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from core.models import ImageBlob, Pin, PinCluster, PinTerm, Tag
+
+
+TRACKED_PIN_FIELDS = ('image', 'latitude', 'longitude', 'title', 'link')
+
+# Sent with `user_id` and `points`, the (latitude, longitude) pairs at
+# which pins were created, moved to or from, or deleted.
+pin_locations_changed = Signal()
+
+
+@receiver(post_save, sender=Pin)
+@receiver(post_delete, sender=Pin)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_version_on_change(sender, instance, **kwargs):
+    """Bump the owner's data version when a pin or tag changes"""
+    if getattr(instance, '_owner_deleted', False):
+        return
+    get_user_model().objects.bump_data_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def bump_version_on_tags_change(sender, instance, action, **kwargs):
+    """Bump the owner's data version when pin tags are linked"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        get_user_model().objects.bump_data_version(instance.user_id)
+
+
+@receiver(pre_save, sender=Pin)
+def find_stored_values(sender, instance, update_fields=None, **kwargs):
+    """Look up the stored image, location and text a pin save replaces"""
+    instance.__dict__.pop('_stored_values', None)
+    fields = [
+        field for field in TRACKED_PIN_FIELDS
+        if field in instance.__dict__ and (
+            update_fields is None or field in update_fields
+        )
+    ]
+    if not fields:
+        return
+
+    stored = None
+    if not instance._state.adding:
+        stored = Pin.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._stored_values = {
+        field: (stored or {}).get(field) for field in fields
+    }
+
+
+@receiver(post_save, sender=Pin)
+def count_image_references(sender, instance, **kwargs):
+    """Move the pin's image reference when its image changes"""
+    stored = getattr(instance, '_stored_values', {})
+    if 'image' not in stored:
+        return
+
+    old_name = stored['image'] or ''
+    new_name = instance.image.name or ''
+    if new_name == old_name:
+        return
+    if new_name:
+        ImageBlob.objects.acquire(new_name)
+    if old_name:
+        ImageBlob.objects.release(old_name)
+
+
+@receiver(post_save, sender=Pin)
+def update_clusters(sender, instance, **kwargs):
+    """Move the pin between clusters when its location changes"""
+    stored = getattr(instance, '_stored_values', {})
+    if 'latitude' not in stored and 'longitude' not in stored:
+        return
+
+    new = (instance.latitude, instance.longitude)
+    old = (
+        stored.get('latitude', instance.latitude),
+        stored.get('longitude', instance.longitude),
+    )
+    if new != old:
+        PinCluster.objects.move(instance.user_id, [new], [old])
+        pin_locations_changed.send(
+            sender=Pin, user_id=instance.user_id, points=[new, old]
+        )
+
+
+@receiver(pre_delete, sender=Pin)
+def release_pin_data(sender, instance, **kwargs):
+    """Drop the image reference and cluster counts of a deleted pin"""
+    fields = ('image', 'latitude', 'longitude')
+    if all(field in instance.__dict__ for field in fields):
+        image, latitude, longitude = (
+            instance.image.name, instance.latitude, instance.longitude
+        )
+    else:
+        image, latitude, longitude = Pin.objects.filter(
+            pk=instance.pk
+        ).values_list(*fields).first() or (None, None, None)
+
+    if image:
+        ImageBlob.objects.release(image)
+    if getattr(instance, '_owner_deleted', False):
+        return
+    point = (latitude, longitude)
+    PinCluster.objects.move(instance.user_id, removed=[point])
+    pin_locations_changed.send(
+        sender=Pin, user_id=instance.user_id, points=[point]
+    )
+
+
+@receiver(pre_delete, sender=Pin)
+def uncount_deleted_pin(sender, instance, **kwargs):
+    """Drop a deleted pin from the pin counts of its tags"""
+    if getattr(instance, '_owner_deleted', False):
+        return
+    tag_ids = instance.tags.through.objects.filter(
+        pin_id=instance.pk
+    ).values_list('tag_id', flat=True)
+    Tag.objects.count_pins(dict.fromkeys(tag_ids, -1))
+
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def count_tag_pins(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the pin counts of tags in step with linked and unlinked pins
+
+    Removals are counted before the links go, since `pk_set` may name
+    pins or tags that were never linked.
+    """
+    if action == 'post_add':
+        if reverse:
+            Tag.objects.count_pins({instance.pk: len(pk_set)})
+        else:
+            Tag.objects.count_pins(dict.fromkeys(pk_set, 1))
+    elif action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.filter(
+            **{'tag_id' if reverse else 'pin_id': instance.pk}
+        )
+        if action == 'pre_remove':
+            links = links.filter(
+                **{'pin_id__in' if reverse else 'tag_id__in': pk_set}
+            )
+        instance._unlinked_tag_ids = list(
+            links.values_list('tag_id', flat=True)
+        )
+    elif action in ('post_remove', 'post_clear'):
+        unlinked = Counter(instance.__dict__.pop('_unlinked_tag_ids', []))
+        Tag.objects.count_pins({
+            tag_id: -count for tag_id, count in unlinked.items()
+        })
+
+
+@receiver(post_save, sender=Pin)
+def index_pin_text(sender, instance, created, **kwargs):
+    """Reindex the pin for search when its title or link changes"""
+    stored = getattr(instance, '_stored_values', {})
+    if created or any(
+        stored[field] != getattr(instance, field)
+        for field in ('title', 'link') if field in stored
+    ):
+        PinTerm.objects.reindex([instance.pk])
+
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def index_pin_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """Reindex pins for search when their tags are linked or unlinked"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            PinTerm.objects.reindex([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_pin_ids = list(
+            instance.pin_set.values_list('id', flat=True)
+        )
+    elif action == 'post_clear':
+        PinTerm.objects.reindex(instance.__dict__.pop('_cleared_pin_ids'))
+    elif action in ('post_add', 'post_remove'):
+        PinTerm.objects.reindex(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+def index_renamed_tag(sender, instance, created, update_fields=None,
+                      **kwargs):
+    """Reindex the pins of a tag for search when its name may change"""
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    PinTerm.objects.reindex(instance.pin_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def find_untagged_pins(sender, instance, **kwargs):
+    """Remember the pins losing a tag that is deleted"""
+    if getattr(instance, '_owner_deleted', False):
+        return
+    instance._untagged_pin_ids = list(
+        instance.pin_set.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def index_untagged_pins(sender, instance, **kwargs):
+    """Reindex pins for search once a tag of theirs is deleted"""
+    PinTerm.objects.reindex(instance.__dict__.pop('_untagged_pin_ids', []))
@@ -0,0 +1,120 @@
+"""Log of the slow queries of requests
+
+SlowQueryMiddleware installs a SlowQueryLog as execute wrapper on the
+connections for the length of each request. Queries running for
+SLOW_QUERY_SECONDS or longer are recorded with the view and serializer
+found on the call stack and the plan of the query, explained right
+away. The records are saved once the response is ready, outside the
+request's transactions, and only the newest SLOW_QUERY_LOG_SIZE are
+kept.
+"""
+import os
+import sys
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+from core import metrics
+from core.models import SlowQuery
+
+MAX_PARAMS_LENGTH = 2000
+# Frames of the wrappers around queries, skipped to find their caller
+WRAPPER_FILES = (os.path.abspath(__file__), os.path.abspath(metrics.__file__))
+
+
+class SlowQueryLog:
+    """Execute wrapper recording the slow queries of a request"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self._explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        seconds = time.perf_counter() - start
+        if seconds >= settings.SLOW_QUERY_SECONDS and not self._explaining:
+            self.records.append(
+                self._record(sql, params, many, context['connection'],
+                             seconds)
+            )
+        return result
+
+    def save(self):
+        """Store the recorded queries, dropping the oldest past the limit"""
+        if self.records:
+            SlowQuery.objects.bulk_create(self.records)
+            SlowQuery.objects.trim(settings.SLOW_QUERY_LOG_SIZE)
+
+    def _record(self, sql, params, many, connection, seconds):
+        view, serializer, location = _callers()
+        return SlowQuery(
+            alias=connection.alias,
+            seconds=seconds,
+            sql=sql,
+            params=repr(params)[:MAX_PARAMS_LENGTH],
+            path=self.path,
+            view=view,
+            serializer=serializer,
+            location=location,
+            explain='' if many else self._explain(sql, params, connection),
+        )
+
+    def _explain(self, sql, params, connection):
+        """Return the plan of a SELECT, run again if ANALYZE is enabled"""
+        if sql.lstrip()[:6].upper() != 'SELECT':
+            return ''
+        options = {}
+        if (
+            settings.SLOW_QUERY_EXPLAIN_ANALYZE and
+            connection.vendor == 'postgresql'
+        ):
+            options['analyze'] = True
+        prefix = connection.ops.explain_query_prefix(**options)
+        self._explaining = True
+        try:
+            # A failing EXPLAIN only rolls back its own savepoint
+            with transaction.atomic(using=connection.alias), \
+                    connection.cursor() as cursor:
+                cursor.execute(f'{prefix} {sql}', params)
+                rows = cursor.fetchall()
+        except DatabaseError as exc:
+            return f'EXPLAIN failed: {exc}'
+        finally:
+            self._explaining = False
+        return '\n'.join(' '.join(map(str, row)) for row in rows)
+
+
+def _name(cls):
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def _callers():
+    """Return the view, serializer and project line running a query"""
+    view = serializer = location = ''
+    frame = sys._getframe(1)
+    while frame is not None:
+        # type() leaves lazy objects such as request.user unevaluated
+        cls = type(frame.f_locals.get('self'))
+        if not serializer and issubclass(cls, BaseSerializer):
+            serializer = _name(cls)
+        if not view and issubclass(cls, APIView):
+            view = _name(cls)
+            action = getattr(frame.f_locals['self'], 'action', None)
+            if action:
+                view = f'{view}.{action}'
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (
+            not location and
+            filename.startswith(settings.BASE_DIR + os.sep) and
+            filename not in WRAPPER_FILES
+        ):
+            location = '{}:{}'.format(
+                os.path.relpath(filename, settings.BASE_DIR), frame.f_lineno
+            )
+        frame = frame.f_back
+    return view, serializer, location
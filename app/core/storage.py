@@ -0,0 +1,67 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after the SHA-256 of their bytes
+
+    Identical uploads map to the same name, so each blob is written once
+    however many pins use it. Blobs are never removed by `delete()`;
+    unreferenced ones are garbage collected by the gc_image_blobs
+    command once their reference count drops to zero.
+    """
+    blob_dir = 'uploads/blobs'
+
+    def blob_name(self, digest, extension):
+        """Return the storage name of a blob"""
+        return f'{self.blob_dir}/{digest[:2]}/{digest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        extension = os.path.splitext(name)[1].lower()
+        directory = self.path(self.blob_dir)
+        os.makedirs(directory, exist_ok=True)
+
+        # Hash while copying to a temporary file next to the blobs, then
+        # move it into place only if that content is not stored yet.
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            name = self.blob_name(digest.hexdigest(), extension)
+            if self.exists(name):
+                # Refresh the blob so garbage collection leaves it alone
+                os.remove(tmp_path)
+                os.utime(self.path(name))
+            else:
+                os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return name
+
+    def delete(self, name):
+        """Leave blobs in place, they are removed by garbage collection"""
+
+    def purge(self, name):
+        """Remove a blob from disk"""
+        super().delete(name)
@@ -0,0 +1,133 @@
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.models import Pin, Tag
+from pins.cache import response_cache
+from pins.serializers import PinDetailSerializer, TagSerializer
+
+METRICS_URL = reverse('metrics')
+TAGS_URL = reverse('pins:tag-list')
+
+
+class MetricsTests(TestCase):
+    """Test requests are recorded per URL name and exposed to staff"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@devansh.com',
+            'password',
+            is_staff=True,
+        )
+        Tag.objects.create(user=self.user, name='Festival')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+        self.registry = metrics.Registry()
+        patcher = patch('core.metrics.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_recorded_by_url_name(self):
+        """Test latency, queries, serialization and size are recorded"""
+        self.client.get(TAGS_URL)
+        self.client.get(TAGS_URL)
+        self.client.get('/api/nowhere/')
+
+        totals = self.registry.collect()
+        tags = totals['pins:tag-list', 'GET']
+        self.assertEqual(tags['statuses'], {'200': 2})
+        self.assertEqual(sum(tags['latency']), 2)
+        self.assertGreater(tags['queries'], 0)
+        self.assertGreater(tags['db_seconds'], 0)
+        self.assertGreater(tags['serialization_seconds'], 0)
+        self.assertEqual(sum(tags['sizes']), 2)
+        self.assertGreater(tags['size_sum'], 0)
+        self.assertEqual(
+            totals[metrics.UNRESOLVED, 'GET']['statuses'], {'404': 1}
+        )
+
+    def test_serializer_time_counted_as_serialization(self):
+        """Test building list and detail data counts as serialization"""
+        pin = Pin.objects.create(user=self.user, title='Party')
+
+        def slow(serializer, instance):
+            time.sleep(0.05)
+            return {'id': instance.id}
+
+        for serializer in (TagSerializer, PinDetailSerializer):
+            patcher = patch.object(serializer, 'to_representation', slow)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.get(TAGS_URL)
+        self.client.get(reverse('pins:pin-detail', args=[pin.id]))
+
+        totals = self.registry.collect()
+        for endpoint in ('pins:tag-list', 'pins:pin-detail'):
+            self.assertGreaterEqual(
+                totals[endpoint, 'GET']['serialization_seconds'], 0.05
+            )
+
+    def test_metrics_in_prometheus_format(self):
+        """Test the metrics endpoint renders the Prometheus text format"""
+        self.client.get(TAGS_URL)
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        body = res.content.decode()
+        labels = 'endpoint="pins:tag-list",method="GET"'
+        self.assertIn(
+            f'pinmap_http_requests_total{{{labels},status="200"}} 1', body
+        )
+        self.assertIn(
+            f'pinmap_http_request_duration_seconds_bucket'
+            f'{{{labels},le="+Inf"}} 1',
+            body,
+        )
+        self.assertIn(
+            f'pinmap_http_request_duration_seconds_count{{{labels}}} 1', body
+        )
+        self.assertIn('# TYPE pinmap_db_queries_total counter', body)
+
+    def test_metrics_staff_only(self):
+        """Test the metrics are not served to other users"""
+        self.client.force_authenticate(
+            get_user_model().objects.create_user('other@devansh.com', 'pass')
+        )
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_processes_aggregated_through_directory(self):
+        """Test every process' file in METRICS_DIR is summed"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        other = metrics.Registry()
+
+        with override_settings(
+            METRICS_DIR=directory.name, METRICS_FLUSH_SECONDS=0
+        ):
+            self.client.get(TAGS_URL)
+            other.observe(
+                'pins:tag-list', 'GET', 200, 0.2, 100, metrics.Sample()
+            )
+            other.observe(
+                'pins:tag-list', 'GET', 500, 20, 100, metrics.Sample()
+            )
+            totals = self.registry.collect()
+
+        tags = totals['pins:tag-list', 'GET']
+        self.assertEqual(tags['statuses'], {'200': 2, '500': 1})
+        self.assertEqual(tags['latency'][-1], 1)
+        self.assertEqual(sum(tags['sizes']), 3)
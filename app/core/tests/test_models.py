@@ -1,7 +1,10 @@
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from core import models
+from core import geo, models
 import datetime
+import random
 from unittest.mock import patch
 
 
@@ -55,6 +58,282 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(tag), tag.name)
 
+    def test_tag_name_unique_per_user(self):
+        """Test a user cannot have two tags with the same name"""
+        user = sample_user()
+        models.Tag.objects.create(user=user, name='Festival')
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='Festival')
+
+    def test_tag_resolve_names(self):
+        """Test resolving tag names reuses and creates tags"""
+        user = sample_user()
+        existing = models.Tag.objects.create(user=user, name='Festival')
+
+        tags = models.Tag.objects.resolve_names(user, ['Party', 'Festival'])
+
+        self.assertEqual(list(tags), ['Party', 'Festival'])
+        self.assertEqual(tags['Festival'], existing)
+        self.assertEqual(tags['Party'].user, user)
+
+    def test_data_version_bumped_on_change(self):
+        """Test pin, tag and tag link changes bump the data version"""
+        user = sample_user()
+        versions = [user.data_version]
+        pin = models.Pin.objects.create(user=user, title='Birthday')
+        tag = models.Tag.objects.create(user=user, name='Festival')
+        for change in (lambda: pin.tags.add(tag), tag.delete, pin.delete):
+            change()
+            user.refresh_from_db()
+            versions.append(user.data_version)
+
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertIsNotNone(user.data_modified)
+
+    def test_user_save_keeps_data_version(self):
+        """Test saving a stale user does not undo a data version bump"""
+        user = sample_user()
+        get_user_model().objects.bump_data_version(user.pk)
+
+        user.name = 'Renamed'
+        user.save()
+
+        user.refresh_from_db()
+        self.assertEqual(user.name, 'Renamed')
+        self.assertEqual(user.data_version, 1)
+        self.assertIsNotNone(user.data_modified)
+
+    def test_tag_pin_count_follows_links(self):
+        """Test tag pin counts follow links, unlinks and pin deletes"""
+        user = sample_user()
+        tag1 = models.Tag.objects.create(user=user, name='Food')
+        tag2 = models.Tag.objects.create(user=user, name='Drinks')
+        pin1 = models.Pin.objects.create(user=user, title='Bar')
+        pin2 = models.Pin.objects.create(user=user, title='Cafe')
+
+        def counts():
+            return dict(models.Tag.objects.values_list('name', 'pin_count'))
+
+        pin1.tags.add(tag1, tag2)
+        pin1.tags.add(tag1)
+        tag1.pin_set.add(pin2)
+        self.assertEqual(counts(), {'Food': 2, 'Drinks': 1})
+
+        pin2.tags.remove(tag1, tag2)
+        self.assertEqual(counts(), {'Food': 1, 'Drinks': 1})
+
+        tag1.pin_set.add(pin2)
+        tag1.pin_set.clear()
+        self.assertEqual(counts(), {'Food': 0, 'Drinks': 1})
+
+        tag1.name = 'Meals'
+        tag1.save()
+        pin1.delete()
+        self.assertEqual(counts(), {'Meals': 0, 'Drinks': 0})
+
+    def test_pin_geohash_computed_on_save(self):
+        """Test saving a pin with coordinates sets its geohash"""
+        pin = models.Pin.objects.create(
+            user=sample_user(),
+            title='Aalborg',
+            latitude=57.64911,
+            longitude=10.40744,
+        )
+        self.assertEqual(pin.geohash, 'u4pruydqq')
+
+        pin.latitude = pin.longitude = None
+        pin.save(update_fields=['latitude', 'longitude'])
+        pin.refresh_from_db()
+        self.assertEqual(pin.geohash, '')
+
+    def test_pins_in_bbox(self):
+        """Test bounding box filtering, including across the antimeridian"""
+        user = sample_user()
+        places = {
+            'Paris': (48.8566, 2.3522),
+            'London': (51.5074, -0.1278),
+            'Fiji': (-17.7134, 178.065),
+            'Samoa': (-13.759, -172.1046),
+            'Nowhere': (None, None),
+        }
+        for title, (latitude, longitude) in places.items():
+            models.Pin.objects.create(
+                user=user, title=title,
+                latitude=latitude, longitude=longitude,
+            )
+
+        def titles(*bbox):
+            return set(models.Pin.objects.in_bbox(
+                user, *bbox
+            ).values_list('title', flat=True))
+
+        self.assertEqual(titles(-1, 48, 3, 52), {'Paris', 'London'})
+        self.assertEqual(titles(1, 48, 3, 49), {'Paris'})
+        self.assertEqual(titles(170, -20, -170, -10), {'Fiji', 'Samoa'})
+        self.assertEqual(titles(-180, -90, 180, 90), set(places) - {
+            'Nowhere'
+        })
+
+    def test_pin_clusters_follow_pins(self):
+        """Test clusters are updated as pins are created, moved, deleted"""
+        user = sample_user()
+        paris = models.Pin.objects.create(
+            user=user, title='Paris', latitude=48.8566, longitude=2.3522
+        )
+        models.Pin.objects.create(
+            user=user, title='Versailles', latitude=48.8049, longitude=2.1204
+        )
+
+        def cluster(length):
+            return models.PinCluster.objects.get(user=user, length=length)
+
+        self.assertEqual(
+            models.PinCluster.objects.filter(user=user).count(),
+            len(geo.CLUSTER_LENGTHS) + 4,
+        )
+        self.assertEqual(cluster(2).count, 2)
+        self.assertAlmostEqual(cluster(2).latitude, (48.8566 + 48.8049) / 2)
+
+        paris.latitude, paris.longitude = 51.5074, -0.1278
+        paris.save()
+        self.assertEqual(
+            dict(models.PinCluster.objects.filter(
+                user=user, length=1
+            ).values_list('cell', 'count')),
+            {'g': 1, 'u': 1},
+        )
+
+        paris.delete()
+        self.assertEqual(cluster(2).count, 1)
+        self.assertAlmostEqual(cluster(2).longitude, 2.1204)
+
+    def test_pin_clusters_moved_in_bulk(self):
+        """Test a batch of points is written with a few queries"""
+        user = sample_user()
+        rand = random.Random(0)
+        points = [
+            (rand.uniform(-60, 70), rand.uniform(-180, 180))
+            for _ in range(1000)
+        ]
+        models.PinCluster.objects.move(user.id, added=points[:500])
+
+        with CaptureQueriesContext(connection) as queries:
+            models.PinCluster.objects.move(
+                user.id, added=points[500:], removed=points[:250]
+            )
+
+        # thousands of cells, written a batch per query
+        self.assertLess(len(queries), 50)
+
+        expected = {}
+        for latitude, longitude in points[250:]:
+            geohash = geo.encode(latitude, longitude)
+            for length in geo.CLUSTER_LENGTHS:
+                cell = geohash[:length]
+                expected[cell] = expected.get(cell, 0) + 1
+        self.assertEqual(
+            dict(models.PinCluster.objects.filter(user=user).values_list(
+                'cell', 'count'
+            )),
+            expected,
+        )
+
+    def test_search_index_follows_text_and_tags(self):
+        """Test postings follow title edits, tag links and tag renames"""
+        user = sample_user()
+        pin = models.Pin.objects.create(user=user, title='Birthday party')
+        tag = models.Tag.objects.create(user=user, name='Family')
+
+        def terms():
+            return dict(models.PinTerm.objects.filter(
+                pin=pin
+            ).values_list('term', 'weight'))
+
+        self.assertEqual(terms(), {'birthday': 3, 'party': 3})
+
+        pin.tags.add(tag)
+        self.assertEqual(terms()['family'], 2)
+
+        tag.name = 'Friends'
+        tag.save()
+        self.assertNotIn('family', terms())
+        self.assertEqual(terms()['friends'], 2)
+
+        tag.pin_set.clear()
+        self.assertNotIn('friends', terms())
+
+        pin.tags.add(tag)
+        tag.delete()
+        pin.title = 'Party party'
+        pin.save()
+        self.assertEqual(terms(), {'party': 6})
+
+    def test_search_index_dropped_with_user(self):
+        """Test deleting a user leaves no postings for its tagged pins"""
+        user = sample_user()
+        pin = models.Pin.objects.create(user=user, title='Birthday party')
+        pin.tags.add(models.Tag.objects.create(user=user, name='Family'))
+
+        user.delete()
+
+        self.assertFalse(models.PinTerm.objects.exists())
+
+    def test_user_deleted_without_per_pin_upkeep(self):
+        """Test deleting a user does not reindex or recount its pins"""
+        user = sample_user()
+        tags = [
+            models.Tag.objects.create(user=user, name=f'Tag {i}')
+            for i in range(10)
+        ]
+        for i in range(40):
+            pin = models.Pin.objects.create(
+                user=user, title=f'Pin {i}', latitude=i, longitude=i
+            )
+            pin.tags.add(*tags[:5])
+
+        with CaptureQueriesContext(connection) as queries:
+            user.delete()
+
+        self.assertLess(len(queries), 30)
+        self.assertFalse(models.Pin.objects.exists())
+        self.assertFalse(models.PinCluster.objects.exists())
+        self.assertFalse(models.PinTerm.objects.exists())
+
+    def test_search_ranks_matches(self):
+        """Test every word must match and title matches rank first"""
+        user = sample_user()
+        tag = models.Tag.objects.create(user=user, name='Beach')
+        in_tag = models.Pin.objects.create(user=user, title='Summer trip')
+        in_tag.tags.add(tag)
+        in_title = models.Pin.objects.create(
+            user=user, title='Beach summer'
+        )
+        models.Pin.objects.create(user=user, title='Beach winter')
+        models.Pin.objects.create(
+            user=sample_user('other@devansh.com'), title='Beach summer'
+        )
+
+        self.assertEqual(
+            models.Pin.objects.search(user, 'SUMMER beach!', 10),
+            [in_title.id, in_tag.id],
+        )
+        self.assertEqual(models.Pin.objects.search(user, '...', 10), [])
+
+    def test_geohash_prefix_ranges(self):
+        """Test covering cells become merged hash ranges"""
+        cells = geo.covering_cells(-1, 48, 3, 52)
+        self.assertLessEqual(len(cells), geo.MAX_CELLS)
+        self.assertTrue(all(
+            any(geo.encode(lat, lon).startswith(cell) for cell in cells)
+            for lat, lon in ((48.8566, 2.3522), (51.5074, -0.1278))
+        ))
+
+        self.assertEqual(
+            geo.prefix_ranges(['u4', 'u5', 'u7', 'zz']),
+            [('u4', 'u6'), ('u7', 'u8'), ('zz', None)],
+        )
+
     def test_pin_str(self):
         """Test the recipe string representation"""
         pin = models.Pin.objects.create(
@@ -0,0 +1,104 @@
+import datetime
+import marshal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Pin, RequestProfile, Tag
+from pins.cache import response_cache
+
+PINS_URL = reverse('pins:pin-list')
+
+
+class RequestProfileTests(TestCase):
+    """Test staff users can have their requests profiled"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@devansh.com',
+            'password',
+            is_staff=True,
+        )
+        pin = Pin.objects.create(
+            user=self.user, title='Eiffel Tower', date=datetime.date.today()
+        )
+        pin.tags.add(Tag.objects.create(user=self.user, name='Paris'))
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+        response_cache.cache.clear()
+
+    def test_profile_stored_with_phases(self):
+        """Test a flagged request is profiled phase by phase"""
+        res = self.client.get(PINS_URL, {'profile': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        profile = RequestProfile.objects.get(pk=res['X-Profile-Id'])
+        self.assertEqual(profile.user, self.user)
+        self.assertEqual(profile.path, f'{PINS_URL}?profile=1')
+        self.assertEqual(profile.status, 200)
+        for phase in ('auth', 'queryset', 'serializer', 'render'):
+            seconds = getattr(profile, f'{phase}_seconds')
+            self.assertGreater(seconds, 0)
+            self.assertLessEqual(seconds, profile.total_seconds)
+        self.assertTrue(marshal.loads(bytes(profile.stats)))
+
+    def test_header_flag(self):
+        """Test the X-Profile header asks for a profile too"""
+        res = self.client.get(PINS_URL, HTTP_X_PROFILE='1')
+
+        self.assertIn('X-Profile-Id', res)
+
+    def test_unflagged_and_non_staff_not_profiled(self):
+        """Test requests without the flag or from other users run as is"""
+        res = self.client.get(PINS_URL)
+        self.assertNotIn('X-Profile-Id', res)
+
+        self.user.is_staff = False
+        self.user.save()
+        res = self.client.get(PINS_URL, {'profile': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILES_KEPT=2)
+    def test_oldest_profiles_dropped(self):
+        """Test only the newest REQUEST_PROFILES_KEPT profiles are kept"""
+        ids = [
+            int(self.client.get(PINS_URL, {'profile': 1})['X-Profile-Id'])
+            for _ in range(3)
+        ]
+
+        self.assertEqual(
+            sorted(RequestProfile.objects.values_list('id', flat=True)),
+            ids[1:],
+        )
+
+    def test_profile_downloadable_from_admin(self):
+        """Test the admin shows the report and serves the statistics"""
+        profile_id = self.client.get(PINS_URL, {'profile': 1})['X-Profile-Id']
+        admin = get_user_model().objects.create_superuser(
+            'admin@devansh.com', 'password'
+        )
+        self.client.force_login(admin)
+
+        res = self.client.get(
+            reverse('admin:core_requestprofile_change', args=[profile_id])
+        )
+        self.assertContains(res, 'cumulative')
+
+        res = self.client.get(
+            reverse('admin:core_requestprofile_download', args=[profile_id])
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            marshal.loads(res.content),
+            marshal.loads(bytes(RequestProfile.objects.get().stats)),
+        )
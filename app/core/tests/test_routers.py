@@ -0,0 +1,109 @@
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.db import OperationalError, router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from core import checks, routers
+from core.middleware import ReplicaMiddleware
+from core.models import Pin, Tag
+from pins.views import PinTileView, PinViewSet
+from user.views import ManageUserView
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica1', 'replica2'],
+    REPLICA_CACHE='default',
+)
+class ReplicaRoutingTests(TestCase):
+    """Test reads of safe requests are sent to a reachable replica"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.replicas = {'replica1': Mock(), 'replica2': Mock()}
+        patcher = patch('core.middleware.connections', self.replicas)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def _read_alias(self, method, view, token='Token abc'):
+        """Run a request through the middleware, return where it read"""
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen.append(router.db_for_read(Pin))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        request = getattr(self.factory, method)(
+            '/', HTTP_AUTHORIZATION=token
+        )
+        middleware(request)
+        return seen[0]
+
+    def test_safe_requests_read_from_replica(self):
+        """Test the configured views read from a replica on GET"""
+        for view in (
+            PinViewSet.as_view({'get': 'list'}),
+            ManageUserView.as_view(),
+        ):
+            self.assertIn(self._read_alias('get', view), self.replicas)
+
+        self.assertIsNone(routers.read_alias())
+
+    def test_other_requests_read_from_primary(self):
+        """Test writes and views not configured read from the primary"""
+        pins = PinViewSet.as_view({'get': 'list', 'post': 'create'})
+
+        self.assertEqual(self._read_alias('post', pins), 'default')
+        self.assertEqual(
+            self._read_alias('get', PinTileView.as_view()), 'default'
+        )
+
+    def test_reads_stick_to_primary_after_write(self):
+        """Test a client that just wrote reads from the primary"""
+        pins = PinViewSet.as_view({'get': 'list', 'post': 'create'})
+        self._read_alias('post', pins)
+
+        self.assertEqual(self._read_alias('get', pins), 'default')
+        self.assertIn(
+            self._read_alias('get', pins, token='Token other'), self.replicas
+        )
+
+    def test_unreachable_replica_skipped(self):
+        """Test a replica failing to connect is skipped, then the primary"""
+        pins = PinViewSet.as_view({'get': 'list'})
+        self.replicas['replica1'].ensure_connection.side_effect = \
+            OperationalError
+
+        # Try replica1 first, so it is found down on the first request
+        with patch('core.middleware.random.shuffle'):
+            self.assertEqual(self._read_alias('get', pins), 'replica2')
+        for _ in range(4):
+            self.assertEqual(self._read_alias('get', pins), 'replica2')
+        self.assertEqual(
+            self.replicas['replica1'].ensure_connection.call_count, 1
+        )
+
+        self.replicas['replica2'].ensure_connection.side_effect = \
+            OperationalError
+        self.assertEqual(self._read_alias('get', pins), 'default')
+
+    def test_write_moves_request_to_primary(self):
+        """Test reads after a write in the same request use the primary"""
+        with routers.read_from('replica1'):
+            self.assertEqual(router.db_for_read(Tag), 'replica1')
+            self.assertEqual(router.db_for_write(Tag), 'default')
+            self.assertEqual(router.db_for_read(Tag), 'default')
+
+    def test_local_memory_cache_warned(self):
+        """Test replicas with a per-process cache raise a system warning"""
+        warnings = checks.check_replica_cache(None)
+        self.assertEqual([warning.id for warning in warnings], ['core.W001'])
+
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(checks.check_replica_cache(None), [])
+        with override_settings(REPLICA_CACHE='replicas'):
+            self.assertEqual(checks.check_replica_cache(None), [])
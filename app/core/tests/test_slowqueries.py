@@ -0,0 +1,91 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Pin, SlowQuery, Tag
+from pins.cache import response_cache
+
+PINS_URL = reverse('pins:pin-list')
+TAGS_URL = reverse('pins:tag-list')
+
+
+@override_settings(SLOW_QUERY_SECONDS=0, SLOW_QUERY_LOG_SIZE=100)
+class SlowQueryLogTests(TestCase):
+    """Test slow queries of requests are logged with their plan"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@devansh.com',
+            'password',
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Paris')
+        pin = Pin.objects.create(
+            user=self.user, title='Eiffel Tower', date=datetime.date.today()
+        )
+        pin.tags.add(self.tag)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def test_query_logged_with_view_and_plan(self):
+        """Test a query is logged with its caller and EXPLAIN output"""
+        res = self.client.get(PINS_URL, {'tags': self.tag.id})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        query = SlowQuery.objects.filter(sql__contains='core_pin_tags') \
+            .first()
+        self.assertEqual(query.view, 'pins.views.PinViewSet.list')
+        self.assertEqual(query.path, f'{PINS_URL}?tags={self.tag.id}')
+        self.assertEqual(query.alias, 'default')
+        self.assertIn(str(self.tag.id), query.params)
+        self.assertTrue(query.location.startswith('pins/'))
+        self.assertIn('core_pin', query.explain)
+
+    def test_writes_logged_with_serializer(self):
+        """Test a write names its serializer and is not explained"""
+        self.client.post(TAGS_URL, {'name': 'Rome'})
+
+        query = SlowQuery.objects.get(sql__startswith='INSERT')
+        self.assertEqual(query.view, 'pins.views.TagViewSet.create')
+        self.assertEqual(query.serializer, 'pins.serializers.TagSerializer')
+        self.assertEqual(query.explain, '')
+
+    @override_settings(SLOW_QUERY_LOG_SIZE=3)
+    def test_log_bounded(self):
+        """Test only the newest SLOW_QUERY_LOG_SIZE queries are kept"""
+        self.client.get(PINS_URL)
+        self.client.get(TAGS_URL)
+
+        self.assertEqual(SlowQuery.objects.count(), 3)
+        self.assertEqual(
+            SlowQuery.objects.latest('id').view, 'pins.views.TagViewSet.list'
+        )
+
+    @override_settings(SLOW_QUERY_SECONDS=None)
+    def test_log_off(self):
+        """Test nothing is logged without a threshold"""
+        self.client.get(PINS_URL)
+
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_log_in_admin(self):
+        """Test the logged queries can be browsed in the admin"""
+        self.client.get(PINS_URL)
+        admin = get_user_model().objects.create_superuser(
+            'admin@devansh.com', 'password'
+        )
+        self.client.force_login(admin)
+        query = SlowQuery.objects.first()
+
+        res = self.client.get(reverse('admin:core_slowquery_changelist'))
+        self.assertContains(res, 'pins.views.PinViewSet.list')
+
+        res = self.client.get(
+            reverse('admin:core_slowquery_change', args=[query.pk])
+        )
+        self.assertContains(res, 'SELECT')
@@ -0,0 +1,19 @@
+from django.http import HttpResponse
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+from core import metrics
+
+
+class MetricsView(APIView):
+    """Expose the request metrics of every worker to Prometheus"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.registry.render(), content_type=self.content_type
+        )
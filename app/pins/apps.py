@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PinsConfig(AppConfig):
     name = 'pins'
+
+    def ready(self):
+        from pins import signals  # noqa: F401
@@ -0,0 +1,100 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+
+from core.models import Pin, PinCluster, PinTerm, Tag
+from core.signals import pin_locations_changed
+
+
+def insert_pins(pins, batch_size):
+    """Insert pins in batches, making sure each one gets its primary key"""
+    if can_bulk_insert():
+        return Pin.objects.bulk_create(pins, batch_size=batch_size)
+
+    # Backends that cannot return ids from a multi-row insert (SQLite on
+    # older Django) would leave us unable to link tags, so fall back to
+    # one insert per pin.
+    for pin in pins:
+        pin.save(force_insert=True)
+    return pins
+
+
+def link_tags(links, batch_size):
+    """Insert (pin_id, tag_id) pairs into the pin tags through table"""
+    PinTag = Pin.tags.through
+    PinTag.objects.bulk_create(
+        (PinTag(pin_id=pin_id, tag_id=tag_id) for pin_id, tag_id in links),
+        batch_size=batch_size,
+    )
+
+
+def can_bulk_insert():
+    """Return whether bulk inserts fill in the primary keys of new pins"""
+    connection = connections[router.db_for_write(Pin)]
+    return connection.features.can_return_rows_from_bulk_insert
+
+
+def save_pins(user, items, batch_size=500):
+    """Create or replace pins for a user with batched writes
+
+    Each item is a dict of validated pin fields plus `tag_ids`. Items
+    carrying an `id` replace that pin and its tags, the rest are created.
+    Returns the saved pins in input order with `tag_ids` set on them.
+    """
+    pins = []
+    for item in items:
+        pin = Pin(
+            id=item.get('id'),
+            user=user,
+            title=item['title'],
+            link=item.get('link', ''),
+            date=item.get('date'),
+            latitude=item.get('latitude'),
+            longitude=item.get('longitude'),
+        )
+        pin.update_geohash()
+        pin.tag_ids = list(dict.fromkeys(item.get('tag_ids', [])))
+        pins.append(pin)
+
+    created = [pin for pin in pins if pin.id is None]
+    updated = [pin for pin in pins if pin.id is not None]
+
+    # Pins saved one by one already updated their clusters from signals
+    added = updated + created if can_bulk_insert() else list(updated)
+    removed = []
+    tag_deltas = Counter(
+        tag_id for pin in pins for tag_id in pin.tag_ids
+    )
+
+    with transaction.atomic():
+        insert_pins(created, batch_size)
+        if updated:
+            removed = list(Pin.objects.filter(
+                id__in=[pin.id for pin in updated]
+            ).values_list('latitude', 'longitude'))
+            Pin.objects.bulk_update(
+                updated,
+                ['title', 'link', 'latitude', 'longitude', 'geohash'],
+                batch_size=batch_size,
+            )
+            links = Pin.tags.through.objects.filter(
+                pin_id__in=[pin.id for pin in updated]
+            )
+            tag_deltas.subtract(links.values_list('tag_id', flat=True))
+            links.delete()
+
+        link_tags(
+            [(pin.id, tag_id) for pin in pins for tag_id in pin.tag_ids],
+            batch_size,
+        )
+        Tag.objects.count_pins(tag_deltas)
+        PinTerm.objects.reindex(pin.id for pin in pins)
+        points = [(pin.latitude, pin.longitude) for pin in added]
+        PinCluster.objects.move(user.pk, added=points, removed=removed)
+        pin_locations_changed.send(
+            sender=Pin, user_id=user.pk, points=points + removed
+        )
+        get_user_model().objects.bump_data_version(user.pk)
+
+    return pins
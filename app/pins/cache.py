@@ -0,0 +1,57 @@
+import hashlib
+
+from django.core.cache import caches
+
+
+class ResponseCache:
+    """Cache of list response data keyed by user data version
+
+    Every pin, tag and pin tag change bumps the owner's data version from
+    the model signal receivers, so entries for the old state are never
+    read again and age out of the backend's LRU. Hit and miss counters
+    are kept in the backend so all workers sharing it report together.
+    """
+    stats_keys = ('stats:hits', 'stats:misses')
+
+    def __init__(self, alias='responses'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, prefix, user, params):
+        """Return the cache key for a user and normalized parameters"""
+        modified = user.data_modified.timestamp() if user.data_modified else 0
+        query = '&'.join(f'{name}={value}' for name, value in params)
+        digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+        return (
+            f'{prefix}:{user.pk}:{user.data_version}:{modified}:{digest}'
+        )
+
+    def get(self, key):
+        """Return cached data for the key, counting the hit or miss"""
+        data = self.cache.get(key)
+        self._count(self.stats_keys[data is None])
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data)
+
+    def stats(self):
+        """Return the hit and miss counters"""
+        values = self.cache.get_many(self.stats_keys)
+        return {
+            'hits': values.get(self.stats_keys[0], 0),
+            'misses': values.get(self.stats_keys[1], 0),
+        }
+
+    def _count(self, key):
+        if not self.cache.add(key, 1, timeout=None):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, 1, timeout=None)
+
+
+response_cache = ResponseCache()
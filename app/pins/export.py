@@ -0,0 +1,48 @@
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from core.models import Pin
+
+
+def iter_pin_chunks(queryset, chunk_size):
+    """Yield lists of pin dicts with tag names, newest pins first
+
+    Chunks are read with the same (date, id) keyset used by the list
+    endpoint, so every chunk is an index range scan and only one chunk
+    is held in memory at a time.
+    """
+    queryset = queryset.order_by('-date', '-id').values(
+        'id', 'title', 'link', 'date', 'latitude', 'longitude'
+    )
+    position = None
+    while True:
+        chunk = queryset
+        if position is not None:
+            date, pk = position
+            chunk = chunk.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+        pins = list(chunk[:chunk_size])
+        if not pins:
+            return
+
+        tag_names = defaultdict(list)
+        links = Pin.tags.through.objects.filter(
+            pin_id__in=[pin['id'] for pin in pins]
+        ).values_list('pin_id', 'tag__name')
+        for pin_id, name in links:
+            tag_names[pin_id].append(name)
+        for pin in pins:
+            pin['tags'] = tag_names[pin['id']]
+
+        yield pins
+        position = (pins[-1]['date'], pins[-1]['id'])
+
+
+def iter_pins_ndjson(queryset, chunk_size=1000):
+    """Yield the pins as newline delimited JSON, one chunk at a time"""
+    for pins in iter_pin_chunks(queryset, chunk_size):
+        yield ''.join(
+            json.dumps(pin, cls=DjangoJSONEncoder) + '\n' for pin in pins
+        )
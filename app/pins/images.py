@@ -0,0 +1,159 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, transaction
+
+from core.models import Pin
+
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of each derivative, keyed by the Pin field that
+# records it.
+VARIANTS = {
+    'image_thumb': 256,
+    'image_marker': 64,
+    'image_preview': 1024,
+}
+VARIANTS_DIR = 'uploads/recipe/variants/'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def render_variants(source_path, media_root, stem):
+    """Write the resized variants of an image and return their names
+
+    Runs in a worker process, so it only touches the file system and
+    returns storage names relative to the media root. Images are stored
+    by content hash, so variants that already exist are reused; each one
+    is moved into place whole, as pins sharing an image may render it at
+    the same time.
+    """
+    directory = os.path.join(media_root, VARIANTS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    names = variant_names(stem)
+    missing = {
+        field: name for field, name in names.items()
+        if not os.path.exists(os.path.join(media_root, name))
+    }
+    if not missing:
+        return names
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for field, name in missing.items():
+            variant = image.copy()
+            variant.thumbnail((VARIANTS[field], VARIANTS[field]))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    variant.save(f, 'JPEG', quality=85)
+                if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                    os.chmod(tmp_path, settings.FILE_UPLOAD_PERMISSIONS)
+                os.replace(tmp_path, os.path.join(media_root, name))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    return names
+
+
+def variant_names(stem):
+    """Return the storage names of the variants of an image"""
+    return {
+        field: f'{VARIANTS_DIR}{stem}-{field[6:]}.jpg'
+        for field in VARIANTS
+    }
+
+
+def get_executor():
+    """Return the shared process pool, starting it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PIN_IMAGE_WORKERS
+            )
+        return _executor
+
+
+def schedule_variants(pin):
+    """Mark the pin image pending and render its variants off the request
+
+    Rendering starts once the transaction saving the image commits. With
+    PIN_IMAGE_WORKERS set to 0 the variants are rendered inline instead
+    of in the process pool.
+    """
+    if Pin.objects.filter(pk=pin.pk).update(
+        image_status=Pin.IMAGE_PENDING,
+        image_thumb=None,
+        image_marker=None,
+        image_preview=None,
+    ):
+        get_user_model().objects.bump_data_version(pin.user_id)
+    pin.image_status = Pin.IMAGE_PENDING
+    transaction.on_commit(partial(_submit, pin.pk, pin.image.name))
+
+
+def generate_variants(pin_id, image_name):
+    """Render and record the variants of a pin image in this process"""
+    try:
+        names = render_variants(*_render_args(image_name))
+    except Exception:
+        logger.exception('Rendering variants of %s failed', image_name)
+        names = None
+    _store_variants(pin_id, image_name, names)
+
+
+def _render_args(image_name):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    source_path = os.path.join(settings.MEDIA_ROOT, image_name)
+    return source_path, settings.MEDIA_ROOT, stem
+
+
+def _submit(pin_id, image_name):
+    if not settings.PIN_IMAGE_WORKERS:
+        generate_variants(pin_id, image_name)
+        return
+
+    future = get_executor().submit(render_variants, *_render_args(image_name))
+    future.add_done_callback(partial(_on_rendered, pin_id, image_name))
+
+
+def _on_rendered(pin_id, image_name, future):
+    close_old_connections()
+    try:
+        names = future.result()
+    except Exception:
+        logger.exception('Rendering variants of %s failed', image_name)
+        names = None
+    try:
+        _store_variants(pin_id, image_name, names)
+    finally:
+        close_old_connections()
+
+
+def _store_variants(pin_id, image_name, names):
+    """Record rendered variants unless the pin image changed meanwhile
+
+    The owner's data version is bumped, so conditional requests and
+    cached lists see the new image status.
+    """
+    pins = Pin.objects.filter(pk=pin_id, image=image_name)
+    user_id = pins.values_list('user_id', flat=True).first()
+    if user_id is None:
+        return
+    if names is None:
+        updated = pins.update(image_status=Pin.IMAGE_FAILED)
+    else:
+        updated = pins.update(image_status=Pin.IMAGE_READY, **names)
+    if updated:
+        get_user_model().objects.bump_data_version(user_id)
@@ -0,0 +1,186 @@
+import csv
+import io
+import json
+
+from rest_framework import serializers
+
+from core.models import Tag
+from pins import bulk
+from pins.validators import validate_location
+
+
+FORMATS = ('csv', 'ndjson')
+INVALID_UTF8 = 'Invalid UTF-8.'
+
+
+class PinImportRowSerializer(serializers.Serializer):
+    """Validate one imported pin"""
+    title = serializers.CharField(max_length=255)
+    link = serializers.CharField(max_length=255, allow_blank=True, default='')
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        default=list,
+    )
+    latitude = serializers.FloatField(
+        min_value=-90, max_value=90, allow_null=True, default=None
+    )
+    longitude = serializers.FloatField(
+        min_value=-180, max_value=180, allow_null=True, default=None
+    )
+
+    def validate(self, attrs):
+        return validate_location(attrs)
+
+
+def guess_format(filename):
+    """Return the import format implied by a file name, if any"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+
+def read_csv(stream):
+    """Yield (line number, row) pairs from a CSV text stream
+
+    The tags column holds tag names separated by `|`, and empty
+    latitude and longitude cells mean the pin has no location.
+    """
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:
+            # DictReader only updates its line_num after a good row
+            yield reader.reader.line_num, exc
+            continue
+        cells = [*row, *row.values(), *row.get(None, ())]
+        if not _is_utf8(cell for cell in cells if isinstance(cell, str)):
+            yield reader.line_num, ValueError(INVALID_UTF8)
+            continue
+        for field in ('latitude', 'longitude'):
+            if row.get(field) == '':
+                row[field] = None
+        tags = row.get('tags') or ''
+        row['tags'] = [
+            name.strip() for name in tags.split('|') if name.strip()
+        ]
+        yield reader.line_num, row
+
+
+def read_ndjson(stream):
+    """Yield (line number, row) pairs from an NDJSON text stream"""
+    for line_num, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        if not _is_utf8([line]):
+            yield line_num, ValueError(INVALID_UTF8)
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            row = exc
+        yield line_num, row
+
+
+def _is_utf8(texts):
+    """Return whether texts decoded with surrogateescape were UTF-8"""
+    try:
+        for text in texts:
+            text.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+class PinImporter:
+    """Import pins for a user from a CSV or NDJSON stream
+
+    Rows are parsed one at a time and written in batches of `batch_size`
+    through the bulk pin writer, each batch in its own transaction. Tag
+    names are resolved against a map of the user's tags built once, and
+    names seen for the first time in a batch are created together.
+    """
+
+    def __init__(self, user, batch_size=1000,
+                 on_error=None, on_progress=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.created = 0
+        self.failed = 0
+        self.tag_ids = dict(
+            Tag.objects.filter(user=user).values_list('name', 'id')
+        )
+
+    def run(self, stream, format):
+        """Import every row of a binary stream, return (created, failed)
+
+        Bytes that are not UTF-8 fail the rows holding them.
+        """
+        text = io.TextIOWrapper(
+            stream, encoding='utf-8', errors='surrogateescape', newline=''
+        )
+        rows = read_csv(text) if format == 'csv' else read_ndjson(text)
+
+        batch = []
+        for line_num, row in rows:
+            item = self._validate(line_num, row)
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+        text.detach()
+        return self.created, self.failed
+
+    def _validate(self, line_num, row):
+        if isinstance(row, Exception):
+            self._error(line_num, str(row), row)
+            return None
+        if not isinstance(row, dict):
+            self._error(line_num, 'Expected an object.', row)
+            return None
+
+        serializer = PinImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            self._error(line_num, json.dumps(serializer.errors), row)
+            return None
+        return serializer.validated_data
+
+    def _write(self, batch):
+        names = {name for item in batch for name in item['tags']}
+        missing = [name for name in names if name not in self.tag_ids]
+        if missing:
+            tags = Tag.objects.resolve_names(self.user, missing)
+            self.tag_ids.update(
+                (name, tag.id) for name, tag in tags.items()
+            )
+
+        bulk.save_pins(self.user, [
+            {
+                'title': item['title'],
+                'link': item['link'],
+                'latitude': item['latitude'],
+                'longitude': item['longitude'],
+                'tag_ids': [self.tag_ids[name] for name in item['tags']],
+            }
+            for item in batch
+        ], batch_size=self.batch_size)
+
+        self.created += len(batch)
+        if self.on_progress is not None:
+            self.on_progress(self.created, self.failed)
+
+    def _error(self, line_num, message, row):
+        self.failed += 1
+        if self.on_error is not None:
+            self.on_error(line_num, message, row)
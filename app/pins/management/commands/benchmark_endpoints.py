@@ -0,0 +1,242 @@
+import io
+import json
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+from queue import Empty, SimpleQueue
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.models import Pin
+from pins import seed
+
+ENDPOINTS = (
+    'pins:pin-list', 'pins:pin-detail', 'pins:tag-list',
+    'pins:pin-upload-image', 'user:token',
+)
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic dataset and time requests to the API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--pins', type=int, default=1000,
+                            help='Pins per user')
+        parser.add_argument('--tags', type=int, default=50,
+                            help='Tags per user')
+        parser.add_argument('--links', type=int, default=3,
+                            help='Tags linked to each pin')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests timed per endpoint')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument(
+            '--endpoints',
+            default=','.join(ENDPOINTS),
+            help='Comma separated URL names to time'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='benchmark-endpoints')
+        parser.add_argument(
+            '--reuse',
+            action='store_true',
+            help='Time the users already seeded under the prefix'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the seeded users and pins afterwards, reused ones '
+                 'are always kept'
+        )
+        parser.add_argument('--output', help='Write the results as JSON')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'].split(',')
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(
+                'Unknown endpoints: {}'.format(', '.join(sorted(unknown)))
+            )
+
+        prefix = options['prefix']
+        if not prefix:
+            raise CommandError('The prefix may not be empty')
+
+        self.random = random.Random(options['seed'])
+        self.image = self._image()
+        # Only the exact emails seed_dataset gives, never other accounts
+        users = get_user_model().objects.filter(
+            email__regex=r'^{}[0-9]+@example\.com$'.format(re.escape(prefix))
+        )
+        if not options['reuse']:
+            if users.exists():
+                raise CommandError(
+                    f'Users are already seeded under "{prefix}", pass '
+                    '--reuse or another --prefix'
+                )
+            seed.seed_dataset(
+                options['users'], options['pins'], options['tags'],
+                options['links'], prefix=options['prefix'],
+                seed=options['seed'],
+            )
+        try:
+            self.accounts = self._accounts(users.order_by('id'))
+            if not self.accounts:
+                raise CommandError('No users seeded under the prefix')
+            # Requests come from the test client's host
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+            ):
+                results = {
+                    name: self._time(
+                        name, options['requests'], options['concurrency']
+                    )
+                    for name in endpoints
+                }
+        finally:
+            if not options['keep'] and not options['reuse']:
+                users.delete()
+
+        self._report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'commit': self._commit(),
+                    'created': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'options': {
+                        name: options[name] for name in (
+                            'users', 'pins', 'tags', 'links', 'requests',
+                            'concurrency', 'seed', 'reuse',
+                        )
+                    },
+                    'endpoints': results,
+                }, output, indent=2)
+
+    def _accounts(self, users):
+        """Return (user, token key, pin ids) for the seeded users"""
+        tokens = {
+            token.user_id: token.key
+            for token in Token.objects.filter(user__in=users)
+        }
+        Token.objects.bulk_create(
+            Token(user=user, key=Token().generate_key())
+            for user in users if user.pk not in tokens
+        )
+        tokens.update(
+            Token.objects.filter(user__in=users).values_list('user_id', 'key')
+        )
+        return [
+            (user, tokens[user.pk], list(
+                Pin.objects.filter(user=user).values_list('id', flat=True)
+            ))
+            for user in users
+        ]
+
+    def _image(self):
+        out = io.BytesIO()
+        Image.new('RGB', (640, 480), 'steelblue').save(out, format='JPEG')
+        return out.getvalue()
+
+    def _request(self, name):
+        """Build the (method, url, data, headers) of a request"""
+        user, token, pin_ids = self.random.choice(self.accounts)
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'}
+        if name == 'user:token':
+            return 'post', reverse(name), {
+                'email': user.email, 'password': seed.PASSWORD
+            }, {}
+        if name in ('pins:pin-list', 'pins:tag-list'):
+            return 'get', reverse(name), None, headers
+        pin_id = self.random.choice(pin_ids)
+        if name == 'pins:pin-detail':
+            return 'get', reverse(name, args=[pin_id]), None, headers
+        image = SimpleUploadedFile('benchmark.jpg', self.image, 'image/jpeg')
+        return 'post', reverse(name, args=[pin_id]), {'image': image}, headers
+
+    def _work(self, requests, timings):
+        """Send queued requests until none are left, recording timings"""
+        client = Client(raise_request_exception=False)
+        try:
+            while True:
+                try:
+                    method, url, data, headers = requests.get_nowait()
+                except Empty:
+                    return
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, data, **headers)
+                    elapsed = time.perf_counter() - start
+                timings.append((
+                    elapsed * 1000, len(queries), response.status_code >= 400
+                ))
+        finally:
+            connection.close()
+
+    def _time(self, name, count, concurrency):
+        requests = SimpleQueue()
+        for _ in range(count):
+            requests.put(self._request(name))
+        timings = []
+        workers = [
+            threading.Thread(target=self._work, args=(requests, timings))
+            for _ in range(concurrency)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - start
+
+        latencies = sorted(timing[0] for timing in timings)
+        return {
+            'requests': count,
+            'errors': sum(timing[2] for timing in timings),
+            'p50_ms': self._percentile(latencies, 50),
+            'p95_ms': self._percentile(latencies, 95),
+            'p99_ms': self._percentile(latencies, 99),
+            'mean_ms': statistics.mean(latencies),
+            'throughput_rps': count / wall,
+            'queries_per_request': statistics.mean(
+                timing[1] for timing in timings
+            ),
+        }
+
+    def _percentile(self, values, percent):
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'],
+                capture_output=True, check=True, text=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _report(self, results):
+        self.stdout.write(
+            'endpoint\tp50 ms\tp95 ms\tp99 ms\treq/s\tqueries\terrors'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                '{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.1f}\t{:.1f}\t{}'.format(
+                    name, result['p50_ms'], result['p95_ms'],
+                    result['p99_ms'], result['throughput_rps'],
+                    result['queries_per_request'], result['errors'],
+                )
+            )
@@ -0,0 +1,83 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Pin
+
+
+class Command(BaseCommand):
+    help = 'Time nearest pin lookups for users with growing numbers of pins'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,100000,1000000',
+            help='Comma separated numbers of pins to seed'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=50,
+            help='Lookups timed per size'
+        )
+        parser.add_argument('-k', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        self.stdout.write('pins\tmedian ms\tp95 ms')
+        # Everything is seeded inside one transaction that is rolled back
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(
+                'benchmark-nearest@localhost', None
+            )
+            seeded = 0
+            for size in sizes:
+                self._seed(user, size - seeded)
+                seeded = size
+                timings = self._time(user, options['queries'], options['k'])
+                self.stdout.write('{}\t{:.2f}\t{:.2f}'.format(
+                    size,
+                    statistics.median(timings),
+                    sorted(timings)[int(len(timings) * 0.95)],
+                ))
+            transaction.set_rollback(True)
+
+    def _point(self):
+        """Return a random point in the inhabited latitudes"""
+        return (
+            self.random.uniform(-60, 70),
+            self.random.uniform(-180, 180),
+        )
+
+    def _seed(self, user, count):
+        for start in range(0, count, self.batch_size):
+            pins = []
+            for _ in range(min(self.batch_size, count - start)):
+                latitude, longitude = self._point()
+                pin = Pin(
+                    user=user,
+                    title='Benchmark pin',
+                    latitude=latitude,
+                    longitude=longitude,
+                )
+                pin.update_geohash()
+                pins.append(pin)
+            Pin.objects.bulk_create(pins)
+
+    def _time(self, user, queries, k):
+        timings = []
+        for _ in range(queries):
+            latitude, longitude = self._point()
+            start = time.perf_counter()
+            Pin.objects.nearest(user, latitude, longitude, k)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
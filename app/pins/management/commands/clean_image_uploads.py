@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import ImageUpload
+from pins import uploads
+
+
+class Command(BaseCommand):
+    help = 'Discard resumable image uploads that were never completed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Discard uploads started more than this many hours ago'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(hours=options['hours'])
+        stale = ImageUpload.objects.filter(created__lt=cutoff)
+
+        count = 0
+        for upload in stale.iterator():
+            uploads.discard(upload)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Discarded {count} uploads'))
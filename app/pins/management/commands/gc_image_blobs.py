@@ -0,0 +1,118 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ImageBlob, Pin
+from pins import images
+
+
+class Command(BaseCommand):
+    help = 'Remove stored pin images that no pin references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=int,
+            default=24,
+            help='Keep blobs released or written within this many hours'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be removed'
+        )
+
+    def handle(self, *args, **options):
+        self.storage = Pin._meta.get_field('image').storage
+        self.dry_run = options['dry_run']
+        self.cutoff = timezone.now() - datetime.timedelta(
+            hours=options['grace_hours']
+        )
+
+        self.removed = 0
+        orphans = ImageBlob.objects.filter(
+            ref_count=0, updated__lt=self.cutoff
+        )
+        for blob in orphans.iterator():
+            if self._is_recent(blob.name):
+                continue
+            if self.dry_run:
+                self._purge(blob.name)
+            else:
+                self._collect(blob)
+
+        self._purge_untracked()
+        verb = 'Would remove' if self.dry_run else 'Removed'
+        self.stdout.write(
+            self.style.SUCCESS(f'{verb} {self.removed} blobs')
+        )
+
+    def _collect(self, blob):
+        """Delete the row of an orphaned blob, then its files once unused"""
+        with transaction.atomic():
+            # The row stays locked until it is gone, so a reference taken
+            # meanwhile either lands first or creates a new row
+            if not ImageBlob.objects.select_for_update().filter(
+                pk=blob.pk, ref_count=0, updated__lt=self.cutoff
+            ).exists() or self._is_recent(blob.name):
+                return
+            ImageBlob.objects.filter(pk=blob.pk).delete()
+            transaction.on_commit(lambda: self._purge_unused(blob.name))
+
+    def _purge_unused(self, name):
+        """Purge a blob unless a save has reused it since it was checked
+
+        Saves of the same content refresh the file before they take a
+        reference, so a reused blob is either recent or tracked again.
+        """
+        if self._is_recent(name) or ImageBlob.objects.filter(
+            name=name
+        ).exists():
+            return
+        self._purge(name)
+
+    def _purge_untracked(self):
+        """Remove old blob files that never got a reference"""
+        blob_dir = self.storage.blob_dir
+        if not self.storage.exists(blob_dir):
+            return
+
+        prefixes, _ = self.storage.listdir(blob_dir)
+        for prefix in prefixes:
+            _, files = self.storage.listdir(f'{blob_dir}/{prefix}')
+            names = [f'{blob_dir}/{prefix}/{file}' for file in files]
+            tracked = set(ImageBlob.objects.filter(
+                name__in=names
+            ).values_list('name', flat=True))
+            for name in names:
+                if name in tracked:
+                    continue
+                if self.dry_run:
+                    if not self._is_recent(name):
+                        self._purge(name)
+                else:
+                    self._purge_unused(name)
+
+    def _is_recent(self, name):
+        try:
+            modified = self.storage.get_modified_time(name)
+        except FileNotFoundError:
+            return False
+        return modified >= self.cutoff
+
+    def _purge(self, name):
+        self.stdout.write(f'Removing {name}')
+        self.removed += 1
+        if self.dry_run:
+            return
+
+        self.storage.purge(name)
+        stem = os.path.splitext(os.path.basename(name))[0]
+        for variant in images.variant_names(stem).values():
+            path = os.path.join(settings.MEDIA_ROOT, variant)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from pins import seed
+
+
+class Command(BaseCommand):
+    help = 'Generate a large deterministic dataset of users, tags and pins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--pins', type=int, default=1000,
+                            help='Pins per user')
+        parser.add_argument('--tags', type=int, default=50,
+                            help='Tags per user')
+        parser.add_argument('--links', type=int, default=3,
+                            help='Tags linked to each pin')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix',
+            default='generated',
+            help='Users are named <prefix><index>@example.com'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes generating chunks in parallel'
+        )
+        parser.add_argument(
+            '--chunk-pins',
+            type=int,
+            default=50000,
+            help='Pins written per chunk transaction'
+        )
+
+    def handle(self, *args, **options):
+        users = options['users']
+        taken = get_user_model().objects.filter(email__in=[
+            seed.email(options['prefix'], index)
+            for index in {0, users - 1}
+        ])
+        if taken.exists():
+            raise CommandError(
+                'Users with the prefix {!r} already exist'.format(
+                    options['prefix']
+                )
+            )
+
+        start = time.perf_counter()
+        seed.seed_dataset(
+            users, options['pins'], options['tags'], options['links'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            workers=options['workers'],
+            chunk_pins=options['chunk_pins'],
+        )
+        elapsed = time.perf_counter() - start
+
+        pins = users * options['pins']
+        self.stdout.write(self.style.SUCCESS(
+            'Generated {} users, {} tags, {} pins and {} tag links in '
+            '{:.1f}s ({:.0f} pins/s); the password is {!r}'.format(
+                users,
+                users * options['tags'],
+                pins,
+                pins * min(options['links'], options['tags']),
+                elapsed,
+                pins / elapsed if elapsed else 0,
+                seed.PASSWORD,
+            )
+        ))
@@ -0,0 +1,71 @@
+import csv
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from pins.importer import FORMATS, PinImporter, guess_format
+
+
+class Command(BaseCommand):
+    help = 'Import pins for a user from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to import for')
+        parser.add_argument('path', help='File to import, - for stdin')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--errors',
+            help='Write rejected rows to this CSV file'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        if format is None:
+            raise CommandError('Could not tell the format, use --format')
+
+        error_file = None
+        self.error_writer = None
+        if options['errors']:
+            error_file = open(options['errors'], 'w', newline='')
+            self.error_writer = csv.writer(error_file)
+            self.error_writer.writerow(['line', 'error', 'row'])
+
+        importer = PinImporter(
+            user,
+            batch_size=options['batch_size'],
+            on_error=self.write_error,
+            on_progress=self.write_progress,
+        )
+        try:
+            if path == '-':
+                created, failed = importer.run(sys.stdin.buffer, format)
+            else:
+                with open(path, 'rb') as stream:
+                    created, failed = importer.run(stream, format)
+        finally:
+            if error_file is not None:
+                error_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {created} pins imported, {failed} rejected'
+        ))
+
+    def write_error(self, line, message, row):
+        """Record a rejected row in the error file"""
+        if self.error_writer is None:
+            return
+        if isinstance(row, Exception):
+            row = None
+        self.error_writer.writerow([line, message, json.dumps(row)])
+
+    def write_progress(self, created, failed):
+        self.stdout.write(f'{created} pins imported, {failed} rejected')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Tag
+
+
+class Command(BaseCommand):
+    help = 'Recompute the pin counts of tags from their pin links'
+
+    def handle(self, *args, **options):
+        repaired = Tag.objects.recount_pins()
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} tags'))
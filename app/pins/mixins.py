@@ -0,0 +1,139 @@
+import calendar
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from rest_framework.response import Response
+
+from core import metrics
+from pins.cache import response_cache
+
+
+class NotModified(Exception):
+    """Short-circuit a request with a ready 304 response"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class DataVersionConditionalMixin:
+    """Answer conditional GETs from the user's data version
+
+    The user's data version changes whenever one of their pins, tags or
+    pin tag links does, so it identifies the state of every list and
+    detail response. Matching If-None-Match or If-Modified-Since headers
+    are answered with a 304 before any queryset is built.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_etag(self):
+        """Return the entity tag for the user's current data"""
+        user = self.request.user
+        return f'"{user.pk}-{user.data_version}"'
+
+    def get_last_modified(self):
+        """Return the time the user's data last changed as a timestamp"""
+        modified = self.request.user.data_modified
+        if modified is None:
+            return None
+        return calendar.timegm(modified.utctimetuple())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self._is_conditional(request):
+            response = get_conditional_response(
+                request._request,
+                etag=self.get_etag(),
+                last_modified=self.get_last_modified(),
+            )
+            if response is not None:
+                raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self._is_conditional(request) and response.status_code == 200:
+            response['ETag'] = self.get_etag()
+            last_modified = self.get_last_modified()
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def _is_conditional(self, request):
+        return (
+            request.method in ('GET', 'HEAD') and
+            self.action in self.conditional_actions and
+            request.user.is_authenticated
+        )
+
+
+class SerializationMetricsMixin:
+    """Count serializing list and detail data as serialization in the metrics
+
+    The JSON renderer only counts turning the data into bytes, while
+    building it from the instances is usually the larger part.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(
+            queryset if page is None else page, many=True
+        )
+        with metrics.serializing():
+            data = serializer.data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        with metrics.serializing():
+            data = serializer.data
+        return Response(data)
+
+
+class CachedListMixin:
+    """Serve list responses from the shared response cache
+
+    Entries are keyed by the user, their data version, the host and the
+    query parameters named in `cache_query_params` after normalizing, so
+    `?tags=2,1` and `?tags=1,2,2` share an entry.
+    """
+    cache_query_params = ()
+
+    def list(self, request, *args, **kwargs):
+        key = response_cache.make_key(
+            self.basename, request.user, self.get_cache_params(request)
+        )
+        data = response_cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_cache_params(self, request):
+        """Return the normalized query parameters the list depends on"""
+        params = [('host', request.get_host())]
+        for name in self.cache_query_params:
+            value = request.query_params.get(name)
+            if value:
+                params.append((name, self.normalize_cache_param(name, value)))
+        return params
+
+    def normalize_cache_param(self, name, value):
+        """Return a canonical form of a query parameter value"""
+        return value
@@ -0,0 +1,121 @@
+import base64
+import binascii
+import datetime
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PinCursorPagination(BasePagination):
+    """Keyset pagination over (date, id), newest pins first
+
+    Every page is fetched with a range predicate on the
+    (user, -date, -id) index instead of an OFFSET, so requesting page N
+    costs the same as requesting the first page.
+    """
+    page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        reverse, position = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by('date', 'id')
+            if position is not None:
+                date, pk = position
+                queryset = queryset.filter(
+                    Q(date__gt=date) | Q(date=date, id__gt=pk)
+                )
+        else:
+            queryset = queryset.order_by('-date', '-id')
+            if position is not None:
+                date, pk = position
+                queryset = queryset.filter(
+                    Q(date__lt=date) | Q(date=date, id__lt=pk)
+                )
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        self.page = results[:page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        page_size = self.page_size
+        value = request.query_params.get(self.page_size_query_param)
+        if value:
+            try:
+                page_size = int(value)
+            except ValueError:
+                pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(
+                self.base_url, self.cursor_query_param
+            )
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(
+                self.base_url, self.cursor_query_param
+            )
+        return self.encode_cursor(True, self.page[0])
+
+    def encode_cursor(self, reverse, pin):
+        """Return a URL pointing at the page after (or before) the pin"""
+        raw = f'{int(reverse)}|{pin.date.isoformat()}|{pin.id}'
+        cursor = base64.urlsafe_b64encode(raw.encode('ascii'))
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor.decode('ascii')
+        )
+
+    def decode_cursor(self, request):
+        """Return a (reverse, position) pair for the requested cursor"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii'))
+            reverse, date, pk = raw.decode('ascii').split('|')
+            position = (
+                datetime.date.fromisoformat(date),
+                int(pk),
+            )
+            return bool(int(reverse)), position
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,249 @@
+"""Synthetic datasets of users with tagged pins, for benchmarks
+
+Datasets are generated in chunks of users, possibly by several worker
+processes, and each chunk is written by the calling process in one
+transaction, with COPY on PostgreSQL and batched inserts elsewhere. The
+derived tables (tag pin counts, clusters and search postings) are
+computed alongside, so no signal or per row query runs.
+
+Every user draws from a random generator seeded with the dataset seed
+and the user's index, and users, tags and pins get keys computed from
+those indexes. The same options therefore produce the same data however
+the chunks are spread over worker processes.
+"""
+import datetime
+import io
+import multiprocessing
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from core import geo, search
+from core.models import Pin, PinCluster, PinTerm, Tag
+
+PASSWORD = 'benchmark'
+WORDS = (
+    'museum', 'park', 'cafe', 'bridge', 'market', 'garden', 'tower',
+    'beach', 'castle', 'library', 'station', 'harbor', 'gallery', 'lake',
+)
+FIRST_DATE = datetime.date(2015, 1, 1)
+DAYS = 3650
+
+
+def email(prefix, index):
+    """Return the email of a seeded user"""
+    return f'{prefix}{index}@example.com'
+
+
+class Table:
+    """Column order and defaults of the rows written to a model's table"""
+
+    def __init__(self, model, with_pk=True):
+        self.model = model
+        self.fields = [
+            field for field in model._meta.concrete_fields
+            if with_pk or not field.primary_key
+        ]
+        self.defaults = [field.get_default() for field in self.fields]
+        self.positions = {
+            field.attname: position
+            for position, field in enumerate(self.fields)
+        }
+
+    def row(self, **values):
+        row = self.defaults.copy()
+        for name, value in values.items():
+            row[self.positions[name]] = value
+        return tuple(row)
+
+    def write(self, rows):
+        """Insert rows with COPY or a batched insert"""
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = ', '.join(quote(field.column) for field in self.fields)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.copy_expert(
+                    f'COPY {table} ({columns}) FROM STDIN',
+                    io.StringIO(''.join(
+                        '\t'.join(map(_copy_value, row)) + '\n'
+                        for row in rows
+                    )),
+                )
+            else:
+                placeholders = ', '.join(['%s'] * len(self.fields))
+                cursor.executemany(
+                    f'INSERT INTO {table} ({columns}) '
+                    f'VALUES ({placeholders})',
+                    rows,
+                )
+
+
+def _copy_value(value):
+    """Format a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def seed_dataset(users, pins, tags, links, prefix='bench', seed=0,
+                 workers=1, chunk_pins=50000):
+    """Create users each with `tags` tags and `pins` pins
+
+    Every pin is linked to `links` distinct tags of its owner. All users
+    share the password PASSWORD, hashed once. Chunks of users holding
+    about `chunk_pins` pins are generated by `workers` processes.
+    """
+    User = get_user_model()
+    plan = {
+        'users': users, 'pins': pins, 'tags': tags,
+        'links': min(links, tags), 'prefix': prefix, 'seed': seed,
+        'password': make_password(PASSWORD),
+        'first_user': _next_id(User),
+        'first_tag': _next_id(Tag),
+        'first_pin': _next_id(Pin),
+    }
+    chunk_users = max(1, chunk_pins // max(pins, 1))
+    chunks = [
+        (start, min(start + chunk_users, users))
+        for start in range(0, users, chunk_users)
+    ]
+
+    tables = _tables()
+    if workers > 1:
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            chunk_rows = executor.map(
+                _generate_chunk, [plan] * len(chunks), chunks
+            )
+            for rows in chunk_rows:
+                _write_chunk(tables, rows)
+    else:
+        for chunk in chunks:
+            _write_chunk(tables, _generate_chunk(plan, chunk))
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Tag, Pin]
+            ):
+                cursor.execute(sql)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def _tables():
+    """Return the tables written, in foreign key order"""
+    return {
+        'users': Table(get_user_model()),
+        'tags': Table(Tag),
+        'pins': Table(Pin),
+        'links': Table(Pin.tags.through, with_pk=False),
+        'clusters': Table(PinCluster, with_pk=False),
+        'terms': Table(PinTerm, with_pk=False),
+    }
+
+
+def _generate_chunk(plan, chunk):
+    """Return the rows of the users of a (start, stop) index range"""
+    tables = _tables()
+    rows = {name: [] for name in tables}
+    for index in range(*chunk):
+        _generate_user(plan, index, tables, rows)
+    return rows
+
+
+def _write_chunk(tables, rows):
+    with transaction.atomic():
+        for name, table in tables.items():
+            table.write(rows[name])
+
+
+def _generate_user(plan, index, tables, rows):
+    rand = random.Random(f"{plan['seed']}:{index}")
+    user_id = plan['first_user'] + index
+    rows['users'].append(tables['users'].row(
+        id=user_id,
+        email=email(plan['prefix'], index),
+        password=plan['password'],
+    ))
+
+    first_tag = plan['first_tag'] + index * plan['tags']
+    tag_ids = range(first_tag, first_tag + plan['tags'])
+    tag_names = {tag_id: f'Tag {tag_id - first_tag}' for tag_id in tag_ids}
+    pin_counts = Counter()
+    clusters = {}
+
+    first_pin = plan['first_pin'] + index * plan['pins']
+    for pin_id in range(first_pin, first_pin + plan['pins']):
+        title = ' '.join(rand.sample(WORDS, 2))
+        latitude = rand.uniform(-60, 70)
+        longitude = rand.uniform(-180, 180)
+        geohash = geo.encode(latitude, longitude)
+        rows['pins'].append(tables['pins'].row(
+            id=pin_id,
+            user_id=user_id,
+            title=title,
+            date=(
+                FIRST_DATE + datetime.timedelta(days=rand.randrange(DAYS))
+            ).isoformat(),
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geohash,
+        ))
+
+        pin_tags = rand.sample(tag_ids, plan['links'])
+        pin_counts.update(pin_tags)
+        rows['links'].extend(
+            tables['links'].row(pin_id=pin_id, tag_id=tag_id)
+            for tag_id in pin_tags
+        )
+        weights = search.weigh(
+            title, '', [tag_names[tag_id] for tag_id in pin_tags]
+        )
+        rows['terms'].extend(
+            tables['terms'].row(
+                user_id=user_id, term=term, pin_id=pin_id, weight=weight
+            )
+            for term, weight in weights.items()
+        )
+        for length in geo.CLUSTER_LENGTHS:
+            cluster = clusters.setdefault(geohash[:length], [0, 0.0, 0.0])
+            cluster[0] += 1
+            cluster[1] += latitude
+            cluster[2] += longitude
+
+    rows['tags'].extend(
+        tables['tags'].row(
+            id=tag_id,
+            user_id=user_id,
+            name=tag_names[tag_id],
+            pin_count=pin_counts[tag_id],
+        )
+        for tag_id in tag_ids
+    )
+    rows['clusters'].extend(
+        tables['clusters'].row(
+            user_id=user_id,
+            length=len(cell),
+            cell=cell,
+            count=count,
+            latitude_sum=latitude_sum,
+            longitude_sum=longitude_sum,
+        )
+        for cell, (count, latitude_sum, longitude_sum) in clusters.items()
+    )
@@ -1,45 +1,252 @@
 
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import serializers
 
 
-from core.models import Tag, Pin
+from core.models import ImageUpload, Tag, Pin, PinCluster
+from pins import bulk
+from pins.importer import FORMATS, guess_format
+from pins.validators import validate_location
 
 
 class TagSerializer(serializers.ModelSerializer):
     """Serializer for tag object"""
+    default_error_messages = {
+        'unique_name': _('A tag with this name already exists.'),
+    }
 
     class Meta:
         model = Tag
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'pin_count')
         read_only_Fields = ('id',)
 
+    def validate_name(self, value):
+        """Check the user does not already have a tag with this name"""
+        request = self.context.get('request')
+        if request is None:
+            return value
+
+        tags = Tag.objects.filter(user=request.user, name=value)
+        if self.instance is not None:
+            tags = tags.exclude(id=self.instance.id)
+        if tags.exists():
+            raise serializers.ValidationError(
+                self.error_messages['unique_name']
+            )
+        return value
+
+
+class TagUpsertSerializer(serializers.Serializer):
+    """Serializer for resolving a batch of tag names"""
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=False,
+        max_length=1000,
+    )
+
 
 class PinSerializer(serializers.ModelSerializer):
     """Serialize a pin"""
 
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Tag.objects.all()
     )
+    tag_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True,
+    )
 
     class Meta:
         model = Pin
         fields = (
             'id', 'title', 'tags', 'date',
-            'link',
+            'link', 'latitude', 'longitude', 'tag_names',
         )
         read_only_fields = ('id',)
 
+    def validate(self, attrs):
+        return validate_location(attrs, self.instance)
+
+    def create(self, validated_data):
+        self._resolve_tag_names(validated_data, validated_data['user'])
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        self._resolve_tag_names(validated_data, instance.user)
+        return super().update(instance, validated_data)
+
+    def _resolve_tag_names(self, validated_data, user):
+        """Merge tags given by name into the tags given by id"""
+        tag_names = validated_data.pop('tag_names', None)
+        if tag_names is None:
+            return
+
+        tags = list(validated_data.get('tags', []))
+        tags.extend(Tag.objects.resolve_names(user, tag_names).values())
+        validated_data['tags'] = list(dict.fromkeys(tags))
+
 
 class PinDetailSerializer(PinSerializer):
     """Serialze a pin detail"""
     tags = TagSerializer(many=True, read_only=True)
 
+    class Meta(PinSerializer.Meta):
+        fields = PinSerializer.Meta.fields + (
+            'image', 'image_status', 'image_thumb', 'image_marker',
+            'image_preview',
+        )
+        read_only_fields = ('id', 'image')
+
+
+class PinBulkListSerializer(serializers.ListSerializer):
+    """Validate and save a batch of pins with set-based queries"""
+    max_items = 5000
+
+    def to_internal_value(self, data):
+        """Validate every item, checking ids and tags in one query each"""
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+        if len(data) > self.max_items:
+            raise serializers.ValidationError({
+                'non_field_errors': [
+                    _('Ensure this list has no more than {max_items} '
+                      'items.').format(max_items=self.max_items)
+                ]
+            })
+
+        items = []
+        errors = []
+        for item in data:
+            try:
+                items.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                items.append({})
+                errors.append(exc.detail)
+
+        self._check_references(items, errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def _check_references(self, items, errors):
+        """Check referenced pins and tags belong to the user"""
+        user = self.context['request'].user
+        pin_ids = {item['id'] for item in items if 'id' in item}
+        tag_ids = {
+            tag_id for item in items for tag_id in item.get('tag_ids', [])
+        }
+        pin_dates = dict(
+            Pin.objects.filter(
+                user=user, id__in=pin_ids
+            ).values_list('id', 'date')
+        ) if pin_ids else {}
+        known_tags = set(
+            Tag.objects.filter(
+                user=user, id__in=tag_ids
+            ).values_list('id', flat=True)
+        ) if tag_ids else set()
+
+        seen_ids = set()
+        for item, error in zip(items, errors):
+            if 'id' in item:
+                if item['id'] not in pin_dates:
+                    error['id'] = [_('Pin does not exist.')]
+                elif item['id'] in seen_ids:
+                    error['id'] = [_('Pin is listed more than once.')]
+                else:
+                    item['date'] = pin_dates[item['id']]
+                seen_ids.add(item['id'])
+            missing = [
+                tag_id for tag_id in item.get('tag_ids', [])
+                if tag_id not in known_tags
+            ]
+            if missing:
+                error['tags'] = [
+                    _('Invalid pk "{pk_value}" - object does not '
+                      'exist.').format(pk_value=tag_id)
+                    for tag_id in missing
+                ]
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        return bulk.save_pins(user, validated_data)
+
+
+class PinBulkSerializer(serializers.ModelSerializer):
+    """Serialize one pin of a bulk create or update"""
+    id = serializers.IntegerField(required=False)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        source='tag_ids',
+        required=False,
+    )
+
+    class Meta:
+        model = Pin
+        fields = (
+            'id', 'title', 'tags', 'date',
+            'link', 'latitude', 'longitude',
+        )
+        list_serializer_class = PinBulkListSerializer
+
+    def validate(self, attrs):
+        return validate_location(attrs)
+
+
+class PinClusterSerializer(serializers.ModelSerializer):
+    """Serialize a cluster of pins with its centroid"""
+
+    class Meta:
+        model = PinCluster
+        fields = ('cell', 'count', 'latitude', 'longitude')
+
 
 class PinImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to pin"""
 
     class Meta:
         model = Pin
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'image_status')
         read_only_fields = ('id',)
+
+
+class PinImportSerializer(serializers.Serializer):
+    """Serializer for importing pins from an uploaded file"""
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMATS, required=False)
+
+    def validate(self, attrs):
+        if 'format' not in attrs:
+            attrs['format'] = guess_format(attrs['file'].name)
+            if attrs['format'] is None:
+                raise serializers.ValidationError({
+                    'format': [_('Could not tell the format from the file '
+                                 'name, please give one.')]
+                })
+        return attrs
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """Serializer for resumable image uploads"""
+    offset = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ImageUpload
+        fields = ('id', 'filename', 'size', 'offset')
+        read_only_fields = ('id',)
+
+    def validate_size(self, value):
+        """Check the declared size is within the upload limit"""
+        if not 0 < value <= settings.PIN_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                _('Ensure the size is between 1 and {max_size} bytes.')
+                .format(max_size=settings.PIN_UPLOAD_MAX_SIZE)
+            )
+        return value
@@ -0,0 +1,42 @@
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from core.models import Pin, Tag
+from core.signals import pin_locations_changed
+from pins.tiles import tile_cache
+
+
+@receiver(pin_locations_changed)
+def invalidate_moved_tiles(sender, user_id, points, **kwargs):
+    """Drop cached tiles where pins appeared or disappeared"""
+    tile_cache.invalidate(user_id, points)
+
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def invalidate_retagged_tiles(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    """Drop cached tiles of pins whose tags change"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        points = [(instance.latitude, instance.longitude)]
+    else:
+        pins = instance.pin_set.all()
+        if action != 'pre_clear':
+            pins = Pin.objects.filter(id__in=pk_set)
+        points = pins.exclude(
+            latitude__isnull=True
+        ).values_list('latitude', 'longitude')
+    tile_cache.invalidate(instance.user_id, points)
+
+
+@receiver(pre_delete, sender=Tag)
+def invalidate_untagged_tiles(sender, instance, **kwargs):
+    """Drop cached tiles of pins losing a deleted tag"""
+    if getattr(instance, '_owner_deleted', False):
+        return
+    points = instance.pin_set.exclude(
+        latitude__isnull=True
+    ).values_list('latitude', 'longitude')
+    tile_cache.invalidate(instance.user_id, points)
@@ -0,0 +1,359 @@
+import csv
+import datetime
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core.models import ImageBlob, ImageUpload, Pin, PinCluster, PinTerm, \
+    Tag
+from pins import seed
+from pins.management.commands.gc_image_blobs import Command
+
+
+class ImportPinsCommandTests(TestCase):
+    """Test the import_pins management command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'import@dev.com',
+            'testpass'
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_pins_writes_error_file(self):
+        """Test rows are imported and rejected rows written out"""
+        path = self._write('pins.csv', 'title,tags\nFirst,A|B\n,A\n')
+        errors = os.path.join(self.tmpdir.name, 'errors.csv')
+        out = StringIO()
+
+        call_command(
+            'import_pins', self.user.email, path,
+            errors=errors, batch_size=1, stdout=out
+        )
+
+        self.assertEqual(Pin.objects.filter(user=self.user).count(), 1)
+        self.assertIn('1 pins imported, 1 rejected', out.getvalue())
+        with open(errors) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ['line', 'error', 'row'])
+        self.assertEqual(rows[1][0], '3')
+
+    def test_import_pins_unknown_user(self):
+        """Test importing for a missing user fails"""
+        path = self._write('pins.csv', 'title\nFirst\n')
+
+        with self.assertRaises(CommandError):
+            call_command('import_pins', 'nobody@dev.com', path)
+
+
+class CleanImageUploadsCommandTests(TestCase):
+    """Test the clean_image_uploads management command"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('up@dev.com', 'pass')
+        self.pin = Pin.objects.create(user=user, title='Pin')
+        self.user = user
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_clean_stale_uploads(self):
+        """Test only uploads older than the cutoff are discarded"""
+        with override_settings(PIN_UPLOAD_DIR=self.tmpdir.name):
+            stale = ImageUpload.objects.create(
+                user=self.user, pin=self.pin, filename='a.jpg', size=4
+            )
+            fresh = ImageUpload.objects.create(
+                user=self.user, pin=self.pin, filename='b.jpg', size=4
+            )
+            ImageUpload.objects.filter(id=stale.id).update(
+                created=timezone.now() - datetime.timedelta(hours=2)
+            )
+            with open(stale.path, 'wb') as f:
+                f.write(b'data')
+
+            call_command('clean_image_uploads', hours=1, stdout=StringIO())
+
+            self.assertFalse(os.path.exists(stale.path))
+        self.assertEqual(list(ImageUpload.objects.all()), [fresh])
+
+
+class GcImageBlobsCommandTests(TransactionTestCase):
+    """Test the gc_image_blobs management command
+
+    Files are purged once the row deletes commit, so these tests commit.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tmpdir.name
+        )
+        self.settings_override.enable()
+        self.storage = Pin._meta.get_field('image').storage
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+    def _store(self, content, hours_old, ref_count=None):
+        name = self.storage.save('a.jpg', ContentFile(content))
+        old = time.time() - hours_old * 3600
+        os.utime(self.storage.path(name), (old, old))
+        if ref_count is not None:
+            ImageBlob.objects.create(
+                name=name,
+                ref_count=ref_count,
+                updated=timezone.now() - datetime.timedelta(hours=hours_old),
+            )
+        return name
+
+    def test_gc_removes_unreferenced_blobs(self):
+        """Test only old blobs without references are removed"""
+        released = self._store(b'released', 48, ref_count=0)
+        untracked = self._store(b'untracked', 48)
+        used = self._store(b'used', 48, ref_count=1)
+        recent = self._store(b'recent', 1, ref_count=0)
+
+        call_command('gc_image_blobs', stdout=StringIO())
+
+        self.assertFalse(self.storage.exists(released))
+        self.assertFalse(self.storage.exists(untracked))
+        self.assertTrue(self.storage.exists(used))
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(ImageBlob.objects.filter(name=released).exists())
+
+    def test_gc_dry_run(self):
+        """Test a dry run keeps every blob"""
+        released = self._store(b'released', 48, ref_count=0)
+
+        out = StringIO()
+        call_command('gc_image_blobs', dry_run=True, stdout=out)
+
+        self.assertTrue(self.storage.exists(released))
+        self.assertIn('Would remove 1 blobs', out.getvalue())
+
+    def test_gc_keeps_blob_reused_before_purge(self):
+        """Test a blob saved again after its row is deleted is kept"""
+        released = self._store(b'released', 48, ref_count=0)
+        purge_unused = Command._purge_unused
+
+        def reuse_then_purge(command, name):
+            self.storage.save('b.jpg', ContentFile(b'released'))
+            ImageBlob.objects.acquire(name)
+            purge_unused(command, name)
+
+        out = StringIO()
+        with patch.object(Command, '_purge_unused', reuse_then_purge):
+            call_command('gc_image_blobs', stdout=out)
+
+        self.assertTrue(self.storage.exists(released))
+        self.assertEqual(ImageBlob.objects.get(name=released).ref_count, 1)
+        self.assertIn('Removed 0 blobs', out.getvalue())
+
+
+class RecountTagPinsCommandTests(TestCase):
+    """Test the recount_tag_pins management command"""
+
+    def test_recount_repairs_drifted_counts(self):
+        """Test counts are recomputed from the pin links"""
+        user = get_user_model().objects.create_user('recount@dev.com')
+        pin = Pin.objects.create(user=user, title='Pin')
+        linked = Tag.objects.create(user=user, name='Linked')
+        unlinked = Tag.objects.create(user=user, name='Unlinked')
+        exact = Tag.objects.create(user=user, name='Exact')
+        pin.tags.add(exact)
+        Pin.tags.through.objects.create(pin=pin, tag=linked)
+        Tag.objects.filter(id=unlinked.id).update(pin_count=4)
+        user.refresh_from_db()
+        version = user.data_version
+
+        out = StringIO()
+        call_command('recount_tag_pins', stdout=out)
+
+        self.assertEqual(
+            dict(Tag.objects.values_list('name', 'pin_count')),
+            {'Linked': 1, 'Unlinked': 0, 'Exact': 1}
+        )
+        self.assertIn('Repaired 2 tags', out.getvalue())
+        user.refresh_from_db()
+        self.assertGreater(user.data_version, version)
+
+
+class BenchmarkNearestCommandTests(TestCase):
+    """Test the benchmark_nearest management command"""
+
+    def test_benchmark_reports_sizes_and_rolls_back(self):
+        """Test a line is written per size and no pins are kept"""
+        out = StringIO()
+
+        call_command(
+            'benchmark_nearest', sizes='20,10', queries=2, k=3, stdout=out
+        )
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split('\t')[0] for line in lines[1:]],
+                         ['10', '20'])
+        self.assertFalse(Pin.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+
+class GenerateDataCommandTests(TestCase):
+    """Test the generate_data management command"""
+
+    def _generate(self, prefix, **options):
+        call_command(
+            'generate_data', users=3, pins=20, tags=5, links=2,
+            prefix=prefix, chunk_pins=40, stdout=StringIO(), **options
+        )
+
+    def _snapshot(self, prefix):
+        """Return the pins of each generated user, without their keys"""
+        return [
+            [
+                (
+                    pin.title, pin.date, pin.latitude, pin.longitude,
+                    pin.geohash, sorted(tag.name for tag in pin.tags.all()),
+                )
+                for pin in Pin.objects.filter(
+                    user__email=seed.email(prefix, index)
+                ).order_by('id')
+            ]
+            for index in range(3)
+        ]
+
+    def test_generated_data_is_deterministic(self):
+        """Test the same seed generates the same pins and links"""
+        self._generate('first', seed=1)
+        self._generate('second', seed=1, workers=2)
+        self._generate('third', seed=2)
+
+        first = self._snapshot('first')
+        self.assertEqual(len(first[0]), 20)
+        self.assertEqual(len(first[0][0][5]), 2)
+        self.assertEqual(first, self._snapshot('second'))
+        self.assertNotEqual(first, self._snapshot('third'))
+
+    def test_generated_derived_data_matches(self):
+        """Test tag counts, postings and clusters match the pins"""
+        self._generate('derived')
+        user = get_user_model().objects.get(email=seed.email('derived', 0))
+        self.assertTrue(user.check_password(seed.PASSWORD))
+
+        self.assertEqual(Tag.objects.recount_pins(), 0)
+
+        def postings():
+            return set(PinTerm.objects.values_list(
+                'user_id', 'pin_id', 'term', 'weight'
+            ))
+        generated = postings()
+        PinTerm.objects.reindex(Pin.objects.values_list('id', flat=True))
+        self.assertEqual(generated, postings())
+
+        def clusters():
+            return {
+                (user_id, cell): (count, round(latitude, 6))
+                for user_id, cell, count, latitude
+                in PinCluster.objects.values_list(
+                    'user_id', 'cell', 'count', 'latitude_sum'
+                )
+            }
+        generated = clusters()
+        PinCluster.objects.all().delete()
+        for user in get_user_model().objects.all():
+            PinCluster.objects.move(user.pk, added=list(
+                user.pin_set.values_list('latitude', 'longitude')
+            ))
+        self.assertEqual(generated, clusters())
+
+    def test_generate_refuses_taken_prefix(self):
+        """Test generating over existing users fails"""
+        self._generate('taken')
+
+        with self.assertRaises(CommandError):
+            self._generate('taken')
+
+
+class BenchmarkEndpointsCommandTests(TransactionTestCase):
+    """Test the benchmark_endpoints management command"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tmpdir.name, PIN_IMAGE_WORKERS=0
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+    def test_benchmark_writes_results_and_cleans_up(self):
+        """Test every endpoint is timed, reported and the data removed"""
+        output = os.path.join(self.tmpdir.name, 'results.json')
+
+        call_command(
+            'benchmark_endpoints', users=2, pins=5, tags=4, links=2,
+            requests=4, concurrency=1, output=output, stdout=StringIO()
+        )
+
+        with open(output) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(results['options']['users'], 2)
+        self.assertEqual(set(results['endpoints']), {
+            'pins:pin-list', 'pins:pin-detail', 'pins:tag-list',
+            'pins:pin-upload-image', 'user:token',
+        })
+        for result in results['endpoints'].values():
+            self.assertEqual(result['requests'], 4)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries_per_request'], 0)
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Pin.objects.exists())
+
+    def test_benchmark_only_touches_seeded_users(self):
+        """Test other accounts survive and reused users are kept"""
+        User = get_user_model()
+        other = User.objects.create_user('benchmark-endpoints@example.com')
+        options = dict(
+            users=1, pins=2, tags=2, links=1, requests=1, concurrency=1,
+            endpoints='pins:tag-list', stdout=StringIO(),
+        )
+
+        call_command('benchmark_endpoints', keep=True, **options)
+        with self.assertRaises(CommandError):
+            call_command('benchmark_endpoints', **options)
+        call_command('benchmark_endpoints', reuse=True, **options)
+
+        self.assertEqual(
+            set(User.objects.values_list('email', flat=True)),
+            {other.email, seed.email('benchmark-endpoints', 0)},
+        )
+        with self.assertRaises(CommandError):
+            call_command('benchmark_endpoints', prefix='', **options)
+
+    def test_benchmark_rejects_unknown_endpoints(self):
+        """Test endpoints outside the benchmarked set are refused"""
+        with self.assertRaises(CommandError):
+            call_command('benchmark_endpoints', endpoints='pins:pin-export')
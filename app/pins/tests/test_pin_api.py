@@ -1,19 +1,35 @@
+import csv
 import tempfile
+import threading
+import json
 import os
+import struct
+import time
+from unittest.mock import patch
 
 from PIL import Image
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings, skipUnlessDBFeature
 from django.urls import reverse
 
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
-from core.models import Pin, Tag
+from core.models import ImageBlob, ImageUpload, Pin, Tag
 
+from pins import images, tiles, uploads
+from pins.cache import response_cache
 from pins.serializers import PinSerializer, PinDetailSerializer
 import datetime
 PINS_URL = reverse('pins:pin-list')
+BULK_URL = reverse('pins:pin-bulk')
+CACHE_STATS_URL = reverse('pins:cache-stats')
+EXPORT_URL = reverse('pins:pin-export')
+IMPORT_URL = reverse('pins:pin-import-pins')
+CLUSTERS_URL = reverse('pins:pin-clusters')
 
 
 def image_upload_url(pin_id):
@@ -21,6 +37,17 @@ def image_upload_url(pin_id):
     return reverse('pins:pin-upload-image', args=[pin_id])
 
 
+def image_uploads_url(pin_id, upload_id=None, complete=False):
+    """Return URL for resumable pin image uploads"""
+    if upload_id is None:
+        return reverse('pins:pin-start-image-upload', args=[pin_id])
+    if complete:
+        return reverse(
+            'pins:pin-complete-image-upload', args=[pin_id, upload_id]
+        )
+    return reverse('pins:pin-image-upload', args=[pin_id, upload_id])
+
+
 def detail_url(pin_id):
     """Return pin detail URL"""
     return reverse('pins:pin-detail', args=[pin_id])
@@ -66,6 +93,7 @@ class PrivatePinApiTests(TestCase):
             'testpass'
         )
         self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
 
     def test_retrieve_pins(self):
         """Test retrieving list of pins"""
@@ -74,10 +102,10 @@ class PrivatePinApiTests(TestCase):
 
         res = self.client.get(PINS_URL)
 
-        pins = Pin.objects.all().order_by('-id')
+        pins = Pin.objects.all().order_by('-date', '-id')
         serializer = PinSerializer(pins, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_pins_limited_to_user(self):
         """Test retrieving pins for user"""
@@ -93,8 +121,8 @@ class PrivatePinApiTests(TestCase):
         pins = Pin.objects.filter(user=self.user)
         serializer = PinSerializer(pins, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_view_pin_detail(self):
         """Test viewing a pin detail"""
@@ -137,6 +165,36 @@ class PrivatePinApiTests(TestCase):
         self.assertIn(tag1, tags)
         self.assertIn(tag2, tags)
 
+    def test_create_pin_with_tag_names(self):
+        """Test creating a pin with tags given by name"""
+        existing = sample_tag(user=self.user, name='Festival')
+        payload = {
+            'title': 'Pin with named tags',
+            'tag_names': ['Festival', 'Night'],
+        }
+        res = self.client.post(PINS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        pin = Pin.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(pin.tags.values_list('name', flat=True)),
+            ['Festival', 'Night']
+        )
+        self.assertIn(existing, pin.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+
+    def test_partial_update_pin_with_tag_names(self):
+        """Test replacing pin tags by name with patch"""
+        pin = sample_pin(user=self.user)
+        pin.tags.add(sample_tag(user=self.user))
+
+        payload = {'tag_names': ['Fresh']}
+        self.client.patch(detail_url(pin.id), payload, format='json')
+
+        self.assertEqual(
+            list(pin.tags.values_list('name', flat=True)), ['Fresh']
+        )
+
     def test_partial_update_pin(self):
         """Test updating a pin with patch"""
         pin = sample_pin(user=self.user)
@@ -178,10 +236,23 @@ class PinImageUploadTests(TestCase):
         self.client = APIClient()
         self.user = get_user_model().objects.create_user('user', 'testpass')
         self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
         self.pin = sample_pin(user=self.user)
 
     def tearDown(self):
-        self.pin.image.delete()
+        storage = Pin._meta.get_field('image').storage
+        for name in ImageBlob.objects.values_list('name', flat=True):
+            storage.purge(name)
+        for field in images.VARIANTS:
+            getattr(self.pin, field).delete(save=False)
+
+    def _upload(self, size=(10, 10), color='black'):
+        url = image_upload_url(self.pin.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img = Image.new('RGB', size, color)
+            img.save(ntf, format='JPEG')
+            ntf.seek(0)
+            return self.client.post(url, {'image': ntf}, format='multipart')
 
     def test_upload_image_to_pin(self):
         """Test uploading an image to pin"""
@@ -197,6 +268,142 @@ class PinImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.pin.image.path))
 
+    @override_settings(PIN_IMAGE_WORKERS=0)
+    def test_upload_image_renders_variants(self):
+        """Test variants are rendered once the upload commits"""
+        with patch('django.db.transaction.on_commit') as on_commit:
+            res = self._upload(size=(2000, 1000))
+            self.assertEqual(res.data['image_status'], Pin.IMAGE_PENDING)
+            # force_authenticate reuses the user, token auth reloads it
+            self.user.refresh_from_db()
+            etag = self.client.get(detail_url(self.pin.id))['ETag']
+            on_commit.call_args[0][0]()
+
+        self.pin.refresh_from_db()
+        self.assertEqual(self.pin.image_status, Pin.IMAGE_READY)
+        for field, size in images.VARIANTS.items():
+            with Image.open(getattr(self.pin, field).path) as variant:
+                self.assertEqual(variant.size, (size, size // 2))
+
+        self.user.refresh_from_db()
+        res = self.client.get(
+            detail_url(self.pin.id), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['image_status'], Pin.IMAGE_READY)
+        self.assertTrue(res.data['image_thumb'].endswith('-thumb.jpg'))
+
+    def test_variants_not_ready_before_commit(self):
+        """Test the upload returns before any variant is rendered"""
+        res = self._upload()
+
+        self.pin.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.pin.image_status, Pin.IMAGE_PENDING)
+        self.assertFalse(self.pin.image_thumb)
+
+    def test_variants_failed(self):
+        """Test an unreadable source image marks the variants failed"""
+        self._upload(color='red')
+        self.pin.refresh_from_db()
+        with open(self.pin.image.path, 'wb') as f:
+            f.write(b'not an image')
+
+        images.generate_variants(self.pin.id, self.pin.image.name)
+
+        self.pin.refresh_from_db()
+        self.assertEqual(self.pin.image_status, Pin.IMAGE_FAILED)
+
+    def test_variants_for_replaced_image_ignored(self):
+        """Test variants of a superseded image are not recorded"""
+        self._upload()
+        self.pin.refresh_from_db()
+        old_name = self.pin.image.name
+        self._upload(color='white')
+        self.pin.refresh_from_db()
+
+        images.generate_variants(self.pin.id, old_name)
+
+        self.pin.refresh_from_db()
+        self.assertEqual(self.pin.image_status, Pin.IMAGE_PENDING)
+
+    def test_identical_images_stored_once(self):
+        """Test uploading the same image twice reuses the stored blob"""
+        self._upload(color='blue')
+        self.pin.refresh_from_db()
+        other = sample_pin(user=self.user, title='Other pin')
+        url = image_upload_url(other.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10), 'blue').save(ntf, format='JPEG')
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+
+        other.refresh_from_db()
+        self.assertEqual(other.image.name, self.pin.image.name)
+        self.assertTrue(
+            self.pin.image.name.startswith('uploads/blobs/')
+        )
+        blob = ImageBlob.objects.get(name=self.pin.image.name)
+        self.assertEqual(blob.ref_count, 2)
+
+    def test_image_references_follow_pins(self):
+        """Test replacing and deleting images releases references"""
+        self._upload(color='green')
+        self.pin.refresh_from_db()
+        old_name = self.pin.image.name
+        self._upload(color='yellow')
+        self.pin.refresh_from_db()
+
+        self.assertEqual(ImageBlob.objects.get(name=old_name).ref_count, 0)
+        self.assertTrue(self.pin.image.storage.exists(old_name))
+        blob = ImageBlob.objects.get(name=self.pin.image.name)
+        self.assertEqual(blob.ref_count, 1)
+
+        name = self.pin.image.name
+        self.pin.delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 0)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_render_variants_in_process_pool(self):
+        """Test variants can be rendered by a worker process"""
+        self._upload()
+        self.pin.refresh_from_db()
+
+        future = images.get_executor().submit(
+            images.render_variants,
+            *images._render_args(self.pin.image.name)
+        )
+        names = future.result(timeout=30)
+
+        self.assertEqual(set(names), set(images.VARIANTS))
+        for name in names.values():
+            self.assertTrue(default_storage.exists(name))
+            default_storage.delete(name)
+
+    def test_render_variants_moved_into_place(self):
+        """Test a failed render leaves no partial variant behind"""
+        self._upload()
+        self.pin.refresh_from_db()
+        args = images._render_args(self.pin.image.name)
+        names = images.variant_names(args[2]).values()
+        for name in names:
+            default_storage.delete(name)
+
+        def fail(image, fp, *args, **kwargs):
+            fp.write(b'partial')
+            raise OSError('disk full')
+
+        with patch.object(Image.Image, 'save', fail):
+            with self.assertRaises(OSError):
+                images.render_variants(*args)
+
+        for name in names:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse([
+            name for name in default_storage.listdir(images.VARIANTS_DIR)[1]
+            if name.endswith('.part')
+        ])
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
         url = image_upload_url(self.pin.id)
@@ -224,6 +431,1266 @@ class PinImageUploadTests(TestCase):
         serializer1 = PinSerializer(pin1)
         serializer2 = PinSerializer(pin2)
         serializer3 = PinSerializer(pin3)
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
+
+    def test_filter_pins_by_any_and_all_tags(self):
+        """Test tags_any matches one of the tags and tags_all every tag"""
+        tag1 = sample_tag(user=self.user, name='Food')
+        tag2 = sample_tag(user=self.user, name='Drinks')
+        both = sample_pin(user=self.user, title='Bar')
+        both.tags.add(tag1, tag2)
+        one = sample_pin(user=self.user, title='Cafe')
+        one.tags.add(tag1)
+        sample_pin(user=self.user, title='Park')
+        tag_ids = '{},{}'.format(tag1.id, tag2.id)
+
+        res_any = self.client.get(PINS_URL, {'tags_any': tag_ids})
+        res_all = self.client.get(PINS_URL, {'tags_all': tag_ids})
+
+        self.assertCountEqual(
+            [pin['id'] for pin in res_any.data['results']],
+            [both.id, one.id]
+        )
+        self.assertEqual(
+            [pin['id'] for pin in res_all.data['results']], [both.id]
+        )
+
+    def test_filter_pins_combines_any_and_all_tags(self):
+        """Test tags_any and tags_all apply together"""
+        tag1 = sample_tag(user=self.user, name='Food')
+        tag2 = sample_tag(user=self.user, name='Drinks')
+        tag3 = sample_tag(user=self.user, name='Music')
+        pin1 = sample_pin(user=self.user, title='Bar')
+        pin1.tags.add(tag1, tag3)
+        pin2 = sample_pin(user=self.user, title='Club')
+        pin2.tags.add(tag2)
+
+        res = self.client.get(PINS_URL, {
+            'tags_any': '{},{}'.format(tag1.id, tag2.id),
+            'tags_all': tag3.id,
+        })
+
+        self.assertEqual(
+            [pin['id'] for pin in res.data['results']], [pin1.id]
+        )
+
+    def test_filter_pins_by_tags_and_tags_any_rejected(self):
+        """Test tags and tags_any cannot be sent together"""
+        tag1 = sample_tag(user=self.user, name='Food')
+        tag2 = sample_tag(user=self.user, name='Drinks')
+
+        res = self.client.get(PINS_URL, {
+            'tags': tag1.id,
+            'tags_any': tag2.id,
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags_any', res.data)
+
+    def test_filter_pins_by_invalid_tags(self):
+        """Test malformed tag filters are rejected"""
+        for param in ('tags', 'tags_any', 'tags_all'):
+            res = self.client.get(PINS_URL, {param: '1,abc'})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(param, res.data)
+
+
+class PinPaginationApiTests(TestCase):
+    """Test keyset pagination of the pin list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'pages@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def _create_pins(self, count):
+        """Create pins two per date, return their ids newest first"""
+        today = datetime.date.today()
+        for i in range(count):
+            pin = sample_pin(user=self.user, title=f'Pin {i}')
+            date = today - datetime.timedelta(days=i // 2)
+            Pin.objects.filter(id=pin.id).update(date=date)
+        return list(
+            Pin.objects.order_by('-date', '-id').values_list('id', flat=True)
+        )
+
+    def _walk(self, url, params=None):
+        """Follow next links and return the ids of every page"""
+        pages = []
+        res = self.client.get(url, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append([pin['id'] for pin in res.data['results']])
+            if not res.data['next']:
+                return pages, res
+            res = self.client.get(res.data['next'])
+
+    def test_pages_cover_all_pins_in_order(self):
+        """Test following next links returns every pin exactly once"""
+        expected = self._create_pins(7)
+
+        pages, _ = self._walk(PINS_URL, {'page_size': 3})
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_first_page_has_no_previous_link(self):
+        """Test the first page only links forward"""
+        self._create_pins(3)
+
+        res = self.client.get(PINS_URL, {'page_size': 2})
+
+        self.assertIsNone(res.data['previous'])
+        self.assertIsNotNone(res.data['next'])
+
+    def test_previous_link_returns_prior_page(self):
+        """Test following a previous link returns the prior page"""
+        self._create_pins(6)
+        first = self.client.get(PINS_URL, {'page_size': 2})
+        second = self.client.get(first.data['next'])
+
+        res = self.client.get(second.data['previous'])
+
+        self.assertEqual(res.data['results'], first.data['results'])
+        self.assertIsNone(res.data['previous'])
+
+    def test_cursor_stable_when_pins_added(self):
+        """Test that new pins do not shift later pages"""
+        expected = self._create_pins(4)
+        first = self.client.get(PINS_URL, {'page_size': 2})
+        sample_pin(user=self.user, title='Newest')
+
+        res = self.client.get(first.data['next'])
+
+        ids = [pin['id'] for pin in res.data['results']]
+        self.assertEqual(ids, expected[2:4])
+
+    def test_pagination_with_tag_filter(self):
+        """Test cursors keep the tags filter applied"""
+        tag = sample_tag(user=self.user)
+        self._create_pins(5)
+        tagged = list(Pin.objects.order_by('-date', '-id')[:4])
+        for pin in tagged:
+            pin.tags.add(tag)
+
+        pages, _ = self._walk(PINS_URL, {'tags': tag.id, 'page_size': 3})
+
+        self.assertEqual(sum(pages, []), [pin.id for pin in tagged])
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor returns 404"""
+        res = self.client.get(PINS_URL, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PinQueryCountTests(TestCase):
+    """Test the pin read path runs a fixed number of queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'queries@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+        self.tags = [
+            sample_tag(user=self.user, name=f'Tag {i}') for i in range(3)
+        ]
+
+    def _seed_pins(self, count):
+        """Bulk create pins each linked to every sample tag"""
+        Pin.objects.bulk_create(
+            Pin(user=self.user, title=f'Pin {i}') for i in range(count)
+        )
+        pin_ids = Pin.objects.filter(
+            user=self.user,
+            tags__isnull=True,
+        ).values_list('id', flat=True)
+        Pin.tags.through.objects.bulk_create(
+            Pin.tags.through(pin_id=pin_id, tag_id=tag.id)
+            for pin_id in pin_ids
+            for tag in self.tags
+        )
+
+    def test_list_query_count_is_constant(self):
+        """Test listing pins does not issue a query per pin"""
+        seeded = 0
+        for count in (10, 100, 1000):
+            self._seed_pins(count - seeded)
+            seeded = count
+
+            with self.assertNumQueries(2):
+                res = self.client.get(PINS_URL, {'page_size': count})
+
+            self.assertEqual(len(res.data['results']), count)
+            self.assertEqual(len(res.data['results'][0]['tags']), 3)
+
+    def test_detail_query_count(self):
+        """Test retrieving a pin fetches its tags in one query"""
+        self._seed_pins(1)
+        pin = Pin.objects.get(user=self.user)
+
+        with self.assertNumQueries(2):
+            res = self.client.get(detail_url(pin.id))
+
+        self.assertEqual(len(res.data['tags']), 3)
+        self.assertEqual(
+            res.data['tags'][0].keys(), {'id', 'name', 'pin_count'}
+        )
+
+    def test_tag_filters_return_each_pin_once(self):
+        """Test pins matching many filtered tags are not repeated"""
+        self.tags += [
+            sample_tag(user=self.user, name=f'Tag {i}') for i in range(3, 50)
+        ]
+        self._seed_pins(200)
+        tag_ids = ','.join(str(tag.id) for tag in self.tags)
+
+        for param in ('tags', 'tags_any', 'tags_all'):
+            start = time.perf_counter()
+            with self.assertNumQueries(2):
+                res = self.client.get(
+                    PINS_URL, {param: tag_ids, 'page_size': 200}
+                )
+            elapsed = time.perf_counter() - start
+
+            ids = [pin['id'] for pin in res.data['results']]
+            self.assertEqual(len(ids), 200)
+            self.assertEqual(len(set(ids)), 200)
+            self.assertLess(elapsed, 5)
+
+
+class PinBulkApiTests(TestCase):
+    """Test creating and updating pins in bulk"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'bulk@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def test_bulk_create_pins(self):
+        """Test creating several pins with tags in one request"""
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        payload = [
+            {'title': 'First', 'tags': [tag1.id, tag2.id]},
+            {'title': 'Second', 'link': 'https://example.com'},
+            {'title': 'Third', 'tags': [tag2.id]},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Pin.objects.filter(user=self.user).count(), 3)
+        for item, data in zip(payload, res.data):
+            pin = Pin.objects.get(id=data['id'])
+            self.assertEqual(pin.title, item['title'])
+            self.assertEqual(
+                sorted(pin.tags.values_list('id', flat=True)),
+                sorted(item.get('tags', [])),
+            )
+            self.assertEqual(data['tags'], item.get('tags', []))
+            self.assertEqual(data['date'], pin.date.isoformat())
+
+    def test_bulk_update_replaces_pins(self):
+        """Test items with an id replace the existing pin and tags"""
+        pin = sample_pin(user=self.user, title='Old', link='old')
+        pin.tags.add(sample_tag(user=self.user, name='Old tag'))
+        new_tag = sample_tag(user=self.user, name='New tag')
+        payload = [
+            {'id': pin.id, 'title': 'New', 'tags': [new_tag.id]},
+            {'title': 'Created'},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        pin.refresh_from_db()
+        self.assertEqual(pin.title, 'New')
+        self.assertEqual(pin.link, '')
+        self.assertEqual(list(pin.tags.all()), [new_tag])
+        self.assertEqual(res.data[0]['date'], pin.date.isoformat())
+        self.assertEqual(Pin.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            dict(Tag.objects.values_list('name', 'pin_count')),
+            {'Old tag': 0, 'New tag': 1}
+        )
+
+    def test_bulk_errors_reported_per_item(self):
+        """Test an invalid item rejects the batch with indexed errors"""
+        user2 = get_user_model().objects.create_user('other@dev.com', 'pass')
+        other_tag = sample_tag(user=user2)
+        other_pin = sample_pin(user=user2)
+        payload = [
+            {'title': 'Fine'},
+            {'title': 'Foreign tag', 'tags': [other_tag.id]},
+            {'title': ''},
+            {'id': other_pin.id, 'title': 'Foreign pin'},
+        ]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[2])
+        self.assertIn('id', res.data[3])
+        self.assertFalse(Pin.objects.filter(user=self.user).exists())
+
+    def test_bulk_foreign_tag_rejected(self):
+        """Test referencing another user's tag is an item error"""
+        user2 = get_user_model().objects.create_user('other@dev.com', 'pass')
+        other_tag = sample_tag(user=user2)
+        payload = [{'title': 'Foreign tag', 'tags': [other_tag.id]}]
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data[0])
+
+    def test_bulk_requires_list(self):
+        """Test a non-list payload is rejected"""
+        res = self.client.post(BULK_URL, {'title': 'One'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnlessDBFeature('can_return_rows_from_bulk_insert')
+    def test_bulk_query_count_is_constant(self):
+        """Test a large batch is written with a fixed number of queries"""
+        tags = [sample_tag(user=self.user, name=f'Tag {i}') for i in range(5)]
+        payload = [
+            {'title': f'Pin {i}', 'tags': [tag.id for tag in tags]}
+            for i in range(100)
+        ]
+
+        # tag check, then inside a savepoint: pin insert, link insert,
+        # search reindex (two reads, delete, insert) and version bump
+        with self.assertNumQueries(10):
+            res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Pin.tags.through.objects.filter(pin__user=self.user).count(),
+            500,
+        )
+
+
+class PinConditionalApiTests(TestCase):
+    """Test conditional GET support on the pin endpoints"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'etag@dev.com',
+            'testpass'
+        )
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_list_returns_etag(self):
+        """Test the pin list carries ETag and Last-Modified headers"""
+        sample_pin(user=self.user)
+
+        res = self.client.get(PINS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', res)
+        self.assertIn('Last-Modified', res)
+
+    def test_list_not_modified(self):
+        """Test a matching If-None-Match is answered before any pin query"""
+        sample_pin(user=self.user)
+        etag = self.client.get(PINS_URL)['ETag']
+
+        # only the token lookup runs
+        with self.assertNumQueries(1):
+            res = self.client.get(PINS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b'')
+
+    def test_etag_changes_when_pins_change(self):
+        """Test creating, tagging and deleting pins invalidates the ETag"""
+        pin = sample_pin(user=self.user)
+        etags = [self.client.get(PINS_URL)['ETag']]
+
+        pin.tags.add(sample_tag(user=self.user))
+        etags.append(self.client.get(PINS_URL)['ETag'])
+        pin.delete()
+        etags.append(self.client.get(PINS_URL)['ETag'])
+
+        self.assertEqual(len(set(etags)), 3)
+        res = self.client.get(PINS_URL, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_etag_ignores_other_users(self):
+        """Test changes to another user's pins keep the ETag valid"""
+        etag = self.client.get(PINS_URL)['ETag']
+        user2 = get_user_model().objects.create_user('other@dev.com', 'pass')
+        sample_pin(user=user2)
+
+        res = self.client.get(PINS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_not_modified(self):
+        """Test conditional GET on a pin detail"""
+        pin = sample_pin(user=self.user)
+        etag = self.client.get(detail_url(pin.id))['ETag']
+
+        res = self.client.get(detail_url(pin.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_writes_have_no_etag(self):
+        """Test unsafe requests are never answered with 304"""
+        res = self.client.post(
+            PINS_URL, {'title': 'New'}, HTTP_IF_NONE_MATCH='*'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('ETag', res)
+
+
+class PinResponseCacheTests(TestCase):
+    """Test pin lists are served from the response cache"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'cache@dev.com',
+            'testpass'
+        )
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response_cache.cache.clear()
+
+    def test_repeated_list_is_cached(self):
+        """Test a repeated list is answered without querying pins"""
+        sample_pin(user=self.user)
+        first = self.client.get(PINS_URL)
+
+        # only the token lookup runs
+        with self.assertNumQueries(1):
+            res = self.client.get(PINS_URL)
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(res['X-Cache'], 'HIT')
+        self.assertEqual(res.data, first.data)
+
+    def test_tag_filter_normalized(self):
+        """Test equivalent tag filters share a cache entry"""
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        self.client.get(PINS_URL, {'tags': f'{tag2.id},{tag1.id}'})
+
+        res = self.client.get(
+            PINS_URL, {'tags': f'{tag1.id},{tag2.id},{tag1.id}'}
+        )
+
+        self.assertEqual(res['X-Cache'], 'HIT')
+
+    def test_different_filters_not_shared(self):
+        """Test different filters get their own cache entries"""
+        tag = sample_tag(user=self.user)
+        self.client.get(PINS_URL)
+
+        res = self.client.get(PINS_URL, {'tags': tag.id})
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+    def test_cache_invalidated_by_changes(self):
+        """Test pin, tag link and delete changes invalidate the cache"""
+        pin = sample_pin(user=self.user)
+        tag = sample_tag(user=self.user)
+        self.client.get(PINS_URL)
+
+        pin.tags.add(tag)
+        res = self.client.get(PINS_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'][0]['tags'], [tag.id])
+
+        pin.title = 'Renamed'
+        pin.save()
+        res = self.client.get(PINS_URL)
+        self.assertEqual(res.data['results'][0]['title'], 'Renamed')
+
+        pin.delete()
+        res = self.client.get(PINS_URL)
+        self.assertEqual(res.data['results'], [])
+
+    def test_cache_not_shared_between_users(self):
+        """Test users never see each other's cached lists"""
+        sample_pin(user=self.user)
+        self.client.get(PINS_URL)
+        user2 = get_user_model().objects.create_user('other@dev.com', 'pass')
+        client2 = APIClient()
+        client2.force_authenticate(user2)
+
+        res = client2.get(PINS_URL)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['results'], [])
+
+    def test_cache_stats(self):
+        """Test hit and miss counters are reported to staff users"""
+        self.client.get(PINS_URL)
+        self.client.get(PINS_URL)
+        admin = get_user_model().objects.create_superuser(
+            'admin@dev.com', 'pass'
+        )
+        client = APIClient()
+
+        res = self.client.get(CACHE_STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(admin)
+        res = client.get(CACHE_STATS_URL)
+        self.assertEqual(res.data, {'hits': 1, 'misses': 1})
+
+
+class PinExportApiTests(TestCase):
+    """Test streaming export of a user's pins"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'export@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def _export(self, params=None):
+        res = self.client.get(EXPORT_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        content = b''.join(res.streaming_content).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export_pins_with_tag_names(self):
+        """Test every pin is exported once with its tag names inlined"""
+        tag1 = sample_tag(user=self.user, name='Tag 1')
+        tag2 = sample_tag(user=self.user, name='Tag 2')
+        pin1 = sample_pin(user=self.user, title='First', link='a')
+        pin1.tags.add(tag1, tag2)
+        pin2 = sample_pin(user=self.user, title='Second')
+        sample_pin(
+            user=get_user_model().objects.create_user('x@dev.com', 'pass')
+        )
+
+        rows = self._export()
+
+        self.assertEqual([row['id'] for row in rows], [pin2.id, pin1.id])
+        self.assertEqual(sorted(rows[1]['tags']), ['Tag 1', 'Tag 2'])
+        self.assertEqual(rows[1]['link'], 'a')
+        self.assertEqual(rows[0]['tags'], [])
+        self.assertEqual(rows[0]['date'], pin2.date.isoformat())
+
+    @patch('pins.views.PinViewSet.export_chunk_size', 3)
+    def test_export_reads_in_chunks(self):
+        """Test pins spanning several chunks are exported exactly once"""
+        today = datetime.date.today()
+        for i in range(8):
+            pin = sample_pin(user=self.user, title=f'Pin {i}')
+            Pin.objects.filter(id=pin.id).update(
+                date=today - datetime.timedelta(days=i // 3)
+            )
+        expected = list(
+            Pin.objects.order_by('-date', '-id').values_list('id', flat=True)
+        )
+
+        # pins and tag names for each of the three chunks, then the
+        # final empty read
+        with self.assertNumQueries(7):
+            rows = self._export()
+
+        self.assertEqual([row['id'] for row in rows], expected)
+
+
+class PinImportApiTests(TestCase):
+    """Test importing pins from uploaded files"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'import@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def _upload(self, name, content, **extra):
+        upload = SimpleUploadedFile(name, content.encode('utf-8'))
+        return self.client.post(
+            IMPORT_URL, dict({'file': upload}, **extra), format='multipart'
+        )
+
+    def test_import_csv(self):
+        """Test importing pins from CSV resolves tags by name"""
+        existing = sample_tag(user=self.user, name='Festival')
+        content = (
+            'title,link,tags\n'
+            'First,https://a.example,Festival|Night\n'
+            'Second,,Night\n'
+        )
+
+        res = self._upload('pins.csv', content)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['created'], 2)
+        self.assertEqual(res.data['failed'], 0)
+        first = Pin.objects.get(user=self.user, title='First')
+        self.assertEqual(first.link, 'https://a.example')
+        self.assertIn(existing, first.tags.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        second = Pin.objects.get(user=self.user, title='Second')
+        self.assertEqual(
+            list(second.tags.values_list('name', flat=True)), ['Night']
+        )
+
+    def test_import_ndjson_reports_bad_rows(self):
+        """Test invalid NDJSON rows are reported and the rest imported"""
+        content = '\n'.join([
+            json.dumps({'title': 'Good', 'tags': ['Beach']}),
+            'not json',
+            json.dumps({'title': ''}),
+            json.dumps(['a list']),
+            json.dumps({'title': 'Also good'}),
+        ])
+
+        res = self._upload('pins.ndjson', content)
+
+        self.assertEqual(res.data['created'], 2)
+        self.assertEqual(res.data['failed'], 3)
+        self.assertEqual(
+            [error['line'] for error in res.data['errors']], [2, 3, 4]
+        )
+        self.assertEqual(Pin.objects.filter(user=self.user).count(), 2)
+
+    def test_import_reports_undecodable_rows(self):
+        """Test rows with bytes that are not UTF-8 are reported"""
+        for name, content, line in (
+            ('pins.csv', b'title\nGood\nBad\xff\nAlso good\n', 3),
+            ('pins.ndjson', b'{"title": "Good"}\n{"title": "Bad\xff"}\n'
+                            b'{"title": "Also good"}\n', 2),
+        ):
+            Pin.objects.filter(user=self.user).delete()
+            upload = SimpleUploadedFile(name, content)
+
+            res = self.client.post(
+                IMPORT_URL, {'file': upload}, format='multipart'
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.data['created'], 2)
+            self.assertEqual(
+                res.data['errors'], [{'line': line, 'error': 'Invalid UTF-8.'}]
+            )
+
+    def test_import_reports_unparsable_csv_rows(self):
+        """Test rows the CSV reader rejects are reported, not raised"""
+        self.addCleanup(csv.field_size_limit, csv.field_size_limit(20))
+        content = 'title\nGood\n{}\nAlso good\n'.format('x' * 30)
+
+        res = self._upload('pins.csv', content)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['created'], 2)
+        self.assertEqual(res.data['failed'], 1)
+        self.assertEqual(res.data['errors'][0]['line'], 3)
+
+    def test_import_roundtrips_export(self):
+        """Test the output of the export endpoint can be imported"""
+        pin = sample_pin(user=self.user, title='Exported')
+        pin.tags.add(sample_tag(user=self.user, name='Kept'))
+        exported = b''.join(
+            self.client.get(EXPORT_URL).streaming_content
+        ).decode('utf-8')
+
+        res = self._upload('export.ndjson', exported)
+
+        self.assertEqual(res.data['created'], 1)
+        copy = Pin.objects.exclude(id=pin.id).get(user=self.user)
+        self.assertEqual(
+            list(copy.tags.values_list('name', flat=True)), ['Kept']
+        )
+
+    @patch('pins.views.PinViewSet.import_batch_size', 2)
+    def test_import_in_batches(self):
+        """Test a file larger than the batch size is fully imported"""
+        content = 'title\n' + ''.join(f'Pin {i}\n' for i in range(5))
+
+        res = self._upload('pins.csv', content)
+
+        self.assertEqual(res.data['created'], 5)
+        self.assertEqual(Pin.objects.filter(user=self.user).count(), 5)
+
+    def test_import_unknown_format(self):
+        """Test a file with no recognisable format is rejected"""
+        res = self._upload('pins.txt', 'title\nOne\n')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self._upload('pins.txt', 'title\nOne\n', format='csv')
+        self.assertEqual(res.data['created'], 1)
+
+
+class PinChunkedImageUploadTests(TestCase):
+    """Test resumable image uploads in parts"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'chunks@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.pin = sample_pin(user=self.user)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            PIN_UPLOAD_DIR=self.tmpdir.name
+        )
+        self.settings_override.enable()
+        with tempfile.TemporaryFile() as f:
+            Image.new('RGB', (40, 30)).save(f, format='JPEG')
+            f.seek(0)
+            self.content = f.read()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+        self.pin.refresh_from_db()
+        if self.pin.image:
+            self.pin.image.storage.purge(self.pin.image.name)
+
+    def _start(self, size=None):
+        res = self.client.post(
+            image_uploads_url(self.pin.id),
+            {'filename': 'photo.jpg', 'size': size or len(self.content)},
+            format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def _put(self, upload_id, offset, content):
+        return self.client.put(
+            image_uploads_url(self.pin.id, upload_id),
+            content,
+            content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_upload_in_parts(self):
+        """Test an image sent in parts becomes the pin image"""
+        upload_id = self._start()
+        half = len(self.content) // 2
+
+        res = self._put(upload_id, 0, self.content[:half])
+        self.assertEqual(res.data['offset'], half)
+        res = self._put(upload_id, half, self.content[half:])
+        self.assertEqual(res.data['offset'], len(self.content))
+
+        res = self.client.post(image_uploads_url(
+            self.pin.id, upload_id, complete=True
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['image_status'], Pin.IMAGE_PENDING)
+        self.pin.refresh_from_db()
+        with open(self.pin.image.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_resume_reports_offset(self):
+        """Test a client can ask how much was received and resume"""
+        upload_id = self._start()
+        self._put(upload_id, 0, self.content[:10])
+
+        res = self.client.get(image_uploads_url(self.pin.id, upload_id))
+        self.assertEqual(res.data['offset'], 10)
+
+        res = self._put(upload_id, 5, self.content[5:])
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 10)
+
+    def test_concurrent_parts_for_same_offset(self):
+        """Test a retried part racing the original gets a conflict"""
+        upload = ImageUpload.objects.get(pk=self._start())
+        reading = threading.Event()
+        release = threading.Event()
+        content = self.content
+
+        class SlowStream:
+            def __init__(self):
+                self.parts = [content]
+
+            def read(self, size):
+                reading.set()
+                release.wait(5)
+                return self.parts.pop() if self.parts else b''
+
+        results = [None, None]
+
+        def append(i):
+            try:
+                results[i] = uploads.append_part(upload, 0, SlowStream())
+            except uploads.OffsetConflict as exc:
+                results[i] = exc
+
+        threads = [
+            threading.Thread(target=append, args=(i,)) for i in range(2)
+        ]
+        threads[0].start()
+        reading.wait(5)
+        threads[1].start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results[0], len(content))
+        self.assertIsInstance(results[1], uploads.OffsetConflict)
+        self.assertEqual(upload.offset, len(content))
+
+    def test_part_past_declared_size_rejected(self):
+        """Test a part that overflows the declared size is discarded"""
+        upload_id = self._start(size=10)
+        self._put(upload_id, 0, self.content[:4])
+
+        res = self._put(upload_id, 4, self.content[4:20])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(image_uploads_url(self.pin.id, upload_id))
+        self.assertEqual(res.data['offset'], 4)
+
+    def test_complete_incomplete_upload(self):
+        """Test completing before every byte arrived fails"""
+        upload_id = self._start()
+        self._put(upload_id, 0, self.content[:10])
+
+        res = self.client.post(image_uploads_url(
+            self.pin.id, upload_id, complete=True
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_complete_invalid_image(self):
+        """Test an assembled file that is not an image is rejected"""
+        upload_id = self._start(size=8)
+        self._put(upload_id, 0, b'notimage')
+
+        res = self.client.post(image_uploads_url(
+            self.pin.id, upload_id, complete=True
+        ))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.pin.refresh_from_db()
+        self.assertFalse(self.pin.image)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_upload_limited_to_owner(self):
+        """Test another user cannot append to an upload"""
+        upload_id = self._start()
+        other = get_user_model().objects.create_user('x@dev.com', 'pass')
+        self.client.force_authenticate(other)
+
+        res = self._put(upload_id, 0, self.content)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_size_limited(self):
+        """Test uploads larger than the limit are refused up front"""
+        with self.settings(PIN_UPLOAD_MAX_SIZE=100):
+            res = self.client.post(
+                image_uploads_url(self.pin.id),
+                {'filename': 'photo.jpg', 'size': 101},
+                format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PinBboxApiTests(TestCase):
+    """Test pin locations and bounding box filtering"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'bbox@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def test_filter_pins_by_bbox(self):
+        """Test only pins inside the viewport are returned"""
+        paris = sample_pin(
+            user=self.user, title='Paris', latitude=48.8566, longitude=2.3522
+        )
+        sample_pin(
+            user=self.user, title='Tokyo', latitude=35.68, longitude=139.69
+        )
+        sample_pin(user=self.user, title='Nowhere')
+
+        res = self.client.get(PINS_URL, {'bbox': '2,48,3,49'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [pin['id'] for pin in res.data['results']], [paris.id]
+        )
+        self.assertEqual(res.data['results'][0]['latitude'], 48.8566)
+
+    def test_invalid_bbox(self):
+        """Test malformed or out of range boxes are rejected"""
+        for bbox in ('1,2,3', 'a,b,c,d', '0,50,10,40', '0,0,190,10'):
+            res = self.client.get(PINS_URL, {'bbox': bbox})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('bbox', res.data)
+
+    def test_create_pin_with_location(self):
+        """Test creating a pin stores its geohash"""
+        res = self.client.post(PINS_URL, {
+            'title': 'Aalborg', 'latitude': 57.64911, 'longitude': 10.40744
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        pin = Pin.objects.get(id=res.data['id'])
+        self.assertEqual(pin.geohash, 'u4pruydqq')
+
+    def test_create_pin_with_half_location(self):
+        """Test a latitude without a longitude is rejected"""
+        res = self.client.post(PINS_URL, {'title': 'Lost', 'latitude': 10})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('longitude', res.data)
+
+    def test_bulk_pins_with_location(self):
+        """Test bulk created and replaced pins get geohashes"""
+        pin = sample_pin(user=self.user, latitude=1, longitude=1)
+        res = self.client.post(BULK_URL, [
+            {'title': 'New', 'latitude': 57.64911, 'longitude': 10.40744},
+            {'id': pin.id, 'title': 'Moved'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        created = Pin.objects.get(title='New')
+        pin.refresh_from_db()
+        self.assertEqual(created.geohash, 'u4pruydqq')
+        self.assertIsNone(pin.latitude)
+        self.assertEqual(pin.geohash, '')
+
+
+class PinClusterApiTests(TestCase):
+    """Test the pin clusters endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'clusters@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def test_clusters_in_viewport(self):
+        """Test zoomed out views return one row per visible cluster"""
+        self.client.post(BULK_URL, [
+            {'title': 'Paris', 'latitude': 48.8566, 'longitude': 2.3522},
+            {
+                'title': 'Versailles',
+                'latitude': 48.8049,
+                'longitude': 2.1204,
+            },
+            {'title': 'Tokyo', 'latitude': 35.68, 'longitude': 139.69},
+        ], format='json')
+
+        res = self.client.get(
+            CLUSTERS_URL, {'bbox': '-10,40,10,55', 'zoom': 3}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['count'], 2)
+        self.assertAlmostEqual(
+            res.data[0]['latitude'], (48.8566 + 48.8049) / 2
+        )
+
+        res = self.client.get(
+            CLUSTERS_URL, {'bbox': '2,48,3,49', 'zoom': 12}
+        )
+        self.assertEqual([c['count'] for c in res.data], [1, 1])
+
+    def test_clusters_require_zoom(self):
+        """Test a missing or out of range zoom is rejected"""
+        for zoom in ('', 'x', 40):
+            res = self.client.get(
+                CLUSTERS_URL, {'bbox': '0,0,1,1', 'zoom': zoom}
+            )
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('zoom', res.data)
+
+
+def decode_tile(data):
+    """Return the (id, x, y, tag ids) entries of an encoded tile"""
+    def varint(pos):
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            value |= (byte & 0x7f) << shift
+            pos += 1
+            if not byte & 0x80:
+                return value, pos
+            shift += 7
+
+    assert data[:3] == tiles.MAGIC + bytes([tiles.VERSION])
+    count, pos = varint(3)
+    pins = []
+    pin_id = 0
+    for _ in range(count):
+        delta, pos = varint(pos)
+        pin_id += delta
+        x, y = struct.unpack_from('<HH', data, pos)
+        tag_count, pos = varint(pos + 4)
+        tag_ids = []
+        for _ in range(tag_count):
+            delta, pos = varint(pos)
+            tag_ids.append((tag_ids[-1] if tag_ids else 0) + delta)
+        pins.append((pin_id, x, y, tag_ids))
+    return pins
+
+
+def tile_url(z, x, y):
+    """Return URL for a map tile"""
+    return reverse('pins:tile', args=[z, x, y])
+
+
+@patch('django.db.transaction.on_commit', lambda func: func())
+class PinTileApiTests(TestCase):
+    """Test binary map tiles"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'tiles@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        tiles.tile_cache.cache.clear()
+        self.tag = sample_tag(user=self.user, name='Museum')
+        self.paris = sample_pin(
+            user=self.user, title='Paris', latitude=48.8566, longitude=2.3522
+        )
+        self.paris.tags.add(self.tag)
+        self.tokyo = sample_pin(
+            user=self.user, title='Tokyo', latitude=35.68, longitude=139.69
+        )
+
+    def test_tile_holds_pins(self):
+        """Test a tile encodes the ids, positions and tags of its pins"""
+        res = self.client.get(tile_url(1, 1, 0))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], tiles.CONTENT_TYPE)
+        pins = decode_tile(res.content)
+        self.assertEqual(
+            [(pin_id, tag_ids) for pin_id, _, _, tag_ids in pins],
+            [(self.paris.id, [self.tag.id]), (self.tokyo.id, [])],
+        )
+        self.assertEqual(decode_tile(self.client.get(
+            tile_url(1, 0, 0)
+        ).content), [])
+
+    def test_tile_not_modified(self):
+        """Test a tile is answered with 304 while its version holds"""
+        res = self.client.get(tile_url(3, 4, 2))
+
+        res = self.client.get(
+            tile_url(3, 4, 2), HTTP_IF_NONE_MATCH=res['ETag']
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_changed_tiles_invalidated(self):
+        """Test moving a pin replaces only the tiles it left or entered"""
+        europe = self.client.get(tile_url(3, 4, 2))['ETag']
+        asia = self.client.get(tile_url(3, 7, 3))['ETag']
+
+        self.client.patch(
+            detail_url(self.paris.id),
+            {'latitude': 48.8049, 'longitude': 2.1204},
+        )
+
+        self.assertNotEqual(
+            self.client.get(tile_url(3, 4, 2))['ETag'], europe
+        )
+        self.assertEqual(self.client.get(tile_url(3, 7, 3))['ETag'], asia)
+
+        europe = self.client.get(tile_url(3, 4, 2))['ETag']
+        self.paris.tags.clear()
+        self.assertNotEqual(
+            self.client.get(tile_url(3, 4, 2))['ETag'], europe
+        )
+
+    def test_bulk_write_replaces_tile_generation(self):
+        """Test many changed points drop every tile with one delete"""
+        europe = self.client.get(tile_url(3, 4, 2))['ETag']
+        asia = self.client.get(tile_url(3, 7, 3))['ETag']
+        cache = tiles.tile_cache.cache
+        points = [(-60.0 + i, -100.0) for i in range(100)]
+
+        with patch.object(cache, 'delete_many') as delete_many, \
+                patch.object(cache, 'delete', wraps=cache.delete) as delete:
+            tiles.tile_cache.invalidate(self.user.id, points)
+
+        delete_many.assert_not_called()
+        self.assertEqual(delete.call_count, 1)
+        self.assertNotEqual(
+            self.client.get(tile_url(3, 4, 2))['ETag'], europe
+        )
+        self.assertNotEqual(self.client.get(tile_url(3, 7, 3))['ETag'], asia)
+
+    def test_tile_out_of_range(self):
+        """Test tiles outside the zoom level grid are not found"""
+        res = self.client.get(tile_url(2, 4, 0))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PinNearestApiTests(TestCase):
+    """Test nearest pin lookups"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'near@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+        places = {
+            'Paris': (48.8566, 2.3522),
+            'Versailles': (48.8049, 2.1204),
+            'London': (51.5074, -0.1278),
+            'Tokyo': (35.68, 139.69),
+            'Fiji': (-17.7134, 178.065),
+        }
+        self.pins = {
+            title: sample_pin(
+                user=self.user, title=title,
+                latitude=latitude, longitude=longitude,
+            )
+            for title, (latitude, longitude) in places.items()
+        }
+        sample_pin(user=self.user, title='Nowhere')
+
+    def _titles(self, res):
+        return [pin['title'] for pin in res.data]
+
+    def test_nearest_pins(self):
+        """Test the k nearest pins are returned nearest first"""
+        res = self.client.get(PINS_URL, {'near': '48.85,2.35', 'k': 3})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self._titles(res), ['Paris', 'Versailles', 'London']
+        )
+
+    def test_nearest_across_antimeridian(self):
+        """Test the search wraps around the antimeridian"""
+        res = self.client.get(PINS_URL, {'near': '-17,-179', 'k': 1})
+
+        self.assertEqual(self._titles(res), ['Fiji'])
+
+    def test_nearest_with_tags(self):
+        """Test nearest lookups only consider pins with the given tags"""
+        tag = sample_tag(user=self.user, name='Far')
+        self.pins['Tokyo'].tags.add(tag)
+        self.pins['Fiji'].tags.add(tag)
+
+        res = self.client.get(
+            PINS_URL, {'near': '48.85,2.35', 'k': 5, 'tags': tag.id}
+        )
+
+        self.assertEqual(self._titles(res), ['Tokyo', 'Fiji'])
+
+    def test_nearest_invalid_params(self):
+        """Test malformed points and counts are rejected"""
+        for params, field in (
+            ({'near': '91,0'}, 'near'),
+            ({'near': 'a,b'}, 'near'),
+            ({'near': '0,0', 'k': 0}, 'k'),
+            ({'near': '0,0', 'k': 1000}, 'k'),
+        ):
+            res = self.client.get(PINS_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field, res.data)
+
+
+class PinSearchApiTests(TestCase):
+    """Test searching pins"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'search@dev.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+
+    def test_search_pins(self):
+        """Test search results are ranked and limited to the page size"""
+        tag = sample_tag(user=self.user, name='Museum')
+        tagged = sample_pin(user=self.user, title='Paris')
+        tagged.tags.add(tag)
+        titled = sample_pin(user=self.user, title='Museum of Paris')
+        sample_pin(user=self.user, title='London')
+
+        res = self.client.get(PINS_URL, {'q': 'paris museum'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [pin['id'] for pin in res.data], [titled.id, tagged.id]
+        )
+
+        res = self.client.get(PINS_URL, {'q': 'paris', 'page_size': 1})
+        self.assertEqual(len(res.data), 1)
+
+    def test_search_with_tags(self):
+        """Test search applies the other filters"""
+        tag = sample_tag(user=self.user, name='Visited')
+        visited = sample_pin(user=self.user, title='Paris')
+        visited.tags.add(tag)
+        sample_pin(user=self.user, title='Paris again')
+
+        res = self.client.get(PINS_URL, {'q': 'paris', 'tags': tag.id})
+
+        self.assertEqual([pin['id'] for pin in res.data], [visited.id])
+
+    def test_search_after_bulk_write(self):
+        """Test pins written in bulk are searchable"""
+        self.client.post(BULK_URL, [{'title': 'Bulk pin'}], format='json')
+
+        res = self.client.get(PINS_URL, {'q': 'bulk'})
+
+        self.assertEqual([pin['title'] for pin in res.data], ['Bulk pin'])
+
+    def test_search_with_near_rejected(self):
+        """Test search and nearest lookups cannot be combined"""
+        res = self.client.get(PINS_URL, {'q': 'paris', 'near': '0,0'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('q', res.data)
@@ -0,0 +1,224 @@
+"""EXPLAIN checks of the queries behind each read endpoint
+
+Every endpoint is requested against a seeded dataset, and the plan of
+each SELECT it runs must neither scan a whole table nor sort rows an
+index could have returned in order. PostgreSQL plans are taken with
+sequential scans and sorts priced out, so they only appear when no
+index can serve the query.
+"""
+import random
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import Pin, PinCluster, PinTerm, Tag
+
+from pins import tiles
+from pins.cache import response_cache
+
+PINS_URL = reverse('pins:pin-list')
+CLUSTERS_URL = reverse('pins:pin-clusters')
+EXPORT_URL = reverse('pins:pin-export')
+TAGS_URL = reverse('pins:tag-list')
+
+SEED_PINS = 2000
+SEED_TAGS = 40
+SEED_USERS = 50
+WORDS = ('museum', 'park', 'cafe', 'bridge', 'market', 'garden', 'tower')
+
+
+def explain(sql):
+    """Return the plan lines of a query"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('SET enable_seqscan = off')
+        cursor.execute('SET enable_sort = off')
+        try:
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.execute('RESET enable_seqscan')
+            cursor.execute('RESET enable_sort')
+
+
+def table_scans(plan):
+    """Return the plan lines reading a whole table"""
+    if connection.vendor == 'sqlite':
+        return [
+            line for line in plan
+            if line.startswith('SCAN ') and 'INDEX' not in line and
+            'CONSTANT ROW' not in line
+        ]
+    return [line for line in plan if 'Seq Scan' in line]
+
+
+def sorts(plan):
+    """Return the plan lines sorting rows"""
+    if connection.vendor == 'sqlite':
+        return [line for line in plan if 'TEMP B-TREE' in line]
+    return [
+        line for line in plan
+        if line.lstrip(' ->').startswith(('Sort ', 'Incremental Sort '))
+    ]
+
+
+class QueryPlanTests(TestCase):
+    """Test the read endpoints only run index backed queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls._seed('plans@dev.com')
+        cls._seed('other@dev.com')
+        # Tags of many users, so no plan can afford to read them all
+        get_user_model().objects.bulk_create(
+            get_user_model()(email=f'tags{i}@dev.com')
+            for i in range(SEED_USERS)
+        )
+        Tag.objects.bulk_create(
+            Tag(user_id=user.pk, name=f'Tag {i}')
+            for user in get_user_model().objects.filter(
+                email__startswith='tags'
+            )
+            for i in range(SEED_TAGS)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    @classmethod
+    def _seed(cls, email):
+        """Create a user with tagged, located and indexed pins"""
+        rand = random.Random(email)
+        user = get_user_model().objects.create_user(email, 'testpass')
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(SEED_TAGS)
+        )
+        tag_ids = list(Tag.objects.filter(
+            user=user
+        ).values_list('id', flat=True))
+
+        pins = []
+        for i in range(SEED_PINS):
+            pin = Pin(
+                user=user,
+                title=' '.join(rand.sample(WORDS, 2)),
+                latitude=rand.uniform(-60, 70),
+                longitude=rand.uniform(-180, 180),
+            )
+            pin.update_geohash()
+            pins.append(pin)
+        Pin.objects.bulk_create(pins)
+
+        pin_ids = list(Pin.objects.filter(
+            user=user
+        ).values_list('id', flat=True))
+        Pin.tags.through.objects.bulk_create(
+            Pin.tags.through(pin_id=pin_id, tag_id=tag_id)
+            for pin_id in pin_ids
+            for tag_id in rand.sample(tag_ids, 3)
+        )
+        PinCluster.objects.move(user.pk, added=[
+            (pin.latitude, pin.longitude) for pin in pins
+        ])
+        PinTerm.objects.reindex(pin_ids)
+        Tag.objects.recount_pins()
+        return user
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
+        tiles.tile_cache.cache.clear()
+        self.tag_ids = ','.join(str(tag_id) for tag_id in Tag.objects.filter(
+            user=self.user
+        ).values_list('id', flat=True)[:5])
+
+    def assertIndexedPlans(self, url, params=None, sorted_by=0):
+        """Request a URL and check the plans of the queries it runs
+
+        `sorted_by` is the number of sorts the endpoint cannot avoid,
+        such as ranking search results by score.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, params)
+            if res.streaming:
+                b''.join(res.streaming_content)
+        self.assertEqual(res.status_code, 200)
+
+        selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].lstrip().upper().startswith('SELECT')
+        ]
+        self.assertTrue(selects)
+        found_sorts = []
+        for sql in selects:
+            plan = explain(sql)
+            self.assertEqual(table_scans(plan), [], f'{sql}\n{plan}')
+            found_sorts.extend(sorts(plan))
+        self.assertLessEqual(len(found_sorts), sorted_by, found_sorts)
+        return res
+
+    def test_pin_list_plans(self):
+        """Test listing pins walks the (user, date, id) index"""
+        res = self.assertIndexedPlans(PINS_URL, {'page_size': 20})
+
+        cursor = parse_qs(urlparse(res.data['next']).query)['cursor'][0]
+        self.assertIndexedPlans(PINS_URL, {'page_size': 20, 'cursor': cursor})
+
+    def test_pin_tag_filter_plans(self):
+        """Test tag filters probe the through table indexes"""
+        self.assertIndexedPlans(PINS_URL, {'tags': self.tag_ids})
+        self.assertIndexedPlans(PINS_URL, {'tags_any': self.tag_ids})
+        # Matches are counted per pin, then ordered once found
+        self.assertIndexedPlans(
+            PINS_URL, {'tags_all': self.tag_ids}, sorted_by=2
+        )
+
+    def test_pin_location_plans(self):
+        """Test bounding box and nearest lookups use the geohash index"""
+        # Pins found by location are then ordered by date, or by distance
+        self.assertIndexedPlans(
+            PINS_URL, {'bbox': '-10,35,30,60'}, sorted_by=1
+        )
+        self.assertIndexedPlans(
+            PINS_URL, {'near': '48.85,2.35', 'k': 10}, sorted_by=1
+        )
+
+    def test_pin_search_plans(self):
+        """Test search reads the postings index"""
+        # Postings are grouped per pin, ranked, then the pins put in rank
+        self.assertIndexedPlans(PINS_URL, {'q': 'museum park'}, sorted_by=3)
+
+    def test_pin_detail_plans(self):
+        """Test retrieving a pin looks it up by key"""
+        pin = Pin.objects.filter(user=self.user).first()
+
+        self.assertIndexedPlans(reverse('pins:pin-detail', args=[pin.id]))
+
+    def test_cluster_plans(self):
+        """Test clusters are read from the (user, length, cell) index"""
+        # The cells of separate ranges are merged into one order
+        self.assertIndexedPlans(
+            CLUSTERS_URL, {'bbox': '-10,35,30,60', 'zoom': 4}, sorted_by=1
+        )
+
+    def test_tile_plans(self):
+        """Test tiles read pins and their tags by index"""
+        z, x, y = 3, 4, 2
+        self.assertIndexedPlans(reverse('pins:tile', args=[z, x, y]))
+
+    def test_export_plans(self):
+        """Test exporting walks the user's pins by index"""
+        self.assertIndexedPlans(EXPORT_URL)
+
+    def test_tag_list_plans(self):
+        """Test listing tags walks the (user, name) index"""
+        self.assertIndexedPlans(TAGS_URL)
+        self.assertIndexedPlans(TAGS_URL, {'assigned_only': 1})
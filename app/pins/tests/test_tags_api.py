@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import TestCase
@@ -7,10 +9,12 @@ from rest_framework.test import APIClient
 
 from core.models import Tag, Pin
 
+from pins.cache import response_cache
 from pins.serializers import TagSerializer
 import datetime
 
 TAGS_URL = reverse('pins:tag-list')
+UPSERT_URL = reverse('pins:tag-upsert')
 
 
 class PublicTagsApiTests(TestCase):
@@ -36,6 +40,7 @@ class PrivateTagsApiTests(TestCase):
         )
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        response_cache.cache.clear()
 
     def test_retrieve_tags(self):
         """Test retrieving tags"""
@@ -64,6 +69,27 @@ class PrivateTagsApiTests(TestCase):
         self.assertEqual(len(res.data), 1)
         self.assertEqual(res.data[0]['name'], tag.name)
 
+    def test_tags_not_modified(self):
+        """Test the tag list answers a matching If-None-Match with 304"""
+        self.user.refresh_from_db()
+        etag = self.client.get(TAGS_URL)['ETag']
+        Tag.objects.create(user=self.user, name='Concert')
+        self.user.refresh_from_db()
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_assigned_only_list_cached(self):
+        """Test equivalent assigned_only values share a cache entry"""
+        self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        res = self.client.get(TAGS_URL, {'assigned_only': '01'})
+
+        self.assertEqual(res['X-Cache'], 'HIT')
+
     def test_create_tag_successful(self):
         """Test creating a new tag"""
         payload = {'name': 'Simple'}
@@ -82,6 +108,77 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_tag_duplicate_name(self):
+        """Test creating a tag with a name the user already has fails"""
+        Tag.objects.create(user=self.user, name='Simple')
+
+        res = self.client.post(TAGS_URL, {'name': 'Simple'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Tag.objects.filter(user=self.user, name='Simple').count(), 1
+        )
+
+    def test_create_tag_duplicate_name_race(self):
+        """Test a name taken after the check still fails with a 400"""
+        Tag.objects.create(user=self.user, name='Simple')
+
+        with patch.object(
+            TagSerializer, 'validate_name', side_effect=lambda value: value
+        ):
+            res = self.client.post(TAGS_URL, {'name': 'Simple'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', res.data)
+        self.assertEqual(
+            Tag.objects.filter(user=self.user, name='Simple').count(), 1
+        )
+
+    def test_create_tag_name_used_by_other_user(self):
+        """Test tag names only need to be unique per user"""
+        user2 = get_user_model().objects.create_user(
+            'other@devansh.com',
+            'testpass'
+        )
+        Tag.objects.create(user=user2, name='Simple')
+
+        res = self.client.post(TAGS_URL, {'name': 'Simple'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_upsert_tags(self):
+        """Test upserting returns existing tags and creates missing ones"""
+        existing = Tag.objects.create(user=self.user, name='Festival')
+        payload = {'names': ['Party', 'Festival', 'Party', 'Concert']}
+
+        res = self.client.post(UPSERT_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [tag['name'] for tag in res.data],
+            ['Party', 'Festival', 'Concert']
+        )
+        self.assertEqual(res.data[1]['id'], existing.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+    def test_upsert_tags_query_count(self):
+        """Test upserting a batch of names uses a fixed number of queries"""
+        Tag.objects.create(user=self.user, name='Tag 0')
+        payload = {'names': [f'Tag {i}' for i in range(200)]}
+
+        # lookup, insert of the missing names, lookup of the new rows
+        # and the data version bump
+        with self.assertNumQueries(4):
+            res = self.client.post(UPSERT_URL, payload, format='json')
+
+        self.assertEqual(len(res.data), 200)
+
+    def test_upsert_tags_invalid(self):
+        """Test upserting without names fails"""
+        res = self.client.post(UPSERT_URL, {'names': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_retrieve_tags_assigned_to_pins(self):
         """Test filtering tags by those assigned to pins"""
         tag1 = Tag.objects.create(user=self.user, name='tag1')
@@ -92,6 +189,7 @@ class PrivateTagsApiTests(TestCase):
             user=self.user,
         )
         pin.tags.add(tag1)
+        tag1.refresh_from_db()
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
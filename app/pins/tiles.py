@@ -0,0 +1,216 @@
+"""Compact binary map tiles of a user's pins
+
+Tiles follow the slippy map (Web Mercator) z/x/y scheme. A tile is:
+
+    b'PT' version:u8 count:varint
+    then per pin, in id order:
+        id_delta:varint x:u16 y:u16 tag_count:varint tag_delta:varint...
+
+All integers are little endian. `x` and `y` quantize the position of the
+pin inside the tile to 0-65535 from the north west corner, and ids and
+tag ids are written as differences from the previous one.
+
+Encoded tiles are cached under a per tile version. Writes that move,
+create, delete or retag located pins replace the version of every tile
+containing the affected points, so only those tiles are rebuilt. Tile
+versions are kept under a per user generation, which writes touching
+many points replace instead, so a bulk write costs one cache delete
+rather than one per point and zoom level.
+"""
+import math
+import struct
+import uuid
+from collections import defaultdict
+
+from django.core.cache import caches
+from django.db import transaction
+
+from core.models import Pin
+
+CONTENT_TYPE = 'application/vnd.pinmap.tile'
+MAGIC = b'PT'
+VERSION = 1
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.05112878
+QUANTUM = 65536
+
+
+def tile_bounds(z, x, y):
+    """Return the (west, south, east, north) bounds of a tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(
+        math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n)))
+    )
+    return west, south, east, north
+
+
+def project(latitude, longitude, z):
+    """Return the fractional tile coordinates of a point at a zoom level"""
+    n = 2 ** z
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    tile_x = (longitude + 180.0) / 360.0 * n
+    tile_y = (
+        1 - math.asinh(math.tan(math.radians(latitude))) / math.pi
+    ) / 2 * n
+    return tile_x, tile_y
+
+
+def tiles_of(points, max_zoom=MAX_ZOOM):
+    """Return the set of (z, x, y) tiles containing any of the points"""
+    tiles = set()
+    for latitude, longitude in points:
+        if latitude is None or longitude is None:
+            continue
+        for z in range(max_zoom + 1):
+            tile_x, tile_y = project(latitude, longitude, z)
+            last = 2 ** z - 1
+            tiles.add((
+                z,
+                min(int(tile_x), last),
+                min(int(tile_y), last),
+            ))
+    return tiles
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_tile(z, x, y, pins):
+    """Encode (id, latitude, longitude, tag ids) tuples into a tile"""
+    pins = sorted(pins)
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    out += _varint(len(pins))
+    previous_id = 0
+    for pin_id, latitude, longitude, tag_ids in pins:
+        tile_x, tile_y = project(latitude, longitude, z)
+        out += _varint(pin_id - previous_id)
+        out += struct.pack(
+            '<HH',
+            min(max(int((tile_x - x) * QUANTUM), 0), QUANTUM - 1),
+            min(max(int((tile_y - y) * QUANTUM), 0), QUANTUM - 1),
+        )
+        out += _varint(len(tag_ids))
+        previous_tag = 0
+        for tag_id in sorted(tag_ids):
+            out += _varint(tag_id - previous_tag)
+            previous_tag = tag_id
+        previous_id = pin_id
+    return bytes(out)
+
+
+def build_tile(user, z, x, y):
+    """Read the pins of a tile from the database and encode them"""
+    west, south, east, north = tile_bounds(z, x, y)
+    pins = Pin.objects.in_bbox(user, west, south, east, north)
+    # Points on a shared edge belong to the tile east or south of it
+    last = 2 ** z - 1
+    if x < last:
+        pins = pins.filter(longitude__lt=east)
+    if y < last:
+        pins = pins.filter(latitude__gt=south)
+
+    tag_ids = defaultdict(list)
+    links = Pin.tags.through.objects.filter(
+        pin__in=pins.values('id')
+    ).values_list('pin_id', 'tag_id')
+    for pin_id, tag_id in links:
+        tag_ids[pin_id].append(tag_id)
+
+    return encode_tile(z, x, y, [
+        (pin_id, latitude, longitude, tag_ids[pin_id])
+        for pin_id, latitude, longitude
+        in pins.values_list('id', 'latitude', 'longitude')
+    ])
+
+
+class TileCache:
+    """Encoded tiles cached under per tile versions"""
+
+    # Writes touching more points replace the user's tile generation
+    max_invalidated_points = 16
+
+    def __init__(self, alias='tiles'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _generation_key(self, user_id):
+        return f'tilegen:{user_id}'
+
+    def _version_key(self, user_id, generation, z, x, y):
+        return f'tilever:{user_id}:{generation}:{z}:{x}:{y}'
+
+    def _get_or_start(self, key):
+        version = self.cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            self.cache.add(key, version, timeout=None)
+            version = self.cache.get(key, version)
+        return version
+
+    def get_version(self, user_id, z, x, y):
+        """Return the current version of a tile, starting one if needed"""
+        generation = self._get_or_start(self._generation_key(user_id))
+        return self._get_or_start(
+            self._version_key(user_id, generation, z, x, y)
+        )
+
+    def get_tile(self, user, z, x, y):
+        """Return (version, encoded tile), building it on a miss
+
+        The version is read before the pins, so a tile built from data
+        that changes meanwhile is stored under a version already replaced.
+        """
+        version = self.get_version(user.pk, z, x, y)
+        key = f'tile:{user.pk}:{z}:{x}:{y}:{version}'
+        data = self.cache.get(key)
+        if data is None:
+            data = build_tile(user, z, x, y)
+            self.cache.set(key, data)
+        return version, data
+
+    def invalidate(self, user_id, points):
+        """Drop the versions of the tiles holding any of the points
+
+        Past `max_invalidated_points` points the user's generation is
+        dropped, replacing the version of every tile of theirs. Runs once
+        the current transaction commits, so readers cannot cache a tile
+        of uncommitted data under the new version.
+        """
+        points = list(points[:self.max_invalidated_points + 1])
+        if len(points) > self.max_invalidated_points:
+            key = self._generation_key(user_id)
+            transaction.on_commit(lambda: self.cache.delete(key))
+            return
+
+        tiles = tiles_of(points)
+        if tiles:
+            transaction.on_commit(
+                lambda: self._drop_versions(user_id, tiles)
+            )
+
+    def _drop_versions(self, user_id, tiles):
+        generation = self.cache.get(self._generation_key(user_id))
+        if generation is not None:
+            self.cache.delete_many([
+                self._version_key(user_id, generation, *tile)
+                for tile in tiles
+            ])
+
+
+tile_cache = TileCache()
@@ -0,0 +1,77 @@
+import fcntl
+import os
+
+from PIL import Image
+from django.core.files import File
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class OffsetConflict(Exception):
+    """A part was sent for an offset other than the bytes received"""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def append_part(upload, offset, stream):
+    """Append a request body to the upload file at the given offset
+
+    The body is copied in small chunks so memory stays flat whatever the
+    part size. Parts of an upload are appended one at a time under a
+    lock on its file, and the offset is checked once the lock is held,
+    so a retried part racing the original fails with a conflict.
+    Returns the new offset.
+    """
+    os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+    with open(upload.path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise OffsetConflict(current)
+
+        remaining = upload.size - current
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(chunk) > remaining:
+                f.truncate(current)
+                raise exceptions.ValidationError(
+                    _('Part goes past the declared upload size.')
+                )
+            f.write(chunk)
+            remaining -= len(chunk)
+    return upload.size - remaining
+
+
+def complete(upload):
+    """Hand the assembled file to the pin image field
+
+    Returns False, leaving the pin untouched, if the file is not a valid
+    image.
+    """
+    with open(upload.path, 'rb') as f:
+        try:
+            with Image.open(f) as image:
+                image.verify()
+        except Exception:
+            return False
+
+        f.seek(0)
+        upload.pin.image.save(upload.filename, File(f))
+    return True
+
+
+def discard(upload):
+    """Remove an upload and its temporary file"""
+    try:
+        os.remove(upload.path)
+    except FileNotFoundError:
+        pass
+    upload.delete()
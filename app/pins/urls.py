@@ -10,5 +10,15 @@ router.register('pins', views.PinViewSet)
 app_name = 'pins'
 
 urlpatterns = [
-    path('', include(router.urls))
+    path('', include(router.urls)),
+    path(
+        'tiles/<int:z>/<int:x>/<int:y>/',
+        views.PinTileView.as_view(),
+        name='tile'
+    ),
+    path(
+        'cache-stats/',
+        views.ResponseCacheStatsView.as_view(),
+        name='cache-stats'
+    ),
 ]
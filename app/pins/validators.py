@@ -0,0 +1,16 @@
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import serializers
+
+
+def validate_location(attrs, instance=None):
+    """Check a pin location is given with both coordinates or neither"""
+    latitude = attrs.get('latitude', getattr(instance, 'latitude', None))
+    longitude = attrs.get('longitude', getattr(instance, 'longitude', None))
+    if (latitude is None) != (longitude is None):
+        raise serializers.ValidationError({
+            'latitude' if latitude is None else 'longitude': [
+                _('Give both latitude and longitude, or neither.')
+            ]
+        })
+    return attrs
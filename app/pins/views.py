@@ -1,21 +1,53 @@
+import math
+from io import BytesIO
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, Prefetch, When
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 
-from core.models import Tag,  Pin
+from core import geo
+from core.models import ImageUpload, Tag,  Pin, PinCluster
 
 
-from pins import serializers
+from pins import images, serializers, tiles, uploads
+from pins.cache import response_cache
+from pins.export import iter_pins_ndjson
+from pins.importer import PinImporter
+from pins.mixins import CachedListMixin, DataVersionConditionalMixin, \
+    SerializationMetricsMixin
+from pins.pagination import PinCursorPagination
 
 
-class BasePinAttrViewSet(viewsets.GenericViewSet,
+class BasePinAttrViewSet(DataVersionConditionalMixin,
+                         CachedListMixin,
+                         SerializationMetricsMixin,
+                         viewsets.GenericViewSet,
                          mixins.ListModelMixin,
                          mixins.CreateModelMixin):
     """Base viewset for user owned pins attributes"""
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    cache_query_params = ('assigned_only',)
+
+    def normalize_cache_param(self, name, value):
+        """Return a canonical form of a query parameter value"""
+        if name == 'assigned_only':
+            try:
+                return str(int(bool(int(value))))
+            except ValueError:
+                pass
+        return value
 
     def get_queryset(self):
         """Return objects for current user"""
@@ -24,14 +56,22 @@ class BasePinAttrViewSet(viewsets.GenericViewSet,
         )
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(pin__isnull=False)
+            queryset = queryset.filter(pin_count__gt=0)
         return queryset.filter(
             user=self.request.user
-        ).order_by('-name').distinct()
+        ).order_by('-name')
 
     def perform_create(self, serializer):
         """Create a new ingredient"""
-        serializer.save(user=self.request.user)
+        # The name check races with concurrent creates, which the unique
+        # constraint catches
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError(
+                {'name': [serializer.error_messages['unique_name']]}
+            )
 
 
 class TagViewSet(BasePinAttrViewSet):
@@ -39,34 +79,254 @@ class TagViewSet(BasePinAttrViewSet):
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
 
+    def get_serializer_class(self):
+        """Return appropriate serializer class"""
+        if self.action == 'upsert':
+            return serializers.TagUpsertSerializer
+
+        return self.serializer_class
+
+    @action(methods=['POST'], detail=False)
+    def upsert(self, request):
+        """Return tags for a batch of names, creating missing ones"""
+        serializer = self.get_serializer(data=request.data)
+
+        if serializer.is_valid():
+            tags = Tag.objects.resolve_names(
+                request.user,
+                serializer.validated_data['names']
+            )
+            return Response(
+                serializers.TagSerializer(tags.values(), many=True).data,
+                status=status.HTTP_200_OK
+            )
+
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
 
-class PinViewSet(viewsets.ModelViewSet):
+class PinViewSet(DataVersionConditionalMixin,
+                 CachedListMixin,
+                 SerializationMetricsMixin,
+                 viewsets.ModelViewSet):
     """Manage pins in the database"""
     serializer_class = serializers.PinSerializer
     queryset = Pin.objects.all()
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = PinCursorPagination
+    cache_query_params = (
+        'tags', 'tags_any', 'tags_all', 'bbox', 'near', 'k', 'q',
+        'cursor', 'page_size',
+    )
+    tag_query_params = ('tags', 'tags_any', 'tags_all')
+    conditional_actions = ('list', 'retrieve', 'clusters')
+    max_zoom = 22
+    nearest_k = 20
+    max_nearest_k = 100
+    export_chunk_size = 1000
+    import_batch_size = 1000
+    import_max_errors = 1000
+    invalid_bbox_message = _(
+        'Expected minLon,minLat,maxLon,maxLat in degrees.'
+    )
+
+    def normalize_cache_param(self, name, value):
+        """Return a canonical form of a query parameter value"""
+        if name in self.tag_query_params:
+            try:
+                return ','.join(
+                    str(tag_id)
+                    for tag_id in sorted(set(self._params_to_ints(value)))
+                )
+            except ValueError:
+                pass
+        return value
 
     def _params_to_ints(self, qs):
         """Convert a list of string IDs to a list of integers"""
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _params_to_tag_ids(self, name, qs):
+        """Convert a tag filter to integers, rejecting malformed ids"""
+        try:
+            return self._params_to_ints(qs)
+        except ValueError:
+            raise ValidationError({name: [
+                _('Expected comma separated tag ids.')
+            ]})
+
+    def _params_to_bbox(self, qs):
+        """Convert a minLon,minLat,maxLon,maxLat string to floats"""
+        try:
+            min_lon, min_lat, max_lon, max_lat = (
+                float(value) for value in qs.split(',')
+            )
+        except ValueError:
+            raise ValidationError({'bbox': [self.invalid_bbox_message]})
+        if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and
+                -90 <= min_lat <= max_lat <= 90):
+            raise ValidationError({'bbox': [self.invalid_bbox_message]})
+        return min_lon, min_lat, max_lon, max_lat
+
+    def _params_to_zoom(self, qs):
+        """Convert a zoom level string to an integer"""
+        try:
+            zoom = int(qs)
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValidationError({'zoom': [
+                _('Expected a zoom level between 0 and {max_zoom}.')
+                .format(max_zoom=self.max_zoom)
+            ]})
+        return zoom
+
+    def _params_to_point(self, qs):
+        """Convert a lat,lon string to floats"""
+        try:
+            latitude, longitude = (float(value) for value in qs.split(','))
+        except ValueError:
+            latitude = longitude = math.nan
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValidationError({'near': [
+                _('Expected lat,lon in degrees.')
+            ]})
+        return latitude, longitude
+
+    def _params_to_k(self, qs):
+        """Convert the number of nearest pins wanted to an integer"""
+        if not qs:
+            return self.nearest_k
+        try:
+            k = int(qs)
+        except ValueError:
+            k = 0
+        if not 1 <= k <= self.max_nearest_k:
+            raise ValidationError({'k': [
+                _('Expected a number between 1 and {max_k}.')
+                .format(max_k=self.max_nearest_k)
+            ]})
+        return k
+
     def get_queryset(self):
-        """Retrieve the pins for the authenticated user"""
-        tags = self.request.query_params.get('tags')
+        """Retrieve the pins for the authenticated user
+
+        `tags` and `tags_any` keep pins with any of the tags, `tags_all`
+        keeps pins with every one of them.
+        """
+        params = self.request.query_params
+        if params.get('tags_any') and params.get('tags'):
+            raise ValidationError({'tags_any': [
+                _('Cannot be combined with tags.')
+            ]})
+        tags_any = params.get('tags_any') or params.get('tags')
+        tags_all = params.get('tags_all')
+        bbox = self.request.query_params.get('bbox')
+        near = self.request.query_params.get('near')
+        text = self.request.query_params.get('q')
+        user = self.request.user
 
         queryset = self.queryset
-        if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
-        return queryset.filter(user=self.request.user)
+        if tags_any:
+            name = 'tags_any' if params.get('tags_any') else 'tags'
+            queryset = queryset.with_any_tags(
+                self._params_to_tag_ids(name, tags_any)
+            )
+        if tags_all:
+            queryset = queryset.with_all_tags(
+                self._params_to_tag_ids('tags_all', tags_all)
+            )
+        # Geohash and search lookups match the user in their own queries
+        if bbox:
+            queryset = queryset.in_bbox(user, *self._params_to_bbox(bbox))
+        if self.action == 'list' and near and text:
+            raise ValidationError({'q': [
+                _('Search cannot be combined with near.')
+            ]})
+        if near and self.action == 'list':
+            queryset = self._nearest(queryset, near)
+        elif text and self.action == 'list':
+            queryset = self._search(queryset, text)
+        elif not bbox:
+            queryset = queryset.filter(user=user)
+
+        if self.action in ('list', 'retrieve'):
+            queryset = self._limit_to_rendered_fields(queryset)
+        return queryset
+
+    def _nearest(self, queryset, near):
+        """Limit the pins to the k nearest to a point, nearest first"""
+        latitude, longitude = self._params_to_point(near)
+        k = self._params_to_k(self.request.query_params.get('k'))
+        ids = queryset.nearest(self.request.user, latitude, longitude, k)
+        return self._in_order(ids)
+
+    def _search(self, queryset, text):
+        """Limit the pins to the best matches of a search, best first"""
+        limit = self.paginator.get_page_size(self.request)
+        return self._in_order(
+            queryset.search(self.request.user, text, limit)
+        )
+
+    def _in_order(self, ids):
+        """Return the pins with the given ids, in the order given"""
+        queryset = Pin.objects.filter(id__in=ids)
+        if ids:
+            queryset = queryset.order_by(Case(
+                *(When(id=pin_id, then=rank) for rank, pin_id in
+                  enumerate(ids)),
+                output_field=IntegerField(),
+            ))
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        """Return nearest pins and search results whole, they are ranked
+
+        Both are limited, to k pins and to the page size.
+        """
+        params = self.request.query_params
+        if self.action == 'list' and (params.get('near') or params.get('q')):
+            return None
+        return super().paginate_queryset(queryset)
+
+    def _limit_to_rendered_fields(self, queryset):
+        """Fetch only the pin and tag columns the serializer renders"""
+        serializer_class = self.get_serializer_class()
+        columns = {field.name for field in Pin._meta.concrete_fields}
+        pin_fields = [
+            field for field in serializer_class.Meta.fields
+            if field in columns
+        ]
+        if self.action == 'retrieve':
+            tag_fields = serializers.TagSerializer.Meta.fields
+        else:
+            tag_fields = ('id',)
+
+        return queryset.only(*pin_fields).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only(*tag_fields))
+        )
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
         if self.action == 'retrieve':
             return serializers.PinDetailSerializer
-        elif self.action == 'upload_image':
+        elif self.action in ('upload_image', 'complete_image_upload'):
             return serializers.PinImageSerializer
+        elif self.action in (
+            'start_image_upload',
+            'image_upload',
+            'append_image_upload',
+        ):
+            return serializers.ImageUploadSerializer
+        elif self.action == 'bulk':
+            return serializers.PinBulkSerializer
+        elif self.action == 'import_pins':
+            return serializers.PinImportSerializer
+        elif self.action == 'clusters':
+            return serializers.PinClusterSerializer
 
         return self.serializer_class
 
@@ -74,6 +334,77 @@ class PinViewSet(viewsets.ModelViewSet):
         """Create a new pin"""
         serializer.save(user=self.request.user)
 
+    @action(methods=['POST'], detail=False)
+    def bulk(self, request):
+        """Create or replace many pins in one request"""
+        serializer = self.get_serializer(data=request.data, many=True)
+
+        if serializer.is_valid():
+            serializer.save()
+            return Response(
+                serializer.data,
+                status=status.HTTP_200_OK
+            )
+
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(methods=['GET'], detail=False)
+    def clusters(self, request):
+        """Return pin clusters of a zoom level inside a bounding box"""
+        bbox = self._params_to_bbox(request.query_params.get('bbox', ''))
+        zoom = self._params_to_zoom(request.query_params.get('zoom', ''))
+
+        clusters = PinCluster.objects.in_bbox(
+            request.user, geo.cluster_length(zoom), *bbox
+        ).order_by('cell')
+        return Response(
+            self.get_serializer(clusters, many=True).data,
+            status=status.HTTP_200_OK
+        )
+
+    @action(methods=['GET'], detail=False)
+    def export(self, request):
+        """Stream every pin of the user as newline delimited JSON"""
+        response = StreamingHttpResponse(
+            iter_pins_ndjson(self.get_queryset(), self.export_chunk_size),
+            content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = 'attachment; filename="pins.ndjson"'
+        return response
+
+    @action(methods=['POST'], detail=False, url_path='import')
+    def import_pins(self, request):
+        """Import pins from an uploaded CSV or NDJSON file"""
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        errors = []
+
+        def on_error(line, message, row):
+            if len(errors) < self.import_max_errors:
+                errors.append({'line': line, 'error': message})
+
+        importer = PinImporter(
+            request.user,
+            batch_size=self.import_batch_size,
+            on_error=on_error
+        )
+        created, failed = importer.run(
+            serializer.validated_data['file'].file,
+            serializer.validated_data['format']
+        )
+        return Response(
+            {'created': created, 'failed': failed, 'errors': errors},
+            status=status.HTTP_200_OK
+        )
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Upload an image to a pin"""
@@ -85,6 +416,7 @@ class PinViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
             serializer.save()
+            images.schedule_variants(pin)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -94,3 +426,117 @@ class PinViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=['POST'], detail=True, url_path='image-uploads')
+    def start_image_upload(self, request, pk=None):
+        """Start a resumable upload of an image for a pin"""
+        pin = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+
+        if serializer.is_valid():
+            serializer.save(user=request.user, pin=pin)
+            return Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED
+            )
+
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path=r'image-uploads/(?P<upload_id>[0-9a-f-]+)'
+    )
+    def image_upload(self, request, pk=None, upload_id=None):
+        """Report how many bytes of an upload were received"""
+        upload = self._get_image_upload(upload_id)
+        return Response(self.get_serializer(upload).data)
+
+    @image_upload.mapping.put
+    def append_image_upload(self, request, pk=None, upload_id=None):
+        """Append the request body to an upload at the Upload-Offset"""
+        upload = self._get_image_upload(upload_id)
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', ''))
+        except ValueError:
+            return Response(
+                {'offset': [_('An integer Upload-Offset header is needed.')]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            uploads.append_part(upload, offset, request.stream or BytesIO())
+        except uploads.OffsetConflict as exc:
+            return Response(
+                {
+                    'detail': _('Upload-Offset does not match the bytes '
+                                'received.'),
+                    'offset': exc.offset,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(self.get_serializer(upload).data)
+
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path=r'image-uploads/(?P<upload_id>[0-9a-f-]+)/complete'
+    )
+    def complete_image_upload(self, request, pk=None, upload_id=None):
+        """Attach a fully received upload to the pin as its image"""
+        upload = self._get_image_upload(upload_id)
+        if upload.offset != upload.size:
+            return Response(
+                {'offset': [_('The upload is not complete.')]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        valid = uploads.complete(upload)
+        uploads.discard(upload)
+        if not valid:
+            return Response(
+                {'image': [_('Upload a valid image.')]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        images.schedule_variants(upload.pin)
+        return Response(
+            self.get_serializer(upload.pin).data,
+            status=status.HTTP_200_OK
+        )
+
+    def _get_image_upload(self, upload_id):
+        return get_object_or_404(
+            ImageUpload, pk=upload_id, pin=self.get_object()
+        )
+
+
+class PinTileView(APIView):
+    """Serve a binary map tile of the user's pins"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, z, x, y):
+        if z > tiles.MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise NotFound(_('No such tile.'))
+
+        version, data = tiles.tile_cache.get_tile(request.user, z, x, y)
+        etag = f'"{version}"'
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = HttpResponse(data, content_type=tiles.CONTENT_TYPE)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ResponseCacheStatsView(APIView):
+    """Report hit and miss counters of the response cache"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(response_cache.stats())